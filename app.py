@@ -3,28 +3,43 @@
 UAP Signal Generator Flask Application
 Interactive dashboard for customizing and generating UAP contact signals
 """
-from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, url_for
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestedRangeNotSatisfiable, RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 from functools import wraps
 import os
 import json
 import numpy as np
-from uap_signal_generator import generate_hybrid_uap_signal, apply_amplitude_modulation, apply_tremolo
+from uap_signal_generator import (
+    generate_hybrid_uap_signal, estimate_render_seconds, apply_amplitude_modulation, apply_tremolo,
+    RenderCancelled, find_ffmpeg, audio_segment_class, encode_signal, validate_output_format, DEFAULT_SAMPLE_RATE,
+    DEFAULT_CONFIG
+)
 from signal_presets import get_all_presets, get_preset
-from pydub import AudioSegment
+from render_metrics import RenderProfile, REGISTRY, record_profile
+from render_queue import RenderQueue, QueueFullError
+from music_store import MusicStore, UploadTooLargeError
+from render_cache import render_key, content_etag, RenderCache, CacheWarmer
+from youtube_ingest import YouTubeIngestor, make_extractor
+from segment_stream import SegmentedRender, StreamRegistry, SEGMENT_SECONDS, loudness_probe_ms
+from preview_session import PreviewRegistry, PreviewClosedError, PREVIEW_SECONDS, PREVIEW_MAX_SECONDS
+from expiry_reaper import ExpiryReaper
+from viz_payload import encode_base64, encode_binary, encode_json, round_floats
+from response_compression import init_app as init_compression, choose_encoding, compress_stream
+from signal_graph import validate_graph, GraphValidationError, set_render_threads
+from sliced_render import set_render_processes
 import io
 import threading
 import queue
 import uuid
-import yt_dlp
 import re
-import tempfile
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Load environment variables
 load_dotenv()
@@ -35,15 +50,50 @@ app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 10 * 1024 * 1024))
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'source_files')
 app.config['OUTPUT_FOLDER'] = os.getenv('OUTPUT_FOLDER', 'generated_signals')
+app.config['MUSIC_STORE_FOLDER'] = os.getenv('MUSIC_STORE_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'pcm'))
 app.config['COOKIES_FILE'] = 'youtube_cookies.txt'
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', os.urandom(32).hex())
 
 # Security settings
 API_KEY = os.getenv('API_KEY', '')
+# Reverse proxies in front of the app whose X-Forwarded-For is trusted (Heroku's router is one)
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 1 if os.getenv('DYNO') else 0))
 RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
 MAX_CONCURRENT_TASKS = int(os.getenv('MAX_CONCURRENT_TASKS', 3))
+MAX_QUEUED_TASKS = int(os.getenv('MAX_QUEUED_TASKS', 20))
+MAX_TASKS_PER_CLIENT = int(os.getenv('MAX_TASKS_PER_CLIENT', 3))
+MAX_QUEUED_SECONDS = float(os.getenv('MAX_QUEUED_SECONDS', 1800))
+CANCEL_ON_DISCONNECT = os.getenv('CANCEL_ON_DISCONNECT', 'true').lower() == 'true'
+SSE_DISCONNECT_GRACE = float(os.getenv('SSE_DISCONNECT_GRACE', 5))  # Seconds to wait for a reconnect
 MAX_MUSIC_FILES = int(os.getenv('MAX_MUSIC_FILES', 10))
+MUSIC_STORE_MAX_MB = float(os.getenv('MUSIC_STORE_MAX_MB', 1024))  # Decoded PCM kept on disk (0 = unlimited)
+RENDER_THREADS = int(os.getenv('RENDER_THREADS', 0))  # Step threads shared by all renders (0 = one per core)
+RENDER_PROCESSES = int(os.getenv('RENDER_PROCESSES', 0))  # Worker processes for time-sliced long renders (0 = off)
+RENDER_CACHE_MAX_MB = float(os.getenv('RENDER_CACHE_MAX_MB', 64))
+RENDER_WARMUP = os.getenv('RENDER_WARMUP', 'false').lower() == 'true'
+# Import the render modules on a background thread at boot (opt-in: it competes with the first request for CPU)
+PRELOAD_RENDER_MODULES = os.getenv('PRELOAD_RENDER_MODULES', 'false').lower() == 'true'
+RENDER_WARMUP_DURATIONS = [int(ms) for ms in os.getenv('RENDER_WARMUP_DURATIONS', '10000').split(',') if ms.strip()]
+RENDER_WARMUP_PRESETS = [name.strip() for name in os.getenv('RENDER_WARMUP_PRESETS', '').split(',') if name.strip()]
+RENDER_WARMUP_INTERVAL = float(os.getenv('RENDER_WARMUP_INTERVAL', 0))  # Seconds between warm-up passes (0 = once at boot)
+STREAM_MAX = int(os.getenv('STREAM_MAX', 32))
+STREAM_SEGMENT_CACHE_MB = float(os.getenv('STREAM_SEGMENT_CACHE_MB', 64))
+STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', 14400))  # Longest stream (or stream music track) accepted
+# Segment renders queued or running per client, counted apart from MAX_TASKS_PER_CLIENT
+STREAM_SEGMENTS_PER_CLIENT = int(os.getenv('STREAM_SEGMENTS_PER_CLIENT', 3))
+RENDER_WAIT_SECONDS = float(os.getenv('RENDER_WAIT_SECONDS', 30))  # Longest a request waits on the render queue
+PREVIEW_MAX_SESSIONS = int(os.getenv('PREVIEW_MAX_SESSIONS', 8))
+PREVIEW_IDLE_SECONDS = float(os.getenv('PREVIEW_IDLE_SECONDS', 600))
+PREVIEW_MAX_MB = float(os.getenv('PREVIEW_MAX_MB', 256))  # Memory held by preview sessions (0 = unlimited)
+YOUTUBE_WORKERS = int(os.getenv('YOUTUBE_WORKERS', 2))
+YOUTUBE_EXTRACTOR = os.getenv('YOUTUBE_EXTRACTOR', 'yt-dlp')  # or local:<dir> to ingest local files (no network)
 TASK_EXPIRATION = int(os.getenv('TASK_EXPIRATION', 3600))
+TASK_RESULTS_MAX_MB = float(os.getenv('TASK_RESULTS_MAX_MB', 256))  # MP3 data held by finished tasks (0 = unlimited)
+COMPRESS_RESPONSES = os.getenv('COMPRESS_RESPONSES', 'true').lower() == 'true'  # gzip/Brotli for JSON and SSE
+
+# Behind a proxy every request comes from the proxy's address; take the client's from X-Forwarded-For
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 # CORS Configuration
 cors_origins = os.getenv('CORS_ORIGINS', '*')
@@ -52,6 +102,10 @@ if cors_origins == '*':
 else:
     CORS(app, origins=cors_origins.split(','))
 
+# JSON, text and event streams are compressed when the client accepts gzip or Brotli
+if COMPRESS_RESPONSES:
+    init_compression(app)
+
 # Rate Limiter Configuration
 if RATE_LIMIT_ENABLED:
     limiter = Limiter(
@@ -72,12 +126,53 @@ else:
 # Store progress data for each generation task with timestamps
 generation_progress = {}
 
-# Store uploaded music files in memory (filename -> {'data': bytes, 'timestamp': datetime})
-uploaded_music_files = {}
-
-# Active task counter
-active_tasks = 0
-tasks_lock = threading.Lock()
+# All expiry and budget housekeeping runs on this one background thread (started at the end of this module)
+reaper = ExpiryReaper()
+
+# Uploaded and downloaded music, decoded once to memory-mapped PCM (shared by all worker processes);
+# the reaper evicts the oldest tracks beyond MAX_MUSIC_FILES / MUSIC_STORE_MAX_MB after each addition
+music_store = MusicStore(app.config['MUSIC_STORE_FOLDER'], max_entries=MAX_MUSIC_FILES,
+                         max_bytes=int(MUSIC_STORE_MAX_MB * 1024 * 1024), on_store=lambda: reaper.poke('music-store'))
+
+# Background YouTube ingestion, deduplicated per video ID (options are built per download, see below)
+youtube_ingestor = YouTubeIngestor(
+    music_store,
+    make_extractor(YOUTUBE_EXTRACTOR, lambda: youtube_download_options()),
+    workers=YOUTUBE_WORKERS
+)
+
+# Generation jobs wait here and run on MAX_CONCURRENT_TASKS worker threads
+render_queue = RenderQueue(
+    workers=MAX_CONCURRENT_TASKS,
+    max_queued=MAX_QUEUED_TASKS,
+    max_per_client=MAX_TASKS_PER_CLIENT,
+    max_queued_cost_s=MAX_QUEUED_SECONDS
+)
+
+# Independent layers of a render run concurrently on this many shared threads
+set_render_threads(RENDER_THREADS)
+# Long renders can also be split along the timeline across worker processes
+set_render_processes(RENDER_PROCESSES)
+
+# Finished renders by content key, so repeat requests skip rendering entirely
+render_cache = RenderCache(max_bytes=int(RENDER_CACHE_MAX_MB * 1024 * 1024))
+render_warmer = None  # CacheWarmer, when RENDER_WARMUP is enabled (started at the end of this module)
+
+# Segmented (HLS-style) streams: segments render on first request and are cached by size
+stream_registry = StreamRegistry(max_streams=STREAM_MAX, max_segment_bytes=int(STREAM_SEGMENT_CACHE_MB * 1024 * 1024))
+
+# Live preview sessions: short loops re-rendered incrementally as parameters change;
+# the reaper drops the least recently used beyond PREVIEW_MAX_MB after each render
+preview_registry = PreviewRegistry(max_sessions=PREVIEW_MAX_SESSIONS, idle_seconds=PREVIEW_IDLE_SECONDS,
+                                   max_bytes=int(PREVIEW_MAX_MB * 1024 * 1024),
+                                   on_change=lambda: reaper.poke('previews'))
+
+# Cancel events for queued/running tasks (task_id -> threading.Event), checked by the generator
+task_cancel_events = {}
+
+# Open SSE streams per task, so a task nobody is watching any more can be cancelled
+sse_subscribers = {}
+sse_lock = threading.Lock()
 
 # Ensure output directory exists
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
@@ -85,6 +180,13 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'mp3', 'mp4', 'wav', 'flac', 'm4a'}
 
+# SSE streams give up only after this multiple of the predicted render time (never below the minimum)
+SSE_MIN_TIMEOUT = 120
+SSE_TIMEOUT_FACTOR = 3
+SSE_HEARTBEAT_SECONDS = 2  # Unchanged progress is sent as a keep-alive comment this often (detects disconnects)
+FINISHED_TASK_RETENTION = 300  # Seconds a finished task stays downloadable after its SSE stream delivered the result
+BUDGET_SWEEP_INTERVAL = 60  # Seconds between budget sweeps (also run right after large additions)
+
 
 # Security Middleware
 def require_api_key(f):
@@ -118,34 +220,124 @@ def require_api_key(f):
     return decorated_function
 
 
-def cleanup_expired_tasks():
-    """Remove expired tasks and files from memory"""
-    current_time = datetime.now()
-    expiration_delta = timedelta(seconds=TASK_EXPIRATION)
+def client_identity():
+    """
+    Render queue fairness key of a request
     
-    # Cleanup expired generation tasks
-    expired_tasks = [
-        task_id for task_id, task_data in generation_progress.items()
-        if 'timestamp' in task_data and 
-        current_time - task_data['timestamp'] > expiration_delta
-    ]
+    The API key counts as the identity only once it matches API_KEY; otherwise any
+    caller could rotate header values to get around the per-client limits.
+    """
+    provided_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+    if API_KEY and provided_key == API_KEY:
+        return 'api-key'
+    return get_remote_address()
+
+
+def run_queued(client_id, cost_s, fn, background=False, timeout=None, max_per_client=None):
+    """
+    Run a render on a render queue worker and wait for its result
     
-    for task_id in expired_tasks:
-        del generation_progress[task_id]
+    Renders a request waits for (stream setup and segments) share the queue's
+    workers and admission limits with generation tasks. Background jobs
+    (cache warm-up) run only while no other job is waiting.
     
-    # Cleanup old music files if exceeding limit
-    if len(uploaded_music_files) > MAX_MUSIC_FILES:
-        # Sort by timestamp and remove oldest
-        sorted_files = sorted(
-            uploaded_music_files.items(),
-            key=lambda x: x[1].get('timestamp', datetime.min)
-        )
-        
-        files_to_remove = len(uploaded_music_files) - MAX_MUSIC_FILES
-        for filename, _ in sorted_files[:files_to_remove]:
-            del uploaded_music_files[filename]
+    Args:
+        timeout: Seconds to wait; a job still queued then is withdrawn, a running one finishes unobserved
+        max_per_client: Per-client allowance for this job's client_id (default MAX_TASKS_PER_CLIENT)
+    
+    Raises:
+        QueueFullError: If admission control rejects the job
+        TimeoutError: If the result isn't ready within ``timeout``
+    """
+    done = threading.Event()
+    outcome = {}
+    
+    def run():
+        try:
+            outcome['result'] = fn()
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+    
+    job_id = f'inline-{uuid.uuid4()}'
+    render_queue.submit(job_id, client_id, cost_s, run, background=background, max_per_client=max_per_client)
+    if not done.wait(timeout):
+        render_queue.cancel(job_id)
+        raise TimeoutError(f'Render not finished within {timeout:g} s')
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def register_task(task_id, task):
+    """Track a generation task; the reaper removes it TASK_EXPIRATION seconds later"""
+    generation_progress[task_id] = task
+    reaper.schedule(f'task:{task_id}', TASK_EXPIRATION, lambda: drop_task(task_id))
+
+
+def drop_task(task_id):
+    generation_progress.pop(task_id, None)
+    task_cancel_events.pop(task_id, None)
+
+
+def enforce_result_budget():
+    """Drop the oldest finished tasks while their results exceed TASK_RESULTS_MAX_MB (runs on the reaper)"""
+    if not TASK_RESULTS_MAX_MB:
+        return 0
+    finished = sorted(
+        (task['timestamp'], task_id, len(task['result']['mp3_data']))
+        for task_id, task in list(generation_progress.items())
+        if task.get('result') and task['result'].get('mp3_data')
+    )
+    excess = sum(size for _, _, size in finished) - TASK_RESULTS_MAX_MB * 1024 * 1024
+    dropped = 0
+    for _, task_id, size in finished:
+        if excess <= 0:
+            break
+        reaper.cancel(f'task:{task_id}')
+        drop_task(task_id)
+        excess -= size
+        dropped += 1
+    if dropped:
+        print(f"[REAPER] Dropped {dropped} finished task(s) over the {TASK_RESULTS_MAX_MB:g} MB result budget")
+    return dropped
+
+
+def cancel_task(task_id):
+    """
+    Cancel a queued or running generation task
+    
+    Queued tasks are removed from the queue immediately; running tasks are
+    signalled and stop at the generator's next checkpoint (within one block).
+    
+    Returns:
+        'cancelled', 'cancelling', or None if the task is not queued or running
+    """
+    task = generation_progress.get(task_id)
+    if not task or task['status'] not in ('queued', 'running'):
+        return None
     
-    return len(expired_tasks)
+    if render_queue.cancel(task_id):
+        task_cancel_events.pop(task_id, None)
+        task.update({'status': 'cancelled', 'queue_position': None, 'message': 'Cancelled'})
+        return 'cancelled'
+    
+    event = task_cancel_events.get(task_id)
+    if not event:
+        return None
+    event.set()
+    task['message'] = 'Cancelling...'
+    return 'cancelling'
+
+
+def cancel_if_abandoned(task_id):
+    """Cancel a task whose last SSE subscriber left and didn't come back within the grace period"""
+    with sse_lock:
+        if sse_subscribers.get(task_id):
+            return
+    if cancel_task(task_id):
+        print(f"[CANCEL] Task {task_id} abandoned by its last subscriber")
 
 
 def allowed_file(filename):
@@ -156,16 +348,30 @@ def allowed_file(filename):
 @limiter.limit("10/minute")
 def health():
     """Health check endpoint"""
-    import shutil
     # Sanitize output - don't reveal full paths
-    ffmpeg_available = bool(shutil.which('ffmpeg'))
+    ffmpeg_available = bool(find_ffmpeg())
     return jsonify({
         'status': 'ok',
         'ffmpeg': 'available' if ffmpeg_available else 'not found',
+        'queue': render_queue.stats(),
+        'youtube': youtube_ingestor.stats(),
+        'render_cache': render_cache.stats(),
+        'streams': stream_registry.stats(),
+        'previews': preview_registry.stats(),
+        'reaper': reaper.stats(),
+        'warmup': render_warmer.status() if render_warmer else {'state': 'disabled'},
         'version': '1.0.0'
     })
 
 
+@app.route('/metrics')
+@require_api_key
+@limiter.limit("30/minute")
+def metrics():
+    """Prometheus text-format render metrics (per-stage and per-preset histograms)"""
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/')
 def index():
     """Main dashboard page"""
@@ -221,25 +427,9 @@ def api_preset(preset_name):
 @limiter.limit(f"{os.getenv('RATE_LIMIT_GENERATE', 5)}/minute")
 def api_generate():
     """Initiate signal generation and return task ID"""
-    global active_tasks
-    
     try:
-        # Cleanup expired tasks first
-        cleanup_expired_tasks()
-        
-        # Check concurrent task limit
-        with tasks_lock:
-            if active_tasks >= MAX_CONCURRENT_TASKS:
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Maximum concurrent tasks ({MAX_CONCURRENT_TASKS}) reached. Please try again later.'
-                }), 429
-            active_tasks += 1
-        
         data = request.json
         if not data:
-            with tasks_lock:
-                active_tasks -= 1
             return jsonify({'status': 'error', 'message': 'No data provided'}), 400
         
         # Validate required fields
@@ -247,139 +437,249 @@ def api_generate():
         if not preset_name or len(preset_name) > 50:
             return jsonify({'status': 'error', 'message': 'Invalid preset name'}), 400
         
+        # Reject an unsupported output format or a malformed custom layer graph before starting a task
+        try:
+            validate_output_format(data.get('config') or {})
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        graph = (data.get('config') or {}).get('graph')
+        if graph is not None:
+            try:
+                validate_graph(graph)
+            except GraphValidationError as e:
+                return jsonify({'status': 'error', 'message': f'Invalid layer graph: {e}'}), 400
+        
+        # Estimated render time drives queue priority and admission
+        music_info = music_store.info(secure_filename(data.get('music_file') or '')) if data.get('use_music') else None
+        try:
+            estimated_cost = estimate_render_seconds(
+                duration_ms=int(data.get('duration', 10000)),
+                config=data.get('config') or {},
+                music_ms=music_info['duration_ms'] if music_info else None,
+                trailing_stages=('encode', 'visualize')
+            )
+        except (TypeError, ValueError, KeyError):
+            return jsonify({'status': 'error', 'message': 'Invalid generation parameters'}), 400
+        
         print(f"[GENERATE] Received request: {preset_name}")
         task_id = str(uuid.uuid4())
         print(f"[GENERATE] Created task ID: {task_id}")
         
-        # Store task info with timestamp
-        generation_progress[task_id] = {
+        # Identical earlier (or warmed-up) render: complete immediately from the cache
+        cached = render_cache.get(render_key(data.get('config') or {}, int(data.get('duration', 10000)), music_info))
+        if cached:
+            register_task(task_id, {
+                'progress': 100,
+                'message': 'Complete!',
+                'status': 'completed',
+                'queue_position': None,
+                'estimated_cost_s': 0.0,
+                'eta_s': 0.0,
+                'result': {**cached, 'filename': f"UAP_Signal_{data.get('preset_name', 'custom')}.mp3"},
+                'error': None,
+                'timestamp': datetime.now()
+            })
+            reaper.poke('task-results')
+            print(f"[GENERATE] Task {task_id} served from the render cache")
+            return jsonify({
+                'status': 'started',
+                'task_id': task_id,
+                'queue_position': None,
+                'estimated_cost_s': 0.0,
+                'cached': True
+            })
+        
+        # Store task info with timestamp (registered before queueing so a fast worker finds it)
+        register_task(task_id, {
             'progress': 0,
-            'message': 'Initializing...',
-            'status': 'running',
+            'message': 'Queued...',
+            'status': 'queued',
+            'queue_position': None,
+            'estimated_cost_s': round(estimated_cost, 1),
             'result': None,
             'error': None,
             'timestamp': datetime.now()
-        }
+        })
+        
+        client_id = client_identity()
+        task_cancel_events[task_id] = threading.Event()
+        try:
+            position = render_queue.submit(task_id, client_id, estimated_cost,
+                                           lambda: generate_signal_task(task_id, data))
+        except QueueFullError as e:
+            reaper.cancel(f'task:{task_id}')
+            drop_task(task_id)
+            return jsonify({'status': 'error', 'message': str(e)}), 429
         
-        # Start generation in background thread
-        thread = threading.Thread(target=generate_signal_task, args=(task_id, data))
-        thread.daemon = True
-        thread.start()
+        if generation_progress[task_id]['status'] == 'queued':
+            generation_progress[task_id]['queue_position'] = position
         
         return jsonify({
             'status': 'started',
-            'task_id': task_id
+            'task_id': task_id,
+            'queue_position': position,
+            'estimated_cost_s': round(estimated_cost, 1)
         })
         
     except Exception:
-        with tasks_lock:
-            active_tasks -= 1
         return jsonify({
             'status': 'error',
             'message': 'Failed to start signal generation'
         }), 500
 
 
-def generate_signal_task(task_id, data):
-    """Background task to generate signal with progress updates"""
-    global active_tasks
-    """Background task to generate signal with progress updates"""
-    try:
-        print(f"[TASK {task_id}] Starting generation task")
-        config = data.get('config', {})
-        use_music = data.get('use_music', False)
-        music_file = data.get('music_file', None)
-        
-        # Determine music file path or data
-        music_path = None
-        temp_music_file = None
-        if use_music and music_file:
-            # Check if file exists in memory
-            if music_file in uploaded_music_files:
-                # Write to temporary file for processing (generator expects file path)
-                temp_music_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(music_file)[1])
-                # Handle both old format (bytes) and new format (dict)
-                file_info = uploaded_music_files[music_file]
-                file_data = file_info if isinstance(file_info, bytes) else file_info['data']
-                temp_music_file.write(file_data)
-                temp_music_file.close()
-                music_path = temp_music_file.name
-                print(f"[TASK {task_id}] Using music file from memory: {music_file} (temp: {music_path})")
-            else:
-                print(f"[TASK {task_id}] Music file not found in memory: {music_file}")
-                music_path = None
-        
-        # Progress callback
-        def update_progress(progress, message):
-            generation_progress[task_id]['progress'] = progress
-            generation_progress[task_id]['message'] = message
-        
-        # Generate signal with progress tracking
-        signal, metadata = generate_hybrid_uap_signal(
-            music_file_path=music_path,
-            duration_ms=int(data.get('duration', 10000)),
-            config=config,
-            progress_callback=update_progress
-        )
-        
-        # Clean up temporary music file if created
-        if temp_music_file and music_path and os.path.exists(music_path):
-            try:
-                os.unlink(music_path)
-                print(f"[TASK {task_id}] Cleaned up temporary music file: {music_path}")
-            except Exception as cleanup_error:
-                print(f"[TASK {task_id}] Warning: Failed to cleanup temp file: {cleanup_error}")
-        
-        # Export to in-memory buffer instead of file
-        update_progress(97, 'Exporting to MP3...')
-        output_filename = f"UAP_Signal_{data.get('preset_name', 'custom')}.mp3"
-        
-        # Create in-memory buffer
+def render_result(data, profile, update_progress=None, cancel_event=None, log_prefix='[RENDER]'):
+    """
+    Render, encode and analyse one generation request
+    
+    Shared by queued tasks and the cache warm-up.
+    
+    Args:
+        data: Request body (config, duration, use_music, music_file, preset_name)
+        profile: RenderProfile receiving the stage spans
+        update_progress: Optional callback(progress, message)
+        cancel_event: Optional threading.Event checked between stages
+        log_prefix: Prefix for log lines
+    
+    Returns:
+        Task result dictionary (filename, metadata, visualizations, MP3 bytes, render key, ETag)
+    """
+    cancel_event = cancel_event or threading.Event()
+    update_progress = update_progress or (lambda progress, message: None)
+    
+    def check_cancelled():
+        if cancel_event.is_set():
+            raise RenderCancelled('Render cancelled')
+    
+    config = data.get('config', {})
+    use_music = data.get('use_music', False)
+    music_file = data.get('music_file', None)
+    duration_ms = int(data.get('duration', 10000))
+    
+    # Open the decoded music as a memory map (no per-task decode or temp file)
+    music_source = None
+    music_info = None
+    if use_music and music_file:
+        music_info = music_store.info(secure_filename(music_file))
+        music_source = music_store.open(secure_filename(music_file))
+        if music_source:
+            print(f"{log_prefix} Using stored music: {music_file} ({music_source.duration_ms} ms)")
+        else:
+            print(f"{log_prefix} Music file not found in store: {music_file}")
+    
+    # Generate signal with progress tracking
+    signal, metadata = generate_hybrid_uap_signal(
+        music_source=music_source,
+        duration_ms=duration_ms,
+        config=config,
+        progress_callback=update_progress,
+        profile=profile,
+        cancel_event=cancel_event
+    )
+    
+    # Export to in-memory buffer instead of file
+    output_filename = f"UAP_Signal_{data.get('preset_name', 'custom')}.mp3"
+    
+    # Create in-memory buffer
+    check_cancelled()
+    with profile.span('encode') as span:
+        update_progress(profile.progress()['progress'], 'Exporting to MP3...')
         mp3_buffer = io.BytesIO()
-        signal.export(mp3_buffer, format="mp3")
+        encode_signal(signal, mp3_buffer, 'mp3')
         mp3_buffer.seek(0)  # Reset buffer position to start
-        
-        # Get visualization data
-        update_progress(99, 'Generating visualizations...')
+        span['mp3_bytes'] = mp3_buffer.getbuffer().nbytes
+    
+    # Get visualization data
+    check_cancelled()
+    with profile.span('visualize'):
+        update_progress(profile.progress()['progress'], 'Generating visualizations...')
         waveform_data = get_waveform_data(signal, samples=1000)
         fft_data = get_fft_data(signal, bins=512)
+    
+    metadata['profile'] = profile.as_dict()
+    mp3_data = mp3_buffer.getvalue()
+    cache_key = render_key(config, duration_ms, music_info if music_source else None)
+    return {
+        'filename': output_filename,
+        'render_key': cache_key,
+        'etag': content_etag(cache_key, mp3_data),
+        'metadata': metadata,
+        'waveform': waveform_data,
+        'fft': fft_data,
+        'mp3_data': mp3_data,  # Store raw bytes
+        'duration_ms': len(signal)
+    }
+
+
+def warmup_render(data):
+    """Render one warm-up request for the render cache, as a background render queue job"""
+    def render():
+        profile = RenderProfile(trailing_stages=('encode', 'visualize'))
+        result = render_result(data, profile, log_prefix='[WARMUP]')
+        record_profile(profile, data.get('preset_name', 'custom'))
+        return result
+    
+    cost = estimate_render_seconds(duration_ms=int(data.get('duration', 10000)), config=data.get('config') or {},
+                                   trailing_stages=('encode', 'visualize'))
+    return run_queued('warmup', cost, render, background=True)
+
+
+def generate_signal_task(task_id, data):
+    """Background task to generate signal with progress updates (runs on a render queue worker)"""
+    generation_progress[task_id].update({
+        'status': 'running', 'queue_position': None, 'message': 'Initializing...'
+    })
+    profile = RenderProfile(trailing_stages=('encode', 'visualize'))
+    # Only known presets get their own metrics series, so label cardinality stays bounded
+    preset_label = data.get('preset_name') if get_preset(data.get('preset_name', '')) else 'custom'
+    # Kept on the task so SSE ticks can refresh the estimate between progress callbacks
+    generation_progress[task_id]['profile'] = profile
+    cancel_event = task_cancel_events.get(task_id) or threading.Event()
+    
+    try:
+        print(f"[TASK {task_id}] Starting generation task")
         
+        # Progress callback; ETA and sample counts come from the render profile
+        def update_progress(progress, message):
+            estimate = profile.progress()
+            estimate['progress'] = max(progress, generation_progress[task_id]['progress'])
+            estimate['message'] = message
+            generation_progress[task_id].update(estimate)
+        
+        result = render_result(data, profile, update_progress, cancel_event, log_prefix=f'[TASK {task_id}]')
+        record_profile(profile, preset_label)
+        render_cache.put(result['render_key'], result)
         print(f"[TASK {task_id}] Generation complete!")
         
         # Update task with result (store buffer instead of filename)
         generation_progress[task_id]['status'] = 'completed'
         generation_progress[task_id]['progress'] = 100
         generation_progress[task_id]['message'] = 'Complete!'
-        generation_progress[task_id]['result'] = {
-            'filename': output_filename,
-            'metadata': metadata,
-            'waveform': waveform_data,
-            'fft': fft_data,
-            'mp3_data': mp3_buffer.getvalue(),  # Store raw bytes
-            'duration_ms': len(signal)
-        }
-        
+        generation_progress[task_id]['eta_s'] = 0.0
+        generation_progress[task_id].pop('profile', None)
+        generation_progress[task_id]['result'] = result
+        reaper.poke('task-results')
+        
+    except RenderCancelled:
+        print(f"[TASK {task_id}] Cancelled")
+        record_profile(profile, preset_label, status='cancelled')
+        generation_progress[task_id].pop('profile', None)
+        generation_progress[task_id]['status'] = 'cancelled'
+        generation_progress[task_id]['message'] = 'Cancelled'
+    
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
         print(f"[TASK {task_id}] ERROR: {error_trace}")
         
-        # Clean up temporary music file if created
-        if temp_music_file and music_path and os.path.exists(music_path):
-            try:
-                os.unlink(music_path)
-                print(f"[TASK {task_id}] Cleaned up temporary music file after error: {music_path}")
-            except Exception as cleanup_error:
-                print(f"[TASK {task_id}] Warning: Failed to cleanup temp file: {cleanup_error}")
-        
+        record_profile(profile, preset_label, status='error')
+        generation_progress[task_id].pop('profile', None)
         generation_progress[task_id]['status'] = 'error'
         generation_progress[task_id]['error'] = 'Signal generation failed'
         generation_progress[task_id]['message'] = 'Error: Signal generation failed'
     
     finally:
-        # Decrement active task counter
-        with tasks_lock:
-            active_tasks -= 1
+        task_cancel_events.pop(task_id, None)
 
 
 @app.route('/api/progress/<task_id>')
@@ -391,6 +691,8 @@ def api_progress(task_id):
         uuid.UUID(task_id)
     except ValueError:
         return jsonify({'status': 'error', 'error': 'Invalid task ID format'}), 400
+    # The final event carries the visualization quantized to base64 unless plain float lists are requested
+    visualization_format = request.args.get('visualization', 'base64')
     
     def generate():
         import time
@@ -408,48 +710,158 @@ def api_progress(task_id):
             return
         
         print(f"[SSE] Connected to task {task_id}")
+        with sse_lock:
+            sse_subscribers[task_id] = sse_subscribers.get(task_id, 0) + 1
+        try:
+            yield from stream_progress()
+        finally:
+            # Runs when the stream ends or the client disconnects (the next write fails)
+            with sse_lock:
+                sse_subscribers[task_id] -= 1
+                abandoned = not sse_subscribers[task_id]
+                if abandoned:
+                    del sse_subscribers[task_id]
+            task = generation_progress.get(task_id)
+            if CANCEL_ON_DISCONNECT and abandoned and task and task['status'] in ('queued', 'running'):
+                reaper.schedule(f'abandoned:{task_id}', SSE_DISCONNECT_GRACE, lambda: cancel_if_abandoned(task_id))
+    
+    def stream_progress():
+        import time
         
-        # Send keep-alive and check status
-        max_wait = 120  # 2 minutes max
+        # The timeout scales with the task's predicted duration, which is
+        # re-estimated on every progress update; time spent queued doesn't count
         start_time = time.time()
+        last_event, last_sent = None, 0.0
         
         while task_id in generation_progress:
+            if generation_progress[task_id]['status'] == 'queued':
+                start_time = time.time()
+                position = render_queue.position(task_id)
+                if position:
+                    generation_progress[task_id]['queue_position'] = position
+                    generation_progress[task_id]['message'] = f'Queued (position {position})...'
+            
             # Check timeout
+            predicted = generation_progress[task_id].get('predicted_total_s') or 0
+            max_wait = max(SSE_MIN_TIMEOUT, SSE_TIMEOUT_FACTOR * predicted)
             if time.time() - start_time > max_wait:
                 yield f"data: {json.dumps({'status': 'error', 'error': 'Generation timeout', 'progress': 0, 'message': 'Timeout'})}\n\n"
                 break
             
             task_data = generation_progress[task_id]
             
-            # Create a copy without mp3_data (bytes) and timestamp (datetime) - not JSON serializable
+            # Create a copy without mp3_data (bytes), timestamp (datetime) and the profile - not JSON serializable
             sse_data = task_data.copy()
             sse_data.pop('timestamp', None)  # Remove timestamp from SSE
+            profile = sse_data.pop('profile', None)
+            if profile and task_data['status'] == 'running' and profile.expected:
+                # Long stages (mastering, MP3 export) report rarely; re-estimate on every tick,
+                # never letting the bar move backwards
+                estimate = profile.progress()
+                estimate['progress'] = max(task_data['progress'], estimate['progress'])
+                task_data.update(estimate)
+                sse_data.update(estimate)
             if 'result' in sse_data and sse_data['result']:
-                sse_data['result'] = sse_data['result'].copy()
-                sse_data['result'].pop('mp3_data', None)  # Remove bytes from SSE
+                sse_data['result'] = result_for_client(task_id, sse_data['result'], visualization_format)
             
-            yield f"data: {json.dumps(sse_data)}\n\n"
+            # Only changes are sent; otherwise a short comment keeps the connection checked
+            event = json.dumps(sse_data)
+            if event != last_event:
+                yield f"data: {event}\n\n"
+                last_event, last_sent = event, time.time()
+            elif time.time() - last_sent >= SSE_HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
             
-            if task_data['status'] in ['completed', 'error']:
-                # Clean up after 5 minutes to allow client to retrieve result
-                threading.Timer(300.0, lambda: generation_progress.pop(task_id, None)).start()
+            if task_data['status'] in ['completed', 'error', 'cancelled']:
+                # Keep the task for a few minutes so the client can retrieve the result
+                reaper.schedule(f'task:{task_id}', FINISHED_TASK_RETENTION, lambda: drop_task(task_id))
                 break
             
             time.sleep(0.5)  # Update every 500ms
     
     try:
-        return Response(stream_with_context(generate()), 
-                       mimetype='text/event-stream',
-                       headers={
-                           'Cache-Control': 'no-cache',
-                           'X-Accel-Buffering': 'no',
-                           'Connection': 'keep-alive'
-                       })
+        headers = {
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Connection': 'keep-alive'
+        }
+        events = generate()
+        encoding = choose_encoding(request.headers.get('Accept-Encoding')) if COMPRESS_RESPONSES else None
+        if encoding:
+            events = compress_stream(events, encoding)
+            headers.update({'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+        return Response(stream_with_context(events), mimetype='text/event-stream', headers=headers)
     except Exception as e:
         print(f"SSE error: {str(e)}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
 
+def result_for_client(task_id, result, visualization_format='base64'):
+    """
+    Task result as sent to clients: no MP3 bytes, visualization data in the requested encoding
+    
+    Args:
+        visualization_format: 'base64' (quantized, see viz_payload) or 'json' (rounded float lists)
+    """
+    client_result = {key: value for key, value in result.items() if key not in ('mp3_data', 'waveform', 'fft')}
+    if visualization_format == 'json':
+        client_result.update(encode_json(result))
+    else:
+        client_result['visualization'] = encode_base64(result)
+    client_result['visualization_url'] = url_for('api_visualization', task_id=task_id)
+    return client_result
+
+
+@app.route('/api/visualization/<task_id>')
+@limiter.limit("120/minute")
+def api_visualization(task_id):
+    """Visualization data of a finished task: binary (default), base64 or json via ?format="""
+    try:
+        uuid.UUID(task_id)
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'Invalid task ID format'}), 400
+    task = generation_progress.get(task_id)
+    if not task or not task.get('result'):
+        return jsonify({'status': 'error', 'error': 'Task not found or expired'}), 404
+    
+    result = task['result']
+    output_format = request.args.get('format', 'binary')
+    if output_format == 'binary':
+        response = Response(encode_binary(result), mimetype='application/octet-stream')
+    elif output_format == 'base64':
+        response = jsonify(encode_base64(result))
+    elif output_format == 'json':
+        response = jsonify({**encode_json(result), 'duration_ms': result.get('duration_ms')})
+    else:
+        return jsonify({'status': 'error', 'error': 'Unknown format'}), 400
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+@app.route('/api/cancel/<task_id>', methods=['POST'])
+@require_api_key
+@limiter.limit("30/minute")
+def api_cancel(task_id):
+    """Cancel a queued or running generation task"""
+    try:
+        uuid.UUID(task_id)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid task ID format'}), 400
+    
+    task = generation_progress.get(task_id)
+    if not task:
+        return jsonify({'status': 'error', 'message': 'Task not found or expired'}), 404
+    
+    outcome = cancel_task(task_id)
+    if not outcome:
+        return jsonify({'status': 'error', 'message': f"Task is {task['status']} and can no longer be cancelled"}), 409
+    
+    print(f"[CANCEL] Task {task_id}: {outcome}")
+    # A running task stops at its next checkpoint; follow /api/progress for the final 'cancelled' status
+    return jsonify({'status': outcome, 'task_id': task_id}), 200 if outcome == 'cancelled' else 202
+
+
 @app.route('/api/download/<task_id>')
 @limiter.limit("30/minute")
 def api_download(task_id):
@@ -472,82 +884,378 @@ def api_download(task_id):
         if not task.get('result') or 'mp3_data' not in task['result']:
             return jsonify({'error': 'File data not available'}), 404
         
-        # Create BytesIO from stored data
+        # The BytesIO shares the stored bytes rather than copying them
         mp3_buffer = io.BytesIO(task['result']['mp3_data'])
-        mp3_buffer.seek(0)
         
         filename = task['result'].get('filename', 'UAP_Signal.mp3')
         
-        return send_file(
+        # conditional=True answers Range requests with 206 (so players can seek and
+        # downloads resume) and If-None-Match / If-Range against the strong ETag with 304
+        response = send_file(
             mp3_buffer,
             mimetype='audio/mpeg',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            conditional=True,
+            etag=task['result'].get('etag', False)
         )
+        # Results are per task and expire, so clients must revalidate rather than reuse blindly
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    except RequestedRangeNotSatisfiable:
+        length = len(generation_progress[task_id]['result']['mp3_data'])
+        return jsonify({'error': 'Requested range not satisfiable'}), 416, {'Content-Range': f'bytes */{length}'}
     
     except Exception:
         return jsonify({'error': 'Failed to download file'}), 500
 
 
+@app.route('/api/stream', methods=['POST'])
+@require_api_key
+@limiter.limit(f"{os.getenv('RATE_LIMIT_STREAM', 10)}/minute")
+def api_stream():
+    """Publish a render as an HLS-style playlist whose segments render on demand"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'status': 'error', 'message': 'No data provided'}), 400
+        
+        config = data.get('config') or {}
+        if config.get('graph') is not None:
+            try:
+                validate_graph(config['graph'])
+            except GraphValidationError as e:
+                return jsonify({'status': 'error', 'message': f'Invalid layer graph: {e}'}), 400
+        
+        music_info = music_source = None
+        if data.get('use_music') and data.get('music_file'):
+            music_name = secure_filename(data['music_file'])
+            music_info = music_store.info(music_name)
+            music_source = music_store.open(music_name)
+            if not music_source:
+                return jsonify({'status': 'error', 'message': 'Music file not found'}), 404
+        
+        try:
+            duration_ms = int(data.get('duration', 10000))
+            if duration_ms <= 0 and not music_source:
+                raise ValueError('duration')
+            stream_id = render_key(config, duration_ms, music_info, output_format=f'hls-packed-{SEGMENT_SECONDS}s')
+            length_ms = music_source.duration_ms if music_source else duration_ms
+            cost = stream_setup_cost(config, length_ms)
+        except (TypeError, ValueError, KeyError):
+            return jsonify({'status': 'error', 'message': 'Invalid stream parameters'}), 400
+        
+        if length_ms > STREAM_MAX_SECONDS * 1000:
+            return jsonify({'status': 'error',
+                            'message': f'Streams are limited to {STREAM_MAX_SECONDS:g} seconds'}), 400
+        
+        stream = stream_registry.get(stream_id)
+        if not stream:
+            # Setup resamples and scans the whole music track and measures loudness, so it waits its turn
+            # like a render (and registers the stream itself, so a retry after a timeout finds it)
+            try:
+                stream = run_queued(
+                    client_identity(), cost,
+                    lambda: stream_registry.add(SegmentedRender(stream_id, config, duration_ms, music_source)),
+                    timeout=RENDER_WAIT_SECONDS
+                )
+            except QueueFullError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 429
+            except TimeoutError:
+                return render_queue_busy({'status': 'error', 'message': 'Stream setup is queued, try again shortly'})
+            except (TypeError, ValueError, KeyError):
+                return jsonify({'status': 'error', 'message': 'Invalid stream parameters'}), 400
+        
+        print(f"[STREAM] {stream_id[:12]}: {stream.segment_count} segments ({stream.duration_s:.0f} s)")
+        return jsonify({
+            'status': 'success',
+            'stream_id': stream_id,
+            'playlist_url': url_for('api_stream_playlist', stream_id=stream_id),
+            'segments': stream.segment_count,
+            'segment_seconds': round(stream.segment_frames / stream.sample_rate, 6),
+            'duration_ms': int(stream.duration_s * 1000)
+        })
+    
+    except Exception:
+        return jsonify({'status': 'error', 'message': 'Failed to create stream'}), 500
+
+
+def stream_job_cost(config):
+    """Estimated seconds of one segment render, for queue admission"""
+    return estimate_render_seconds(duration_ms=SEGMENT_SECONDS * 1000, config=config, trailing_stages=('encode',))
+
+
+def stream_setup_cost(config, length_ms):
+    """Estimated seconds of a stream's setup: about one segment for the track scan, plus the loudness probe"""
+    cost = stream_job_cost(config)
+    if {**DEFAULT_CONFIG, **config}.get('mastering'):
+        cost += estimate_render_seconds(duration_ms=loudness_probe_ms(length_ms), config=config)
+    return cost
+
+
+def render_queue_busy(body):
+    """503 answer for a request that gave up waiting on the render queue, with a Retry-After estimate"""
+    stats = render_queue.stats()
+    response = jsonify(body)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(np.ceil(stats['queued_cost_s'] / max(1, stats['workers'])))))
+    return response
+
+
+def find_stream(stream_id):
+    """Registered stream for a well-formed stream ID, or None"""
+    if not re.fullmatch(r'[0-9a-f]{64}', stream_id):
+        return None
+    return stream_registry.get(stream_id)
+
+
+@app.route('/api/stream/<stream_id>/playlist.m3u8')
+@limiter.limit("60/minute")
+def api_stream_playlist(stream_id):
+    """HLS media playlist of a stream (segment URLs are relative)"""
+    stream = find_stream(stream_id)
+    if not stream:
+        return jsonify({'error': 'Stream not found or expired'}), 404
+    response = Response(stream.playlist(lambda index: f'segment/{index}.mp3'),
+                        mimetype='application/vnd.apple.mpegurl')
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/stream/<stream_id>/segment/<int:index>.mp3')
+@limiter.limit("240/minute")
+def api_stream_segment(stream_id, index):
+    """One segment of a stream (MP3 packed audio), rendered on first request"""
+    stream = find_stream(stream_id)
+    if not stream:
+        return jsonify({'error': 'Stream not found or expired'}), 404
+    # Segments have their own per-client allowance, so a player prefetching while the same client renders isn't refused
+    client_id, cost = f'{client_identity()}/segments', stream_job_cost(stream.config)
+    try:
+        data = stream_registry.segment(stream, index, run=lambda render: run_queued(
+            client_id, cost, render, timeout=RENDER_WAIT_SECONDS, max_per_client=STREAM_SEGMENTS_PER_CLIENT
+        ), timeout=RENDER_WAIT_SECONDS)
+    except IndexError:
+        return jsonify({'error': 'Segment not found'}), 404
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429
+    except TimeoutError:
+        return render_queue_busy({'error': 'Segment render is queued, try again shortly'})
+    except Exception as e:
+        print(f"[STREAM] Segment {index} of {stream_id[:12]} failed: {e}")
+        return jsonify({'error': 'Failed to render segment'}), 500
+    
+    response = send_file(io.BytesIO(data), mimetype='audio/mpeg', conditional=True,
+                         etag=content_etag(stream_id, data))
+    # A re-render after eviction is identical (same noise seed), so segments can be reused for a while
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+def preview_job_cost(config, seconds):
+    """Estimated seconds of a full preview render (every step synthesized), for queue admission"""
+    return estimate_render_seconds(duration_ms=min(max(seconds, 1.0), PREVIEW_MAX_SECONDS) * 1000, config=config)
+
+
+def preview_response(session, summary):
+    """JSON body describing a preview version"""
+    return jsonify({
+        'status': 'success',
+        'session_id': session.session_id,
+        'audio_url': url_for('api_preview_audio', session_id=session.session_id, v=summary['version']),
+        **summary
+    })
+
+
+@app.route('/api/preview', methods=['POST'])
+@require_api_key
+@limiter.limit(f"{os.getenv('RATE_LIMIT_STREAM', 10)}/minute")
+def api_preview():
+    """Start a live preview session: a short loop of the design, re-rendered incrementally on change"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'status': 'error', 'message': 'No data provided'}), 400
+
+        music_source = None
+        if data.get('use_music') and data.get('music_file'):
+            music_source = music_store.open(secure_filename(data['music_file']))
+            if not music_source:
+                return jsonify({'status': 'error', 'message': 'Music file not found'}), 404
+
+        try:
+            config, seconds = data.get('config') or {}, float(data.get('seconds', PREVIEW_SECONDS))
+            cost = preview_job_cost(config, seconds)
+            # The first render synthesizes every step, so it waits its turn on the render queue
+            session = preview_registry.create(config, music_source, seconds, run=lambda render: run_queued(
+                client_identity(), cost, render, timeout=RENDER_WAIT_SECONDS
+            ))
+        except GraphValidationError as e:
+            return jsonify({'status': 'error', 'message': f'Invalid layer graph: {e}'}), 400
+        except (TypeError, ValueError, KeyError):
+            return jsonify({'status': 'error', 'message': 'Invalid preview parameters'}), 400
+        except QueueFullError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 429
+        except TimeoutError:
+            return render_queue_busy({'status': 'error', 'message': 'Preview render is queued, try again shortly'})
+
+        print(f"[PREVIEW] {session.session_id[:12]}: started ({session.last_update['render_ms']} ms)")
+        return preview_response(session, session.last_update)
+
+    except Exception:
+        return jsonify({'status': 'error', 'message': 'Failed to start preview'}), 500
+
+
+def find_preview(session_id):
+    """Live preview session for a well-formed session ID, or None"""
+    if not re.fullmatch(r'[0-9a-f]{32}', session_id):
+        return None
+    return preview_registry.get(session_id)
+
+
+@app.route('/api/preview/<session_id>', methods=['POST'])
+@require_api_key
+@limiter.limit(f"{os.getenv('RATE_LIMIT_PREVIEW', 600)}/minute")
+def api_preview_update(session_id):
+    """Apply configuration changes to a preview, re-rendering only the layers they affect"""
+    session = find_preview(session_id)
+    if not session:
+        return jsonify({'status': 'error', 'message': 'Preview not found or expired'}), 404
+    data = request.json
+    if not data or not isinstance(data.get('config'), dict):
+        return jsonify({'status': 'error', 'message': 'No configuration changes provided'}), 400
+
+    try:
+        # Updates that synthesize steps run on the render queue; re-mixes of cached steps run here
+        cost = preview_job_cost({**session.config, **data['config']}, session.seconds)
+        summary = preview_registry.update(session, data['config'], run=lambda render: run_queued(
+            client_identity(), cost, render, timeout=RENDER_WAIT_SECONDS
+        ))
+    except PreviewClosedError:
+        return jsonify({'status': 'error', 'message': 'Preview not found or expired'}), 404
+    except GraphValidationError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid layer graph: {e}'}), 400
+    except (TypeError, ValueError, KeyError):
+        return jsonify({'status': 'error', 'message': 'Invalid preview parameters'}), 400
+    except QueueFullError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 429
+    except TimeoutError:
+        return render_queue_busy({'status': 'error', 'message': 'Preview render is queued, try again shortly'})
+    except Exception as e:
+        print(f"[PREVIEW] Update of {session_id[:12]} failed: {e}")
+        return jsonify({'status': 'error', 'message': 'Failed to update preview'}), 500
+    return preview_response(session, summary)
+
+
+@app.route('/api/preview/<session_id>/audio.wav')
+@limiter.limit(f"{os.getenv('RATE_LIMIT_PREVIEW', 600)}/minute")
+def api_preview_audio(session_id):
+    """Current loop of a preview as WAV"""
+    session = find_preview(session_id)
+    if not session:
+        return jsonify({'error': 'Preview not found or expired'}), 404
+    data, version = session.audio, session.version
+    response = send_file(io.BytesIO(data), mimetype='audio/wav', conditional=True,
+                         etag=f'{session_id}-{version}')
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/preview/<session_id>/events')
+@limiter.limit("60/minute")
+def api_preview_events(session_id):
+    """Server-Sent Events announcing each new preview version as soon as it is rendered"""
+    session = find_preview(session_id)
+    if not session:
+        return jsonify({'status': 'error', 'error': 'Preview not found or expired'}), 404
+
+    def generate():
+        version = 0
+        while not session.closed:
+            summary = session.wait_for_version(version, timeout=15)
+            if summary is None:
+                yield ": keepalive\n\n"  # Also detects clients that went away
+                continue
+            version = summary['version']
+            audio_url = url_for('api_preview_audio', session_id=session_id, v=version)
+            yield f"data: {json.dumps({**summary, 'audio_url': audio_url})}\n\n"
+        yield f"data: {json.dumps({'status': 'closed'})}\n\n"
+
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no',
+                        'Connection': 'keep-alive'
+                    })
+
+
 @app.route('/api/upload_music', methods=['POST'])
 @require_api_key
 @limiter.limit(f"{os.getenv('RATE_LIMIT_UPLOAD', 10)}/minute")
 def api_upload_music():
-    """Upload music file for signal modulation (stored in memory)"""
+    """Upload music file for signal modulation (streamed, hashed and decoded as it arrives)"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'status': 'error', 'message': 'No file provided'}), 400
-        
-        file = request.files['file']
-        
-        if file.filename == '':
+        # A client that sends the file's SHA-256 learns before uploading that the track is already stored
+        sha256 = (request.args.get('sha256') or '').lower()
+        if re.fullmatch(r'[0-9a-f]{64}', sha256):
+            existing = music_store.find(sha256)
+            if existing:
+                return upload_response({**existing, 'duplicate': True})
+        
+        # Raw request bodies stream straight from the connection; multipart files arrive spooled by Werkzeug
+        if request.mimetype == 'multipart/form-data':
+            if 'file' not in request.files:
+                return jsonify({'status': 'error', 'message': 'No file provided'}), 400
+            file = request.files['file']
+            original_name, stream = file.filename, file.stream
+        else:
+            original_name, stream = request.args.get('filename', ''), request.stream
+        
+        if not original_name:
             return jsonify({'status': 'error', 'message': 'No file selected'}), 400
         
-        if not file or not allowed_file(file.filename):
+        if not allowed_file(original_name):
             return jsonify({'status': 'error', 'message': 'Invalid file type. Allowed: mp3, wav, ogg, flac, m4a'}), 400
         
-        filename = secure_filename(file.filename)
+        filename = secure_filename(original_name)
         
         # Validate filename
         if not filename or len(filename) > 255:
             return jsonify({'status': 'error', 'message': 'Invalid filename'}), 400
         
-        # Read file into memory
-        file_data = file.read()
-        
-        # Check file size (already enforced by MAX_CONTENT_LENGTH, but double-check)
-        file_size_mb = len(file_data) / (1024 * 1024)
-        if file_size_mb > 10:
+        # Stored at the default render rate in stereo, like YouTube downloads, so renders use the memory map as is;
+        # the store evicts its oldest tracks beyond MAX_MUSIC_FILES
+        max_bytes = app.config['MAX_CONTENT_LENGTH']
+        try:
+            track = music_store.add_stream(filename, stream, DEFAULT_SAMPLE_RATE, 2, source='upload', max_bytes=max_bytes)
+        except UploadTooLargeError:
             return jsonify({
-                'status': 'error', 
-                'message': f'File too large ({file_size_mb:.1f}MB). Maximum size is 10MB.'
-            }), 400
-        
-        # Cleanup old files if needed
-        cleanup_expired_tasks()
-        
-        # Store in memory with timestamp
-        uploaded_music_files[filename] = {
-            'data': file_data,
-            'timestamp': datetime.now()
-        }
+                'status': 'error',
+                'message': f'File too large. Maximum size is {max_bytes / (1024 * 1024):.0f}MB.'
+            }), 413
         
-        # Get file info by loading from memory
-        audio = AudioSegment.from_file(io.BytesIO(file_data))
-        duration_ms = len(audio)
-        
-        return jsonify({
-            'status': 'success',
-            'filename': filename,
-            'duration_ms': duration_ms,
-            'duration_seconds': duration_ms / 1000,
-            'size_mb': round(file_size_mb, 2)
-        })
+        return upload_response(track)
     
+    except RequestEntityTooLarge:
+        raise
     except Exception:
         return jsonify({'status': 'error', 'message': 'Failed to process uploaded file'}), 500
 
 
+def upload_response(track):
+    """JSON body describing a stored upload"""
+    return jsonify({
+        'status': 'success',
+        'filename': track['name'],
+        'duration_ms': track['duration_ms'],
+        'duration_seconds': track['duration_ms'] / 1000,
+        'size_mb': round(track.get('encoded_bytes', track['pcm_bytes']) / (1024 * 1024), 2),
+        'duplicate': bool(track.get('duplicate'))
+    })
+
+
 @app.route('/api/upload_cookies', methods=['POST'])
 @require_api_key
 @limiter.limit("5/minute")
@@ -609,7 +1317,7 @@ def api_check_cookies():
 @require_api_key
 @limiter.limit(f"{os.getenv('RATE_LIMIT_YOUTUBE', 3)}/minute")
 def api_download_youtube():
-    """Download audio from YouTube URL"""
+    """Start (or join) a background download of a YouTube video's audio"""
     try:
         data = request.json
         youtube_url = data.get('url', '').strip()
@@ -631,91 +1339,33 @@ def api_download_youtube():
         video_id = extract_video_id(youtube_url)
         if not video_id or len(video_id) != 11:
             return jsonify({'status': 'error', 'message': 'Invalid YouTube video ID'}), 400
-            
+        
+        # Store key kept from the MP3 era so existing tracks stay cached; the audio itself is stored as PCM
         output_filename = f"youtube_{video_id}.mp3"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
         
-        # Check if already downloaded
-        if os.path.exists(output_path):
-            audio = AudioSegment.from_file(output_path)
+        # Check if already downloaded (and decoded)
+        track = music_store.info(output_filename)
+        if track:
             return jsonify({
                 'status': 'success',
                 'filename': output_filename,
-                'duration_ms': len(audio),
-                'duration_seconds': len(audio) / 1000,
+                'title': track.get('title'),
+                'duration_ms': track['duration_ms'],
+                'duration_seconds': track['duration_ms'] / 1000,
                 'cached': True
             })
         
-        # Download audio using yt-dlp
-        import shutil
-        import platform
-        
-        # Detect if running on Heroku
-        is_heroku = os.environ.get('DYNO') is not None
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': os.path.join(app.config['UPLOAD_FOLDER'], f'youtube_{video_id}.%(ext)s'),
-            'quiet': False,  # Enable output for debugging
-            'no_warnings': False,
-            # Use web client when we have cookies
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['web'],
-                    'skip': ['hls', 'dash'],
-                }
-            },
-        }
-        
-        # Check for uploaded cookie file first (works on both local and Heroku)
-        cookies_path = app.config['COOKIES_FILE']
-        
-        # Check for cookies from Heroku environment variable
-        heroku_cookies = os.environ.get('YOUTUBE_COOKIES')
-        if heroku_cookies and is_heroku:
-            # Write environment variable cookies to temp file with proper format
-            with open(cookies_path, 'w', encoding='utf-8', newline='\n') as f:
-                f.write(heroku_cookies)
-            ydl_opts['cookiefile'] = cookies_path
-            print(f"Using cookies from YOUTUBE_COOKIES environment variable")
-        elif os.path.exists(cookies_path):
-            ydl_opts['cookiefile'] = cookies_path
-            print(f"Using cookie file: {cookies_path}")
-        # Fallback to browser cookies if local and no cookie file
-        elif not is_heroku:
-            try:
-                ydl_opts['cookiesfrombrowser'] = ('chrome',)
-                print("Using Chrome browser cookies")
-            except:
-                print("No cookies available - may encounter bot detection")
-                pass
-        
-        # Add ffmpeg location if not in PATH
-        ffmpeg_path = shutil.which('ffmpeg')
-        if not ffmpeg_path and os.path.exists('C:\\Users\\Duncan\\FFmpeg\\bin'):
-            ydl_opts['ffmpeg_location'] = 'C:\\Users\\Duncan\\FFmpeg\\bin'
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(youtube_url, download=True)
-            title = info.get('title', 'Unknown')
-        
-        # Get audio duration
-        audio = AudioSegment.from_file(output_path)
-        duration_ms = len(audio)
+        job, deduplicated = youtube_ingestor.submit(video_id, youtube_url, output_filename)
+        print(f"[YOUTUBE] {'Joined' if deduplicated else 'Started'} ingestion job {job.job_id} for {video_id}")
         
+        # Follow /api/youtube_progress/<job_id> for download progress and the final track
         return jsonify({
-            'status': 'success',
+            'status': 'started',
+            'job_id': job.job_id,
+            'video_id': video_id,
             'filename': output_filename,
-            'title': title,
-            'duration_ms': duration_ms,
-            'duration_seconds': duration_ms / 1000,
-            'cached': False
-        })
+            'deduplicated': deduplicated
+        }), 202
         
     except Exception as e:
         import traceback
@@ -727,6 +1377,87 @@ def api_download_youtube():
         }), 500
 
 
+@app.route('/api/youtube_progress/<job_id>')
+@limiter.limit("120/minute")
+def api_youtube_progress(job_id):
+    """Stream YouTube ingestion progress via Server-Sent Events"""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'Invalid job ID format'}), 400
+    
+    job = youtube_ingestor.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'error': 'Job not found or expired'}), 404
+    
+    def generate():
+        # Downloads have no reliable size up front, so the stream only ends with the job
+        while True:
+            snapshot = job.snapshot()
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot['status'] in ('completed', 'error'):
+                break
+            time.sleep(0.5)
+    
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no',
+                        'Connection': 'keep-alive'
+                    })
+
+
+def youtube_download_options():
+    """yt-dlp options for one download: cookies and extractor settings (format and output are set by the extractor)"""
+    import shutil
+    
+    # Detect if running on Heroku
+    is_heroku = os.environ.get('DYNO') is not None
+    
+    ydl_opts = {
+        'quiet': False,  # Enable output for debugging
+        'no_warnings': False,
+        # Use web client when we have cookies
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['web'],
+                'skip': ['hls', 'dash'],
+            }
+        },
+    }
+    
+    # Check for uploaded cookie file first (works on both local and Heroku)
+    cookies_path = app.config['COOKIES_FILE']
+    
+    # Check for cookies from Heroku environment variable
+    heroku_cookies = os.environ.get('YOUTUBE_COOKIES')
+    if heroku_cookies and is_heroku:
+        # Write environment variable cookies to temp file with proper format
+        with open(cookies_path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(heroku_cookies)
+        ydl_opts['cookiefile'] = cookies_path
+        print(f"Using cookies from YOUTUBE_COOKIES environment variable")
+    elif os.path.exists(cookies_path):
+        ydl_opts['cookiefile'] = cookies_path
+        print(f"Using cookie file: {cookies_path}")
+    # Fallback to browser cookies if local and no cookie file
+    elif not is_heroku:
+        try:
+            ydl_opts['cookiesfrombrowser'] = ('chrome',)
+            print("Using Chrome browser cookies")
+        except:
+            print("No cookies available - may encounter bot detection")
+            pass
+    
+    # Add ffmpeg location if not in PATH
+    ffmpeg_path = shutil.which('ffmpeg')
+    if not ffmpeg_path and os.path.exists('C:\\Users\\Duncan\\FFmpeg\\bin'):
+        ydl_opts['ffmpeg_location'] = 'C:\\Users\\Duncan\\FFmpeg\\bin'
+    
+    return ydl_opts
+
+
 def extract_video_id(url):
     """Extract video ID from YouTube URL"""
     patterns = [
@@ -746,23 +1477,16 @@ def extract_video_id(url):
 @app.route('/api/list_music')
 @limiter.limit("30/minute")
 def api_list_music():
-    """List available music files from memory"""
+    """List available music files from the music store (metadata only, nothing is decoded)"""
     files = []
     
-    for filename, file_info in uploaded_music_files.items():
-        try:
-            # Handle both old format (bytes) and new format (dict)
-            file_data = file_info if isinstance(file_info, bytes) else file_info['data']
-            audio = AudioSegment.from_file(io.BytesIO(file_data))
-            files.append({
-                'filename': filename,
-                'duration_ms': len(audio),
-                'duration_seconds': len(audio) / 1000,
-                'size_mb': round(len(file_data) / (1024 * 1024), 2)
-            })
-        except Exception as e:
-            print(f"Error reading music file {filename}: {e}")
-            continue
+    for track in music_store.list():
+        files.append({
+            'filename': track['name'],
+            'duration_ms': track['duration_ms'],
+            'duration_seconds': track['duration_ms'] / 1000,
+            'size_mb': round(track.get('encoded_bytes', track['pcm_bytes']) / (1024 * 1024), 2)
+        })
     
     return jsonify({'files': files})
 
@@ -770,7 +1494,10 @@ def api_list_music():
 @app.route('/api/waveform/<filename>')
 @limiter.limit("30/minute")
 def api_waveform(filename):
-    """Get waveform data for visualization"""
+    """Get waveform data for visualization (rounded float list, or ?format=base64|binary)"""
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'base64', 'binary'):
+        return jsonify({'error': 'Unknown format'}), 400
     # Sanitize filename
     safe_filename = secure_filename(filename)
     if not safe_filename or safe_filename != filename:
@@ -782,12 +1509,16 @@ def api_waveform(filename):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        audio = AudioSegment.from_file(file_path)
-        waveform_data = get_waveform_data(audio, samples=2000)
+        audio = audio_segment_class().from_file(file_path)
+        waveform_data = {'waveform': get_waveform_data(audio, samples=2000), 'duration_ms': len(audio)}
         
+        if output_format == 'binary':
+            return Response(encode_binary(waveform_data), mimetype='application/octet-stream')
+        if output_format == 'base64':
+            return jsonify({'status': 'success', 'visualization': encode_base64(waveform_data)})
         return jsonify({
             'status': 'success',
-            'waveform': waveform_data,
+            'waveform': round_floats(waveform_data['waveform']),
             'duration_ms': len(audio)
         })
     except Exception:
@@ -864,6 +1595,12 @@ def request_entity_too_large(error):
     return jsonify({'status': 'error', 'message': 'File too large. Maximum size is 10MB.'}), 413
 
 
+@app.errorhandler(429)
+def rate_limit_exceeded(error):
+    """Handle rate limit errors (otherwise the catch-all below would turn them into 500s)"""
+    return jsonify({'status': 'error', 'message': f'Rate limit exceeded: {error.description}'}), 429
+
+
 @app.errorhandler(500)
 def internal_error(error):
     """Handle internal server errors"""
@@ -885,6 +1622,55 @@ def handle_exception(error):
     return 'An unexpected error occurred', 500
 
 
+def start_render_warmup():
+    """Start the opt-in background warm-up of preset renders (each worker process warms its own cache)"""
+    global render_warmer
+    presets = get_all_presets()
+    names = [name for name in (RENDER_WARMUP_PRESETS or presets) if name in presets]
+    jobs = []
+    for name in names:
+        for duration_ms in RENDER_WARMUP_DURATIONS:
+            data = {'preset_name': name, 'config': presets[name]['config'], 'duration': duration_ms}
+            jobs.append((render_key(data['config'], duration_ms), data))
+    # Warm-up renders yield to user work: a pass is put off while any user render is waiting
+    render_warmer = CacheWarmer(render_cache, jobs, warmup_render, interval_s=RENDER_WARMUP_INTERVAL,
+                                busy=lambda: render_queue.waiting() > 0)
+    render_warmer.start()
+    print(f"[WARMUP] Warming {len(jobs)} renders ({len(names)} presets x {len(RENDER_WARMUP_DURATIONS)} durations)")
+
+
+def preload_render_modules():
+    """
+    Import the render path's heavy dependencies (scipy, pydub, FFmpeg discovery)
+    
+    They are imported lazily so the app answers its first request quickly.
+    With PRELOAD_RENDER_MODULES this loads them on a background thread right
+    after boot instead, for deployments that rather pay it before the first render.
+    """
+    started = time.perf_counter()
+    import scipy.signal  # noqa: F401
+    import scipy.ndimage  # noqa: F401
+    import scipy.fft  # noqa: F401
+    audio_segment_class()
+    print(f"[STARTUP] Render modules preloaded in {time.perf_counter() - started:.2f}s")
+
+
+def start_reaper():
+    """Start the background reaper with the recurring budget sweeps"""
+    reaper.every('task-results', BUDGET_SWEEP_INTERVAL, enforce_result_budget)
+    reaper.every('music-store', BUDGET_SWEEP_INTERVAL, music_store.evict)
+    reaper.every('previews', BUDGET_SWEEP_INTERVAL, preview_registry.expire)
+    reaper.start()
+
+
+start_reaper()
+
+if RENDER_WARMUP:
+    start_render_warmup()
+elif PRELOAD_RENDER_MODULES:
+    threading.Thread(target=preload_render_modules, name='preload-render-modules', daemon=True).start()
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
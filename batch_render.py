@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Batch Renderer
+Headless, parallel catalog rendering without the Flask API
+
+Renders every combination of designs (presets from ``signal_presets.py``
+and/or JSON config files), music sources (a directory or a manifest, or
+none) and durations across a process pool. Each output file name carries
+the render's content key, so an interrupted or repeated run skips outputs
+that already exist and only renders what is missing.
+
+Usage:
+    python batch_render.py                                   # every preset, 10 s, no music
+    python batch_render.py --preset original_uap --duration 60000 --jobs 4
+    python batch_render.py --config designs/*.json --music-dir music/ --output-dir catalog/
+    python batch_render.py --preset all --manifest tracks.txt --format wav --summary summary.json
+
+Config files hold either a preset-shaped object (``{"name": ..., "config": {...}}``),
+a bare config dictionary, or a list of either. Manifests list one music file
+per line (relative to the manifest; ``#`` starts a comment) or a JSON list.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from render_cache import render_key
+from signal_presets import get_all_presets
+
+MUSIC_EXTENSIONS = ('.mp3', '.mp4', '.wav', '.flac', '.m4a')
+OUTPUT_FORMATS = ('mp3', 'wav')
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_sha256(path):
+    """Content hash of a music file, so renames don't trigger re-renders"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_designs(preset_names, config_paths):
+    """
+    Collect (name, config) pairs from presets and config files
+
+    Args:
+        preset_names: Preset names, or ['all']
+        config_paths: JSON config file paths (globs are expanded)
+
+    Returns:
+        List of (name, config dict)
+    """
+    presets = get_all_presets()
+    designs = []
+    for name in preset_names:
+        names = list(presets) if name == 'all' else [name]
+        for preset_name in names:
+            if preset_name not in presets:
+                raise ValueError(f"Unknown preset '{preset_name}' (available: {', '.join(presets)})")
+            designs.append((preset_name, presets[preset_name]['config']))
+
+    for pattern in config_paths:
+        paths = sorted(glob.glob(pattern)) or [pattern]
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            entries = content if isinstance(content, list) else [content]
+            for index, entry in enumerate(entries):
+                if not isinstance(entry, dict):
+                    raise ValueError(f'{path}: entries must be JSON objects')
+                default_name = stem if len(entries) == 1 else f'{stem}_{index + 1}'
+                if isinstance(entry.get('config'), dict):
+                    designs.append((str(entry.get('name') or default_name), entry['config']))
+                else:
+                    designs.append((default_name, entry))
+    return designs
+
+
+def load_music(music_dir=None, manifest=None):
+    """Music file paths from a directory and/or a manifest"""
+    paths = []
+    if music_dir:
+        for filename in sorted(os.listdir(music_dir)):
+            if filename.lower().endswith(MUSIC_EXTENSIONS):
+                paths.append(os.path.join(music_dir, filename))
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as f:
+            text = f.read()
+        if manifest.lower().endswith('.json'):
+            entries = json.loads(text)
+        else:
+            entries = [line.split('#', 1)[0].strip() for line in text.splitlines()]
+        paths.extend(os.path.join(base, entry) for entry in entries if entry)
+    missing = [path for path in paths if not os.path.isfile(path)]
+    if missing:
+        raise FileNotFoundError(f"Music file not found: {missing[0]}")
+    return paths
+
+
+def safe_label(text):
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in text)[:60]
+
+
+def plan_jobs(designs, music_paths, durations, output_dir, audio_format, music_cache):
+    """
+    Expand the render matrix into job dictionaries
+
+    The output name ends with the first 16 hex digits of the render key,
+    which covers the config, duration, music content and format. Music
+    renders follow the track's length, so they get one job per design and
+    track rather than one per duration.
+    """
+    music = [(path, file_sha256(path)) for path in music_paths] or [(None, None)]
+    jobs = []
+    for name, config in designs:
+        for music_path, music_hash in music:
+            for duration_ms in ([0] if music_path else durations):
+                key = render_key(config, duration_ms, {'name': f'sha256:{music_hash}'} if music_hash else None,
+                                 output_format=audio_format)
+                music_label = safe_label(os.path.splitext(os.path.basename(music_path))[0]) if music_path else 'nomusic'
+                length_label = f'{duration_ms}ms' if duration_ms else 'full'
+                filename = f'{safe_label(name)}_{music_label}_{length_label}_{key[:16]}.{audio_format}'
+                jobs.append({
+                    'name': name,
+                    'config': config,
+                    'duration_ms': duration_ms,
+                    'music_path': music_path,
+                    'music_hash': music_hash,
+                    'music_cache': music_cache,
+                    'format': audio_format,
+                    'key': key,
+                    'output': os.path.join(output_dir, filename)
+                })
+    return jobs
+
+
+def render_job(job):
+    """
+    Render one job into its output file (runs in a worker process)
+
+    Music is decoded once into a shared music store keyed by content hash,
+    so every design rendered against the same track memory-maps one copy.
+
+    Returns:
+        Result dictionary (status, wall_s, audio_s, output, error)
+    """
+    from music_store import MusicStore
+    from uap_signal_generator import DEFAULT_SAMPLE_RATE, encode_signal, find_ffmpeg, generate_hybrid_uap_signal
+
+    started = time.perf_counter()
+    partial = job['output'] + '.partial'
+    try:
+        music_source = None
+        if job['music_path']:
+            store = MusicStore(job['music_cache'])
+            # Keyed by content; the extension tells pydub's fallback decoder how to read it
+            track = job['music_hash'][:32] + os.path.splitext(job['music_path'])[1].lower()
+            if track not in store:
+                if find_ffmpeg():
+                    store.add_file(track, job['music_path'], DEFAULT_SAMPLE_RATE, 2, source='batch',
+                                   original=os.path.basename(job['music_path']))
+                else:
+                    with open(job['music_path'], 'rb') as f:
+                        store.add(track, f.read(), source='batch', original=os.path.basename(job['music_path']))
+            music_source = store.open(track)
+
+        signal, _ = generate_hybrid_uap_signal(music_source=music_source, duration_ms=job['duration_ms'],
+                                               config=job['config'])
+        # Written under a temporary name and renamed, so an interrupted run never leaves a file that looks done
+        encode_signal(signal, partial, job['format'])
+        os.replace(partial, job['output'])
+        return {'status': 'rendered', 'output': job['output'], 'audio_s': len(signal) / 1000,
+                'wall_s': round(time.perf_counter() - started, 3)}
+    except Exception as e:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        return {'status': 'failed', 'output': job['output'], 'error': str(e),
+                'wall_s': round(time.perf_counter() - started, 3)}
+
+
+def init_worker(threads):
+    """Worker process setup: split the cores between processes rather than oversubscribing them"""
+    from signal_graph import set_render_threads
+    set_render_threads(threads)
+
+
+def run_batch(jobs, workers, on_result=None):
+    """Render jobs whose output doesn't exist yet; returns (results, skipped count, wall seconds)"""
+    pending = [job for job in jobs if not os.path.exists(job['output'])]
+    skipped = len(jobs) - len(pending)
+    results = []
+    started = time.perf_counter()
+    if workers <= 1:
+        for job in pending:
+            results.append(render_job(job))
+            if on_result:
+                on_result(job, results[-1])
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(threads,)) as pool:
+            futures = {pool.submit(render_job, job): job for job in pending}
+            for future in as_completed(futures):
+                results.append(future.result())
+                if on_result:
+                    on_result(futures[future], results[-1])
+    return results, skipped, time.perf_counter() - started
+
+
+def summarize(results, skipped, wall_s, workers):
+    rendered = [r for r in results if r['status'] == 'rendered']
+    audio_s = sum(r['audio_s'] for r in rendered)
+    return {
+        'rendered': len(rendered),
+        'skipped': skipped,
+        'failed': len(results) - len(rendered),
+        'jobs': workers,
+        'wall_s': round(wall_s, 2),
+        'audio_s': round(audio_s, 1),
+        'realtime_factor': round(audio_s / wall_s, 1) if wall_s > 0 else None,
+        'renders_per_minute': round(60 * len(rendered) / wall_s, 1) if wall_s > 0 else None,
+        'mean_render_s': round(sum(r['wall_s'] for r in rendered) / len(rendered), 2) if rendered else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render UAP signals in bulk, without the web API')
+    parser.add_argument('--preset', action='append', default=[],
+                        help="Preset name from signal_presets.py (repeatable, or 'all')")
+    parser.add_argument('--config', action='append', default=[], help='JSON config file or glob (repeatable)')
+    parser.add_argument('--music-dir', help='Render every design against each audio file in this folder')
+    parser.add_argument('--manifest', help='File listing music paths (one per line, or a JSON list)')
+    parser.add_argument('--duration', action='append', type=int, default=[],
+                        help='Duration in ms (repeatable, default 10000; music renders follow the track length)')
+    parser.add_argument('--output-dir', default='batch_output', help='Where rendered files are written')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='mp3', help='Output format')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Parallel render processes')
+    parser.add_argument('--summary', help='Also write the throughput summary as JSON to this file')
+    parser.add_argument('--dry-run', action='store_true', help='List the planned outputs and exit')
+    args = parser.parse_args(argv)
+
+    try:
+        designs = load_designs(args.preset or ([] if args.config else ['all']), args.config)
+        music_paths = load_music(args.music_dir, args.manifest)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not designs:
+        parser.error('Nothing to render: no presets or configs given')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    music_cache = os.path.join(args.output_dir, '.music')
+    jobs = plan_jobs(designs, music_paths, args.duration or [10000], args.output_dir, args.format, music_cache)
+
+    if args.dry_run:
+        for job in jobs:
+            state = 'exists' if os.path.exists(job['output']) else 'render'
+            print(f"{state:7} {job['output']}")
+        return 0
+
+    print(f'[BATCH] {len(jobs)} renders planned for {len(designs)} designs, {args.jobs} jobs', file=sys.stderr)
+
+    def report(job, result):
+        detail = f"{result['wall_s']}s" if result['status'] == 'rendered' else result.get('error')
+        print(f"[BATCH] {result['status']}: {os.path.basename(job['output'])} ({detail})", file=sys.stderr)
+
+    results, skipped, wall_s = run_batch(jobs, args.jobs, on_result=report)
+    summary = summarize(results, skipped, wall_s, args.jobs)
+
+    print(f"[BATCH] {summary['rendered']} rendered, {summary['skipped']} skipped (already done), "
+          f"{summary['failed']} failed in {summary['wall_s']}s", file=sys.stderr)
+    if summary['rendered']:
+        print(f"[BATCH] {summary['audio_s']}s of audio, {summary['realtime_factor']}x realtime, "
+              f"{summary['renders_per_minute']} renders/min", file=sys.stderr)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'results': results}, f, indent=2)
+    print(json.dumps(summary))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,4 @@
+"""
+UAP Signal Generator benchmarks
+Run from the repository root, e.g. ``python -m benchmarks.suite --quick``
+"""
@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Load Generator
+Simulated dashboard traffic against a local app, for sizing deployments
+
+Virtual users replay what the dashboard does, in a weighted mix of flows:
+
+    generate  preset list -> preset -> /api/generate -> /api/progress (SSE) -> /api/download
+    upload    /api/upload_music (raw body, a fresh track) -> generate with that track
+    youtube   /api/download_youtube -> /api/youtube_progress (SSE) -> generate with the track
+
+Each user runs flows back to back with a random think time in between,
+until the run's duration is up (a flow in flight is finished). YouTube is
+never contacted: the app serves stub tracks through its local extractor.
+
+Usage:
+    python -m benchmarks.load                                    # spawn the app, 4 users for 60 s
+    python -m benchmarks.load --users 1 --users 4 --users 16     # one run per user count
+    python -m benchmarks.load --workers 1 --workers 2 --threads 8 --max-concurrent-tasks 1 --max-concurrent-tasks 3
+    python -m benchmarks.load --mix generate=6,upload=2,youtube=2 --output load.json
+    python -m benchmarks.load --url http://127.0.0.1:5000 --users 8   # an app started by hand
+
+Without ``--url`` the app is started for every combination of
+``--workers``, ``--threads`` and ``--max-concurrent-tasks`` (gunicorn if
+installed, else Flask's own server), with rate limits off unless
+``--rate-limits`` is given, and its music and output folders in a
+scratch directory. Each run reports latency percentiles per endpoint,
+error and 429 rates, time to the first progress event and throughput;
+summaries are printed (and optionally written) as JSON.
+"""
+import argparse
+import http.client
+import io
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from urllib.parse import urlsplit
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+DEFAULT_MIX = 'generate=8,upload=1,youtube=1'
+FLOWS = ('generate', 'upload', 'youtube')
+STREAM_ENDPOINTS = ('progress', 'youtube_progress')  # Held open for the whole task; excluded from overall latency
+STUB_VIDEO_IDS = [f'loadtest{n:03d}' for n in range(8)]  # 11 characters, like real video IDs
+FIXTURE_SECONDS = 15  # Length of uploaded and stub YouTube tracks
+SSE_CONNECT_DELAY_S = 0.1  # The dashboard opens the progress stream 100 ms after /api/generate answers
+SERVER_START_TIMEOUT = 60
+
+
+def music_fixture(seconds, seed):
+    """WAV bytes of a short 'music' bed (chord + noise); the seed makes every track's content unique"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    chord = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3
+    mono = chord * (0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t)) * 0.5 + rng.normal(0, 0.02, len(t))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((np.repeat(np.clip(mono, -1, 1)[:, None], 2, axis=1) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def write_youtube_stubs(directory):
+    """Stub tracks served by the app's local extractor (``YOUTUBE_EXTRACTOR=local:<directory>``)"""
+    os.makedirs(directory, exist_ok=True)
+    for index, video_id in enumerate(STUB_VIDEO_IDS):
+        path = os.path.join(directory, f'{video_id}.wav')
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(music_fixture(FIXTURE_SECONDS, index))
+
+
+def parse_mix(spec):
+    """'generate=8,upload=1' -> {'generate': 8.0, 'upload': 1.0}"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in FLOWS:
+            raise ValueError(f"Unknown flow '{name}' (choose from {', '.join(FLOWS)})")
+        mix[name] = float(weight or 1)
+        if mix[name] < 0:
+            raise ValueError(f'Negative weight for {name}')
+    if not sum(mix.values()):
+        raise ValueError('The flow mix has no weight')
+    return mix
+
+
+class LoadStats:
+    """Thread-safe record of every request and flow of a run"""
+
+    def __init__(self):
+        self.requests = []  # (endpoint, HTTP status or 0 for connection errors/timeouts, seconds)
+        self.flows = []  # Flow outcome dictionaries
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.requests.append((endpoint, status, seconds))
+
+    def record_flow(self, flow):
+        with self._lock:
+            self.flows.append(flow)
+
+
+def user_address(user_id):
+    """Private address standing in for a virtual user's own IP"""
+    return f'10.{(user_id >> 16) & 255}.{(user_id >> 8) & 255}.{user_id & 255}'
+
+
+class Client:
+    """
+    HTTP client of one virtual user
+
+    Requests carry the dashboard's same-origin Referer (so API key checks pass
+    as they do for the web UI) and a per-user X-Forwarded-For address. An app
+    with TRUSTED_PROXIES=1 (as started by the load generator) takes that as
+    the client address for the render queue's per-client limits and the rate
+    limits, as it would behind a proxy.
+    """
+
+    def __init__(self, base_url, user_id, stats, timeout):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.headers = {'Referer': base_url.rstrip('/') + '/'}
+        if user_id is not None:
+            self.headers['X-Forwarded-For'] = user_address(user_id)
+        self.stats = stats
+        self.timeout = timeout
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        """Send one request and read the whole response; returns (status, body bytes)"""
+        started = time.perf_counter()
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers={**self.headers, **(headers or {})})
+            response = connection.getresponse()
+            status, data = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            status, data = 0, b''
+        finally:
+            connection.close()
+        self.stats.record(endpoint, status, time.perf_counter() - started)
+        return status, data
+
+    def json(self, endpoint, method, path, payload=None):
+        """Request with an optional JSON body; returns (status, decoded body or {})"""
+        body = None if payload is None else json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'} if body is not None else None
+        status, data = self.request(endpoint, method, path, body, headers)
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, {}
+
+    def events(self, endpoint, path):
+        """
+        Read a Server-Sent Events stream to its end
+
+        Yields:
+            (seconds since the request was sent, decoded event) for every data event
+        """
+        started = time.perf_counter()
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        status = 0
+        try:
+            connection.request('GET', path, headers=self.headers)
+            response = connection.getresponse()
+            status = response.status
+            if status == 200:
+                for line in iter(response.readline, b''):
+                    if line.startswith(b'data: '):
+                        yield time.perf_counter() - started, json.loads(line[6:])
+        except (OSError, http.client.HTTPException, ValueError):
+            status = 0
+        finally:
+            connection.close()
+            self.stats.record(endpoint, status, time.perf_counter() - started)
+
+
+def failed(status):
+    return {'outcome': 'rate_limited' if status == 429 else 'failed', 'status': status}
+
+
+def generate_flow(client, rng, options, music_file=None):
+    """Pick a preset, generate, follow the progress stream and download the result"""
+    status, presets = client.json('presets', 'GET', '/api/presets')
+    if status != 200 or not presets:
+        return failed(status)
+    preset_name = rng.choice(sorted(presets))
+    status, preset = client.json('preset', 'GET', f'/api/preset/{preset_name}')
+    if status != 200:
+        return failed(status)
+
+    config = dict(preset.get('config') or {})
+    if rng.random() >= options.repeat_ratio:
+        # A tweaked slider makes the render unique; untouched presets may be served from the render cache
+        config['tremolo_depth'] = round(rng.uniform(0.2, 0.8), 3)
+    if music_file:
+        config['use_music_modulation'] = True
+    started = time.perf_counter()
+    status, body = client.json('generate', 'POST', '/api/generate', {
+        'config': config,
+        'use_music': bool(music_file),
+        'music_file': music_file,
+        'preset_name': preset_name,
+        'duration': options.render_ms
+    })
+    if status != 200 or body.get('status') != 'started':
+        return failed(status if status != 200 else 0)
+
+    time.sleep(SSE_CONNECT_DELAY_S)
+    first_progress_s, final = None, {}
+    for _, event in client.events('progress', f"/api/progress/{body['task_id']}"):
+        if first_progress_s is None:
+            first_progress_s = time.perf_counter() - started
+        final = event
+    outcome = {'first_progress_s': first_progress_s, 'render_s': time.perf_counter() - started,
+               'cached': bool(body.get('cached'))}
+    if final.get('status') != 'completed':
+        return {**outcome, 'outcome': 'failed', 'status': final.get('status'), 'error': final.get('error')}
+
+    status, _ = client.request('download', 'GET', f"/api/download/{body['task_id']}")
+    return {**outcome, **(failed(status) if status != 200 else {'outcome': 'completed', 'status': status})}
+
+
+def upload_flow(client, rng, options):
+    """Upload a track nobody has uploaded before, then generate with it"""
+    name = f'load_{rng.getrandbits(48):012x}.wav'
+    status, body = client.request('upload_music', 'POST', f'/api/upload_music?filename={name}',
+                                  music_fixture(FIXTURE_SECONDS, rng.getrandbits(32)),
+                                  {'Content-Type': 'application/octet-stream'})
+    if status != 200:
+        return failed(status)
+    return generate_flow(client, rng, options, json.loads(body)['filename'])
+
+
+def youtube_flow(client, rng, options):
+    """Fetch a stub YouTube track (joining or reusing earlier downloads), then generate with it"""
+    video_id = rng.choice(STUB_VIDEO_IDS)
+    status, body = client.json('download_youtube', 'POST', '/api/download_youtube',
+                               {'url': f'https://www.youtube.com/watch?v={video_id}'})
+    if status == 202:
+        final = {}
+        for _, event in client.events('youtube_progress', f"/api/youtube_progress/{body['job_id']}"):
+            final = event
+        if final.get('status') != 'completed':
+            return {'outcome': 'failed', 'status': final.get('status'), 'error': final.get('error')}
+    elif status != 200:
+        return failed(status)
+    return generate_flow(client, rng, options, body['filename'])
+
+
+FLOW_RUNNERS = {'generate': generate_flow, 'upload': upload_flow, 'youtube': youtube_flow}
+
+
+def run_user(user_id, base_url, stats, options, start_at, deadline):
+    """One virtual user: weighted random flows with think time until the deadline"""
+    rng = random.Random(options.seed * 100003 + user_id)
+    client = Client(base_url, user_id, stats, options.request_timeout)
+    names, weights = zip(*options.mix.items())
+    time.sleep(max(0.0, start_at - time.monotonic()))
+    while time.monotonic() < deadline:
+        flow = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        outcome = FLOW_RUNNERS[flow](client, rng, options)
+        stats.record_flow({'flow': flow, 'user': user_id, 'seconds': time.perf_counter() - started, **outcome})
+        think = rng.expovariate(1 / options.think_time) if options.think_time > 0 else 0.0
+        time.sleep(max(0.0, min(think, deadline - time.monotonic())))
+
+
+def percentiles(values):
+    if not values:
+        return {'p50_s': None, 'p95_s': None, 'p99_s': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_s': round(float(p50), 4), 'p95_s': round(float(p95), 4), 'p99_s': round(float(p99), 4)}
+
+
+def summarize(stats, users, wall_s, settings):
+    """Latency percentiles, error/429 rates, time to first progress and throughput of a run"""
+    requests = stats.requests
+    is_error = lambda status: status == 0 or (status >= 400 and status != 429)
+    endpoints = {}
+    for endpoint in sorted({r[0] for r in requests}):
+        rows = [r for r in requests if r[0] == endpoint]
+        endpoints[endpoint] = {
+            'count': len(rows),
+            'errors': sum(is_error(r[1]) for r in rows),
+            'rate_limited': sum(r[1] == 429 for r in rows),
+            **percentiles([r[2] for r in rows])
+        }
+
+    flows = {}
+    for name in sorted({f['flow'] for f in stats.flows}):
+        rows = [f for f in stats.flows if f['flow'] == name]
+        completed = [f for f in rows if f['outcome'] == 'completed']
+        flows[name] = {
+            'completed': len(completed),
+            'failed': sum(f['outcome'] == 'failed' for f in rows),
+            'rate_limited': sum(f['outcome'] == 'rate_limited' for f in rows),
+            **percentiles([f['seconds'] for f in completed])
+        }
+
+    completed = [f for f in stats.flows if f['outcome'] == 'completed']
+    total = len(requests)
+    return {
+        'users': users,
+        'settings': settings,
+        'wall_s': round(wall_s, 2),
+        'requests': {
+            'total': total,
+            'per_second': round(total / wall_s, 2) if wall_s else 0.0,
+            'error_rate': round(sum(is_error(r[1]) for r in requests) / total, 4) if total else 0.0,
+            'rate_limited_rate': round(sum(r[1] == 429 for r in requests) / total, 4) if total else 0.0,
+            **percentiles([r[2] for r in requests if r[0] not in STREAM_ENDPOINTS])
+        },
+        'endpoints': endpoints,
+        'time_to_first_progress': percentiles([f['first_progress_s'] for f in stats.flows
+                                               if f.get('first_progress_s') is not None]),
+        'render': percentiles([f['render_s'] for f in completed]),
+        'cache_hits': sum(f.get('cached', False) for f in completed),
+        'flows': flows,
+        'flows_per_minute': round(len(completed) * 60 / wall_s, 2) if wall_s else 0.0,
+        'renders_per_minute': round(sum(not f.get('cached') for f in completed) * 60 / wall_s, 2) if wall_s else 0.0
+    }
+
+
+def run_load(base_url, users, options, settings):
+    """Run ``users`` virtual users for ``options.duration`` seconds; returns the run summary"""
+    stats = LoadStats()
+    started = time.monotonic()
+    deadline = started + options.duration
+    threads = []
+    for user_id in range(users):
+        start_at = started + options.ramp_up * user_id / users
+        thread = threading.Thread(target=run_user, name=f'load-user-{user_id}', daemon=True,
+                                  args=(user_id, base_url, stats, options, start_at, deadline))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        # Flows still in flight at the deadline are finished, within the request timeout
+        thread.join(max(0.0, deadline - time.monotonic()) + options.request_timeout)
+    summary = summarize(stats, users, time.monotonic() - started, settings)
+
+    status, health = Client(base_url, None, LoadStats(), options.request_timeout).json('health', 'GET', '/health')
+    if status == 200:
+        summary['server'] = {'queue': health.get('queue'), 'render_cache': health.get('render_cache')}
+    return summary
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """
+    The app in a subprocess on a free local port, for the duration of a ``with`` block
+
+    Args:
+        server: 'gunicorn' or 'flask'
+        workdir: Scratch directory (music store, outputs, server log)
+        workers, threads: gunicorn worker processes and threads per worker
+        env: Extra environment variables for the app
+    """
+
+    def __init__(self, server, workdir, workers=None, threads=None, env=None):
+        self.server = server
+        self.workdir = workdir
+        self.workers = workers
+        self.threads = threads
+        self.env = env or {}
+        self.port = None
+        self.process = None
+        self.log_path = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def __enter__(self):
+        self.port = free_port()
+        env = {**os.environ, 'PORT': str(self.port), 'PYTHONUNBUFFERED': '1',
+               'UPLOAD_FOLDER': os.path.join(self.workdir, 'source_files'),
+               'OUTPUT_FOLDER': os.path.join(self.workdir, 'generated_signals'), **self.env}
+        if self.server == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{self.port}',
+                       '--workers', str(self.workers), '--threads', str(self.threads), '--timeout', '120']
+        else:
+            command = [sys.executable, 'app.py']
+        self.log_path = os.path.join(self.workdir, f'server-{self.port}.log')
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+        return self
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'App exited with code {self.process.returncode} (see {self.log_path})')
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+            try:
+                connection.request('GET', '/api/presets')
+                if connection.getresponse().status == 200:
+                    return
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                connection.close()
+            time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f'App did not answer within {SERVER_START_TIMEOUT}s (see {self.log_path})')
+
+    def __exit__(self, *exc_info):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def format_run(summary):
+    settings = ', '.join(f'{key}={value}' for key, value in summary['settings'].items() if value is not None)
+    requests, first = summary['requests'], summary['time_to_first_progress']
+    flows = summary['flows'].values()
+    return (f"[LOAD] {summary['users']} users ({settings or 'external app'}): "
+            f"{sum(f['completed'] for f in flows)} flows ok, {sum(f['failed'] for f in flows)} failed, "
+            f"{sum(f['rate_limited'] for f in flows)} rate-limited | "
+            f"{requests['total']} requests, p50/p95/p99 {requests['p50_s']}/{requests['p95_s']}/{requests['p99_s']}s, "
+            f"errors {requests['error_rate']:.1%}, 429 {requests['rate_limited_rate']:.1%} | "
+            f"first progress p50/p95 {first['p50_s']}/{first['p95_s']}s | "
+            f"{summary['renders_per_minute']} renders/min")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay simulated dashboard traffic against a local app')
+    parser.add_argument('--url', help='Load an app that is already running (default: start one per setting)')
+    parser.add_argument('--server', choices=('gunicorn', 'flask'),
+                        help='How to start the app (default: gunicorn if installed)')
+    parser.add_argument('--workers', action='append', type=int, default=[],
+                        help='gunicorn worker processes (repeatable, default 1)')
+    parser.add_argument('--threads', action='append', type=int, default=[],
+                        help='Threads per gunicorn worker (repeatable, default 8)')
+    parser.add_argument('--max-concurrent-tasks', action='append', type=int, default=[],
+                        help='MAX_CONCURRENT_TASKS of the app (repeatable, default: the app default)')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment variable for the started app (repeatable)')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='Keep the app rate limits (applied per virtual user address)')
+    parser.add_argument('--users', action='append', type=int, default=[],
+                        help='Concurrent virtual users (repeatable, default 4)')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds each run starts new flows')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users are started')
+    parser.add_argument('--think-time', type=float, default=5, help="Mean pause between a user's flows (s)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Flow weights (default {DEFAULT_MIX})')
+    parser.add_argument('--render-ms', type=int, default=10000, help='Requested signal duration (ms)')
+    parser.add_argument('--repeat-ratio', type=float, default=0.2,
+                        help='Share of generations using an untouched preset (render cache candidates)')
+    parser.add_argument('--request-timeout', type=float, default=300, help='Socket timeout per request (s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the users\' random choices')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'uap_load'),
+                        help='Scratch directory for stub tracks, the started app\'s files and logs')
+    parser.add_argument('--output', help='Also write the run summaries as JSON to this file')
+    args = parser.parse_args(argv)
+
+    try:
+        args.mix = parse_mix(args.mix)
+        extra_env = dict(item.split('=', 1) for item in args.env)
+    except ValueError as e:
+        parser.error(str(e))
+    server = args.server
+    if server is None:
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn'
+        except ImportError:
+            server = 'flask'
+    if (args.url or server == 'flask') and (args.workers or args.threads):
+        parser.error('--workers/--threads apply to an app started with gunicorn')
+    if args.url and (args.max_concurrent_tasks or args.env):
+        parser.error('--max-concurrent-tasks/--env apply to an app started by the load generator')
+
+    stubs = os.path.join(args.workdir, 'youtube_stub')
+    write_youtube_stubs(stubs)
+    users = args.users or [4]
+    summaries = []
+
+    if args.url:
+        if 'youtube' in args.mix:
+            print(f'[LOAD] YouTube flows need the app started with YOUTUBE_EXTRACTOR=local:{stubs}', file=sys.stderr)
+        print('[LOAD] Per-user client addresses need the app started with TRUSTED_PROXIES=1', file=sys.stderr)
+        for count in users:
+            summaries.append(run_load(args.url, count, args, {}))
+            print(format_run(summaries[-1]), file=sys.stderr)
+    else:
+        worker_counts = (args.workers or [1]) if server == 'gunicorn' else [None]
+        thread_counts = (args.threads or [8]) if server == 'gunicorn' else [None]
+        for workers, threads, tasks in itertools.product(worker_counts, thread_counts,
+                                                         args.max_concurrent_tasks or [None]):
+            env = {'YOUTUBE_EXTRACTOR': f'local:{stubs}', 'RENDER_WARMUP': 'false', 'TRUSTED_PROXIES': '1',
+                   **extra_env}
+            if not args.rate_limits:
+                env['RATE_LIMIT_ENABLED'] = 'false'
+            if tasks is not None:
+                env['MAX_CONCURRENT_TASKS'] = str(tasks)
+            settings = {'server': server, 'workers': workers, 'threads': threads, 'max_concurrent_tasks': tasks}
+            # A fresh scratch directory per setting, so stored tracks and caches don't carry over
+            workdir = tempfile.mkdtemp(prefix='app-', dir=args.workdir)
+            with AppServer(server, workdir, workers, threads, env) as app_server:
+                print(f'[LOAD] App started at {app_server.url} ({server}), log: {app_server.log_path}',
+                      file=sys.stderr)
+                for count in users:
+                    summaries.append(run_load(app_server.url, count, args, settings))
+                    print(format_run(summaries[-1]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+    print(json.dumps(summaries))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Stream Seam Check
+Decodes the segments of a segmented stream and compares them with a full render
+
+Checks that every segment decodes to exactly ``segment_frames`` frames
+(the last one to its length rounded up to a whole MP3 frame), and that
+the segments decoded back to back, as a player does, follow the full
+render as closely as one continuous MP3 encode of it does. The error is
+compared in a two-frame window around every seam.
+
+Usage:
+    python -m benchmarks.stream_seams                       # 35 s stream, default config
+    python -m benchmarks.stream_seams --duration 60000 --config '{"mastering": true}'
+"""
+import argparse
+import io
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+SEAM_TOLERANCE = 2.0  # Seam error allowed, relative to the continuous encode's error around the same point
+ERROR_FLOOR = 1e-4  # RMS error below which a window passes regardless (about -80 dBFS)
+MAX_CODEC_DELAY = 4096  # Longest decoder output delay searched for when aligning the continuous encode
+
+
+def decode_mp3(data, channels):
+    """Decode MP3 frames with FFmpeg (no gapless trimming is possible: there is no Xing header)"""
+    from uap_signal_generator import find_ffmpeg
+    result = subprocess.run([find_ffmpeg(), '-v', 'error', '-f', 'mp3', '-i', '-', '-f', 's16le', '-'],
+                            input=data, capture_output=True, check=True)
+    return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels) / 32768.0
+
+
+def strip_id3(data):
+    """Packed audio segment without its leading ID3 tag"""
+    if data[:3] != b'ID3':
+        return data
+    size = sum(byte << shift for byte, shift in zip(data[6:10], (21, 14, 7, 0)))
+    return data[10 + size:]
+
+
+def codec_delay(decoded, reference):
+    """Lag of a decoded continuous encode behind its input, found by cross-correlation (not assumed)"""
+    probe = reference[:min(len(reference), len(decoded) - MAX_CODEC_DELAY)]
+    return max(range(MAX_CODEC_DELAY), key=lambda lag: float(np.sum(decoded[lag:lag + len(probe)] * probe)))
+
+
+def rms(values):
+    return float(np.sqrt(np.mean(np.square(values)))) if values.size else 0.0
+
+
+def check_stream(config, duration_ms):
+    from segment_stream import PACKED_MP3_PARAMETERS, SegmentedRender
+    from uap_signal_generator import array_to_segment, encode_signal
+
+    stream = SegmentedRender('seam-check', config, duration_ms)
+    frame, channels = stream.mp3_frame, stream.channels
+    reference = stream.full_mix()
+
+    segments = [stream.render_segment(index) for index in range(stream.segment_count)]
+    lengths = [len(decode_mp3(strip_id3(data), channels)) for data in segments]
+    expected = [stream.segment_frames] * (stream.segment_count - 1)
+    expected.append(-(-(stream.total_frames - stream.segment_frames * (stream.segment_count - 1)) // frame) * frame)
+
+    played = decode_mp3(b''.join(strip_id3(data) for data in segments), channels)[:stream.total_frames]
+    buffer = io.BytesIO()
+    encode_signal(array_to_segment(reference, stream.sample_rate), buffer, 'mp3', PACKED_MP3_PARAMETERS)
+    continuous = decode_mp3(buffer.getvalue(), channels)
+    delay = codec_delay(continuous, reference)
+    continuous = continuous[delay:delay + stream.total_frames]
+
+    seams = []
+    for index in range(1, stream.segment_count):
+        point = index * stream.segment_frames
+        window = slice(point - frame, point + frame)
+        seam_error = rms(played[window] - reference[window])
+        continuous_error = rms(continuous[window] - reference[window])
+        seams.append({
+            'frame': point,
+            'segments_rms_error': round(seam_error, 6),
+            'continuous_rms_error': round(continuous_error, 6),
+            'ok': seam_error <= max(SEAM_TOLERANCE * continuous_error, ERROR_FLOOR)
+        })
+
+    return {
+        'segments': stream.segment_count,
+        'segment_frames': stream.segment_frames,
+        'decoded_lengths': lengths,
+        'lengths_ok': lengths == expected,
+        'played_frames': len(played),
+        'total_frames': stream.total_frames,
+        'codec_delay': delay,
+        'overall_rms_error': {'segments': round(rms(played - reference), 6),
+                              'continuous': round(rms(continuous - reference), 6)},
+        'seams': seams,
+        'ok': lengths == expected and len(played) == stream.total_frames and all(seam['ok'] for seam in seams)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check that stream segments decode to seamless, exact-length audio')
+    parser.add_argument('--duration', type=int, default=35000, help='Stream duration (ms)')
+    parser.add_argument('--config', default='{}', help='Configuration overrides as JSON')
+    args = parser.parse_args(argv)
+
+    report = check_stream(json.loads(args.config), args.duration)
+    print(json.dumps(report, indent=2))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Signal Generator Benchmark Suite
+Reproducible wall time, CPU time and peak RSS measurements for the
+generator, layer helpers, visualization, MP3 export, the HTTP hot path
+and cold module imports
+
+Usage:
+    python -m benchmarks.suite                    # full suite (includes 60 min renders)
+    python -m benchmarks.suite --quick            # 10 s and 1 min renders only
+    python -m benchmarks.suite --filter generate  # cases whose name contains 'generate'
+    python -m benchmarks.suite --output bench.json
+
+Each case runs in a fresh subprocess so its peak RSS is not polluted by
+earlier cases. Results are printed (and optionally written) as JSON.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timezone
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+FULL_DURATIONS_MS = [10_000, 60_000, 600_000, 3_600_000]
+QUICK_DURATIONS_MS = [10_000, 60_000]
+HELPER_DURATION_MS = 60_000
+
+# Case name -> (setup function, params). setup(params) returns a zero-argument callable to time.
+CASES = {}
+
+
+def register(name, **params):
+    def decorator(setup):
+        CASES[name] = (setup, params)
+        return setup
+    return decorator
+
+
+def write_music_fixture(path, duration_ms, channels=2):
+    """Write a deterministic 16-bit WAV 'music' bed (chord + noise) without needing FFmpeg"""
+    rng = np.random.default_rng(1234)
+    frames = int(SAMPLE_RATE * duration_ms / 1000)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        # Written in chunks so hour-long fixtures don't need the whole signal in memory
+        for start in range(0, frames, SAMPLE_RATE * 10):
+            t = np.arange(start, min(start + SAMPLE_RATE * 10, frames)) / SAMPLE_RATE
+            chord = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3
+            envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t)
+            mono = chord * envelope * 0.5 + rng.normal(0, 0.02, len(t))
+            block = np.repeat(mono[:, None], channels, axis=1)
+            wav.writeframes((np.clip(block, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def fixture_path(duration_ms):
+    """Cached music fixture path for a duration (created on first use)"""
+    directory = os.path.join(tempfile.gettempdir(), 'uap_benchmark_fixtures')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'music_{duration_ms}ms.wav')
+    if not os.path.exists(path):
+        write_music_fixture(path, duration_ms)
+    return path
+
+
+def ffmpeg_available():
+    from uap_signal_generator import find_ffmpeg
+    return bool(find_ffmpeg())
+
+
+def test_segment(duration_ms):
+    """Mono 16-bit AudioSegment with a tone, used by the helper benchmarks"""
+    from pydub import AudioSegment
+    t = np.arange(int(SAMPLE_RATE * duration_ms / 1000)) / SAMPLE_RATE
+    samples = (np.sin(2 * np.pi * 440 * t) * 16000).astype(np.int16)
+    return AudioSegment(samples.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=1)
+
+
+# ---------------------------------------------------------------------------
+# Cases
+# ---------------------------------------------------------------------------
+
+def _register_generate_cases():
+    for duration_ms in FULL_DURATIONS_MS:
+        label = f'{duration_ms // 1000}s' if duration_ms < 60_000 else f'{duration_ms // 60_000}min'
+        register(f'generate_{label}', duration_ms=duration_ms, music=False)(setup_generate)
+        register(f'generate_{label}_music', duration_ms=duration_ms, music=True)(setup_generate)
+
+
+def setup_generate(params):
+    from uap_signal_generator import generate_hybrid_uap_signal
+    music_path = fixture_path(params['duration_ms']) if params['music'] else None
+
+    def run():
+        generate_hybrid_uap_signal(music_file_path=music_path, duration_ms=params['duration_ms'])
+    return run
+
+
+@register('apply_tremolo', duration_ms=HELPER_DURATION_MS)
+def setup_apply_tremolo(params):
+    from uap_signal_generator import apply_tremolo
+    segment = test_segment(params['duration_ms'])
+    return lambda: apply_tremolo(segment, rate=7.83, depth=0.5)
+
+
+@register('apply_amplitude_modulation', duration_ms=HELPER_DURATION_MS)
+def setup_apply_amplitude_modulation(params):
+    from pydub import AudioSegment
+    from uap_signal_generator import apply_amplitude_modulation
+    carrier = test_segment(params['duration_ms'])
+    modulator = AudioSegment.from_file(fixture_path(params['duration_ms']))
+    return lambda: apply_amplitude_modulation(carrier, modulator)
+
+
+@register('get_waveform_data', duration_ms=HELPER_DURATION_MS)
+def setup_get_waveform_data(params):
+    from app import get_waveform_data
+    segment = test_segment(params['duration_ms'])
+    return lambda: get_waveform_data(segment, samples=1000)
+
+
+@register('get_fft_data', duration_ms=HELPER_DURATION_MS)
+def setup_get_fft_data(params):
+    from app import get_fft_data
+    segment = test_segment(params['duration_ms'])
+    return lambda: get_fft_data(segment, bins=512)
+
+
+@register('mp3_export', duration_ms=HELPER_DURATION_MS, requires_ffmpeg=True)
+def setup_mp3_export(params):
+    from uap_signal_generator import generate_hybrid_uap_signal
+    signal, _ = generate_hybrid_uap_signal(duration_ms=params['duration_ms'])
+    return lambda: signal.export(io.BytesIO(), format='mp3')
+
+
+@register('http_generate_download', duration_ms=10_000, cached=False, requires_ffmpeg=True)
+@register('http_generate_download_cached', duration_ms=10_000, cached=True, requires_ffmpeg=True)
+def setup_http_generate_download(params):
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    import app as app_module
+    client = app_module.app.test_client()
+
+    def run():
+        if not params['cached']:
+            # Repeats would otherwise be served from the render cache after the first
+            app_module.render_cache.clear()
+        response = client.post('/api/generate', json={
+            'preset_name': 'original_uap',
+            'config': {},
+            'duration': params['duration_ms']
+        })
+        task_id = response.get_json()['task_id']
+        while app_module.generation_progress[task_id]['status'] in ('queued', 'running'):
+            time.sleep(0.005)
+        if app_module.generation_progress[task_id]['status'] != 'completed':
+            raise RuntimeError(app_module.generation_progress[task_id].get('error'))
+        download = client.get(f'/api/download/{task_id}')
+        if download.status_code != 200:
+            raise RuntimeError(f'Download failed with HTTP {download.status_code}')
+        download.get_data()
+    return run
+
+
+def setup_import(params):
+    """Cold import of a module in a fresh interpreter (what a scaled-to-zero dyno pays before its first request)"""
+    command = [sys.executable, '-c', f"import {params['module']}"]
+
+    def run():
+        completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.strip()[-2000:])
+    return run
+
+
+register('import_app', module='app')(setup_import)
+register('import_uap_signal_generator', module='uap_signal_generator')(setup_import)
+
+
+_register_generate_cases()
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def cpu_seconds():
+    """CPU time of this process plus finished children (e.g. FFmpeg encoders)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run_case(name, repeat):
+    """Run one case in this process and return its result dictionary"""
+    setup, params = CASES[name]
+    result = {'name': name, 'params': {k: v for k, v in params.items() if k != 'requires_ffmpeg'}}
+
+    if params.get('requires_ffmpeg') and not ffmpeg_available():
+        result.update({'status': 'skipped', 'reason': 'FFmpeg not available'})
+        return result
+
+    run = setup(params)
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), cpu_seconds()
+        run()
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(cpu_seconds() - cpu_start)
+
+    result.update({
+        'status': 'ok',
+        'repeat': repeat,
+        'wall_s': round(float(np.median(walls)), 4),
+        'wall_min_s': round(min(walls), 4),
+        'cpu_s': round(float(np.median(cpus)), 4),
+        'peak_rss_mb': peak_rss_mb()
+    })
+    return result
+
+
+def run_case_subprocess(name, repeat):
+    """Run one case in a fresh interpreter so peak RSS is per case"""
+    command = [sys.executable, '-m', 'benchmarks.suite', '--run-case', name, '--repeat', str(repeat)]
+    completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith('{'):
+            return json.loads(line)
+    return {'name': name, 'status': 'error', 'reason': (completed.stderr or completed.stdout).strip()[-2000:]}
+
+
+def environment_info():
+    import scipy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def select_cases(quick, name_filter):
+    names = list(CASES)
+    if quick:
+        quick_labels = {f'generate_{ms // 1000}s' if ms < 60_000 else f'generate_{ms // 60_000}min'
+                        for ms in QUICK_DURATIONS_MS}
+        names = [n for n in names if not n.startswith('generate_')
+                 or n.replace('_music', '') in quick_labels]
+    if name_filter:
+        names = [n for n in names if name_filter in n]
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='UAP Signal Generator benchmark suite')
+    parser.add_argument('--quick', action='store_true', help='Skip 10 min and 60 min renders')
+    parser.add_argument('--filter', default='', help='Only run cases whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (median is reported)')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--list', action='store_true', help='List case names and exit')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.repeat)))
+        return 0
+
+    names = select_cases(args.quick, args.filter)
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    results = []
+    for name in names:
+        print(f'[BENCH] {name}...', file=sys.stderr)
+        result = run_case_subprocess(name, args.repeat)
+        print(f'[BENCH] {name}: {result.get("status")} {result.get("wall_s", "")}', file=sys.stderr)
+        results.append(result)
+
+    report = json.dumps({'environment': environment_info(), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    print(report)
+    return 0 if all(r['status'] != 'error' for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Expiry Reaper
+One background thread for all time- and size-based housekeeping
+
+Anything that has to go away later is registered as a job under a key
+with a due time: a task's progress entry and result, the grace period
+after an SSE client disconnects, the sweeps that keep task results, the
+music store and preview sessions within their budgets. Jobs sit in a heap
+ordered by due time and the reaper sleeps until the earliest one is due,
+so a request handler only pays for a heap push and no thread is started
+per job. Scheduling a key again replaces its due time (the stale heap
+entry is skipped when it surfaces). Recurring jobs can be ``poke``d to run
+right away, e.g. after something large was stored.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+class ExpiryReaper:
+    """Time-ordered job heap drained by a single daemon thread"""
+
+    def __init__(self):
+        self._heap = []  # (due, sequence, key)
+        self._jobs = {}  # key -> (due, sequence, callback, interval or None)
+        self._sequence = itertools.count()
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self.runs = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name='expiry-reaper', daemon=True)
+        self._thread.start()
+
+    def schedule(self, key, delay, callback, interval=None):
+        """
+        Run ``callback()`` in ``delay`` seconds, replacing any job under ``key``
+
+        Args:
+            key: Job identifier (e.g. 'task:<id>')
+            delay: Seconds from now
+            callback: Callable run on the reaper thread
+            interval: Re-run every this many seconds afterwards (None = once)
+        """
+        with self._wakeup:
+            self._push(key, time.monotonic() + delay, callback, interval)
+
+    def every(self, key, interval, callback):
+        """Run ``callback()`` every ``interval`` seconds"""
+        self.schedule(key, interval, callback, interval)
+
+    def poke(self, key):
+        """Run a scheduled job now instead of at its due time (no-op for unknown keys)"""
+        with self._wakeup:
+            job = self._jobs.get(key)
+            if job is not None:
+                self._push(key, time.monotonic(), job[2], job[3])
+
+    def cancel(self, key):
+        with self._wakeup:
+            self._jobs.pop(key, None)
+
+    def _push(self, key, due, callback, interval):
+        sequence = next(self._sequence)
+        self._jobs[key] = (due, sequence, callback, interval)
+        heapq.heappush(self._heap, (due, sequence, key))
+        # Replaced entries stay in the heap until they surface; rebuild before they pile up
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [(job[0], job[1], job_key) for job_key, job in self._jobs.items()]
+            heapq.heapify(self._heap)
+        if self._heap[0][1] == sequence:
+            self._wakeup.notify()
+
+    def _next_due(self):
+        """Drop stale heap entries; returns the earliest live (due, sequence, key) or None"""
+        while self._heap:
+            due, sequence, key = self._heap[0]
+            job = self._jobs.get(key)
+            if job is not None and job[1] == sequence:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return None
+
+    def run_due(self):
+        """Run every job that is due; returns the number run"""
+        ran = 0
+        while True:
+            with self._wakeup:
+                entry = self._next_due()
+                if entry is None or entry[0] > time.monotonic():
+                    return ran
+                heapq.heappop(self._heap)
+                _, _, callback, interval = self._jobs.pop(entry[2])
+                if interval is not None:
+                    self._push(entry[2], time.monotonic() + interval, callback, interval)
+            try:
+                callback()
+            except Exception as e:
+                self.errors += 1
+                print(f"[REAPER] {entry[2]} failed: {e}")
+            self.runs += 1
+            ran += 1
+
+    def _loop(self):
+        while True:
+            with self._wakeup:
+                entry = self._next_due()
+                timeout = None if entry is None else entry[0] - time.monotonic()
+                if timeout is None or timeout > 0:
+                    self._wakeup.wait(timeout)
+                    continue
+            self.run_due()
+
+    def stats(self):
+        with self._wakeup:
+            return {'jobs': len(self._jobs), 'runs': self.runs, 'errors': self.errors}
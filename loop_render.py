@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Loop Rendering
+Renders long music-free signals as one seamless period tiled to length
+
+Without music, a design is built from fixed tones, LFOs, pulse trains
+repeating at fixed intervals and noise. ``loop_period`` finds the shortest
+period after which every tone and LFO is back in phase (within a small
+tolerance) and every pulse train is back at the start of an interval.
+``render_loop`` then renders that period once, and tiles it to the
+requested length. It covers the seams with a short crossfade into the
+natural continuation of the period, which hides the repeat of noise and
+any residual phase error.
+
+The end of the timeline, where pulse trains stop early, is rendered for
+real. Mastering follows the same idea: loudness is measured over one
+period, and ``limit_looped`` limits the period once with wrap-around
+context. Only the first and last few milliseconds get a limiter pass of
+their own.
+"""
+from functools import reduce
+from math import gcd
+
+import numpy as np
+
+from signal_mastering import (
+    DEFAULT_LOOKAHEAD_MS, DEFAULT_TRUE_PEAK_DB, GATE_BLOCK_SECONDS, GATE_STEP_SECONDS, limit_true_peak,
+    limiter_context_frames
+)
+from sliced_render import render_slice
+from signal_graph import settle_frames
+
+LOOP_MAX_SECONDS = 900  # Longest period searched for
+LOOP_MIN_REPEATS = 2  # Renders shorter than this many periods are rendered normally
+LOOP_PHASE_TOLERANCE = 0.02  # Largest phase mismatch (in cycles) the seam crossfade is allowed to hide
+LOOP_CROSSFADE_MS = 50
+LOOP_GRID_SECONDS = 0.01  # Period step when no pulse train fixes one
+LOOP_MIN_SECONDS = 1
+
+
+def _pulse_frames(step, sample_rate):
+    params = step.params
+    return int(sample_rate * params['pulse_ms'] / 1000.0), int(sample_rate * params['interval_ms'] / 1000.0)
+
+
+def loop_period(plan, total_frames):
+    """
+    Shortest period (in frames) after which the plan repeats, if looping pays off
+
+    Returns:
+        Period in frames, or None when the plan contains music, no period
+        up to LOOP_MAX_SECONDS fits, or the render is shorter than
+        LOOP_MIN_REPEATS periods
+    """
+    sample_rate = plan.sample_rate
+    freqs, intervals = [], []
+    for step in plan.steps:
+        if step.op == 'music':
+            return None
+        if step.op == 'oscillator':
+            freqs.extend(step.params['freqs'])
+        elif step.op == 'lfo':
+            freqs.append(step.params['rate'])
+        elif step.op == 'pulse_train':
+            # Bursts restart their tone and tremolo every interval, so only the interval matters
+            intervals.append(_pulse_frames(step, sample_rate)[1])
+
+    max_frames = min(int(LOOP_MAX_SECONDS * sample_rate), total_frames // LOOP_MIN_REPEATS)
+    grid = reduce(lambda a, b: a * b // gcd(a, b), intervals) if intervals else int(LOOP_GRID_SECONDS * sample_rate)
+    candidates = np.arange(1, max_frames // grid + 1, dtype=np.float64) * grid
+    # Seams need room for the crossfade and the limiter's context on both sides
+    candidates = candidates[candidates >= LOOP_MIN_SECONDS * sample_rate]
+    if not len(candidates):
+        return None
+    if freqs:
+        cycles = np.outer(candidates, np.asarray(freqs, dtype=np.float64) / sample_rate)
+        error = np.abs(cycles - np.round(cycles)).max(axis=1)
+        fits = np.flatnonzero(error <= LOOP_PHASE_TOLERANCE)
+        if not len(fits):
+            return None
+        return int(candidates[fits[0]])
+    return int(candidates[0])
+
+
+def aperiodic_from(plan, total_frames):
+    """First frame where the render departs from its period (pulse trains stop before the end)"""
+    first = total_frames
+    for step in plan.steps:
+        if step.op == 'pulse_train':
+            pulse_frames, interval_frames = _pulse_frames(step, plan.sample_rate)
+            remaining = total_frames - pulse_frames if step.params['fit_last'] else total_frames
+            pulse_count = max(0, -(-remaining // interval_frames))
+            first = min(first, pulse_count * interval_frames)
+    return first
+
+
+def _crossfade_frames(sample_rate, period):
+    return max(1, min(int(sample_rate * LOOP_CROSSFADE_MS / 1000), period // 4))
+
+
+def _tail_start(plan, total_frames, period, crossfade):
+    departure = aperiodic_from(plan, total_frames)
+    return max(period, departure - crossfade) if departure < total_frames else total_frames
+
+
+def loop_work_frames(plan, total_frames, period):
+    """Frames render_loop actually synthesizes (one period, the crossfade and the tail)"""
+    crossfade = _crossfade_frames(plan.sample_rate, period)
+    return period + crossfade + total_frames - _tail_start(plan, total_frames, period, crossfade)
+
+
+def render_loop(plan, total_frames, period, block_frames, on_block=None):
+    """
+    Render a plan by tiling one period
+
+    Args:
+        plan: RenderPlan without music
+        total_frames: Length of the render
+        period: Period from loop_period
+        block_frames: Frames rendered per block
+        on_block: Optional callback(num_frames) after each rendered block
+
+    Returns:
+        (float32 (total_frames, channels) mix, loop info dictionary for
+        limit_looped and the render metadata)
+    """
+    sample_rate, channels = plan.sample_rate, plan.channels
+    crossfade = _crossfade_frames(sample_rate, period)
+    fade_in = (np.arange(crossfade, dtype=np.float32) / crossfade)[:, None]
+
+    # One period plus the crossfade's worth of its continuation
+    renderer = plan.renderer(total_frames)
+    head = np.empty((period + crossfade, channels), dtype=np.float32)
+    for start in range(0, len(head), block_frames):
+        num_frames = min(block_frames, len(head) - start)
+        head[start:start + num_frames] = renderer.render_block(start, num_frames)
+        if on_block:
+            on_block(num_frames)
+
+    # Each repeat fades from where the previous period would have continued into the period's start
+    loop = head[:period].copy()
+    loop[:crossfade] = head[period:] * (1 - fade_in) + head[:crossfade] * fade_in
+
+    mix = np.empty((total_frames, channels), dtype=np.float32)
+    mix[:period] = head[:period]
+    for start in range(period, total_frames, period):
+        stop = min(start + period, total_frames)
+        mix[start:stop] = loop[:stop - start]
+
+    # Past the last full pulse of each train the render is no longer periodic: render it for real
+    tail_start = _tail_start(plan, total_frames, period, crossfade)
+    offloaded_cpu_s = renderer.offloaded_cpu_s
+    if tail_start < total_frames:
+        tail, tail_stats = render_slice(plan, total_frames, tail_start, total_frames, settle_frames(plan), block_frames)
+        offloaded_cpu_s += tail_stats['offloaded_cpu_s']
+        if on_block:
+            on_block(len(tail))
+        fade = min(crossfade, len(tail))
+        mix[tail_start:tail_start + fade] = (mix[tail_start:tail_start + fade] * (1 - fade_in[:fade])
+                                            + tail[:fade] * fade_in[:fade])
+        mix[tail_start + fade:] = tail[fade:]
+
+    return mix, {'period': period, 'crossfade': crossfade, 'tail_start': tail_start, 'loop': loop,
+                 'offloaded_cpu_s': offloaded_cpu_s}
+
+
+def meter_loop(meter, loop_info, block_frames):
+    """
+    Feed one period to a LoudnessMeter, wrapping around its end
+
+    The gating blocks that straddle the seam are included by metering the
+    start of the period again, so each position in the cycle is counted once.
+    """
+    loop = loop_info['loop']
+    wrap = int(round(meter.sample_rate * (GATE_BLOCK_SECONDS - GATE_STEP_SECONDS)))
+    for start in range(0, len(loop), block_frames):
+        meter.add(loop[start:start + block_frames])
+    meter.add(loop[:wrap])
+
+
+def limit_looped(mix, loop_info, sample_rate, ceiling_db=DEFAULT_TRUE_PEAK_DB, lookahead_ms=DEFAULT_LOOKAHEAD_MS,
+                 gain=1.0):
+    """
+    Apply gain and the true-peak limiter to a render_loop mix in place
+
+    Gives the same result as ``limit_true_peak`` over the whole mix: the
+    limiter only looks a few milliseconds around each frame, so every
+    frame away from the head crossfade and the tail gets the gain computed
+    once for the period (with wrap-around context).
+
+    Returns:
+        Maximum gain reduction applied by the limiter, in dB
+    """
+    period, loop = loop_info['period'], loop_info['loop']
+    context = limiter_context_frames(sample_rate, lookahead_ms)
+    exact_until = min(loop_info['crossfade'] + context, len(mix))
+    exact_from = max(exact_until, loop_info['tail_start'] - context)
+
+    head = mix[:exact_until + context].copy()
+    reductions = [limit_true_peak(head, sample_rate, ceiling_db, lookahead_ms, gain)]
+    tail = mix[max(0, exact_from - context):].copy()
+    reductions.append(limit_true_peak(tail, sample_rate, ceiling_db, lookahead_ms, gain))
+    wrapped = np.concatenate([loop[-context:], loop, loop[:context]])
+    reductions.append(limit_true_peak(wrapped, sample_rate, ceiling_db, lookahead_ms, gain))
+    limited = wrapped[context:context + period]
+
+    for start in range(0, exact_from, period):
+        low, high = max(start, exact_until), min(start + period, exact_from)
+        if low < high:
+            mix[low:high] = limited[low - start:high - start]
+    mix[:exact_until] = head[:exact_until]
+    mix[exact_from:] = tail[len(tail) - (len(mix) - exact_from):]
+    return max(reductions)
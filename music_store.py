@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Music Store
+Decode-once, memory-mapped PCM store for uploaded and downloaded music
+
+Each track is decoded a single time into a raw float32 sidecar
+(``<name>.f32``, interleaved frames x channels at the source sample rate)
+described by a JSON file (``<name>.json``). Renders open the PCM through
+``numpy.memmap``, so long sources page in lazily per block and are shared
+between worker processes through the OS page cache instead of being
+copied into each process's heap. The directory itself is the index, so
+every worker process sees the same tracks.
+
+Uploads are ingested as a stream (``add_stream``): the bytes are hashed,
+spooled to disk and piped into FFmpeg as they arrive. Memory per upload
+therefore stays at one chunk, and a file that is already stored is
+recognized by its SHA-256 without being decoded again.
+"""
+import hashlib
+import io
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from uap_signal_generator import audio_segment_class, find_ffmpeg, segment_to_array
+
+PCM_DTYPE = np.float32
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when a streamed upload exceeds its size limit"""
+
+
+class MusicSource:
+    """A stored track opened for reading"""
+
+    def __init__(self, name, samples, sample_rate, duration_ms):
+        self.name = name
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.duration_ms = duration_ms
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class MusicStore:
+    """
+    Directory of decoded tracks, keyed by (sanitized) filename
+
+    Args:
+        root: Directory holding the ``.f32`` and ``.json`` files
+        max_entries: Oldest tracks are evicted beyond this many (0 = unlimited)
+        max_bytes: Oldest tracks are evicted while their PCM exceeds this size (0 = unlimited)
+        on_store: Called after each track is stored instead of evicting inline
+            (e.g. to have a background reaper run ``evict``)
+    """
+
+    def __init__(self, root, max_entries=0, max_bytes=0, on_store=None):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_store = on_store or self.evict
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, name):
+        base = os.path.join(self.root, os.path.basename(name))
+        return base + '.f32', base + '.json'
+
+    def add(self, name, data, source='upload', **extra):
+        """
+        Decode encoded audio (bytes or a file path) and store it as PCM
+
+        Args:
+            name: Track name (already sanitized, e.g. with secure_filename)
+            data: Encoded audio bytes, or a path to an audio file
+            source: Where the track came from ('upload', 'youtube', ...)
+            **extra: Additional metadata to keep (e.g. title)
+
+        Returns:
+            Track metadata dictionary (see info)
+        """
+        # WAV is read natively by pydub; everything else is probed by FFmpeg
+        audio_format = 'wav' if name.lower().endswith('.wav') else None
+        source_file = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        segment = audio_segment_class().from_file(source_file, format=audio_format)
+        samples = segment_to_array(segment, segment.channels)
+        encoded_bytes = len(data) if isinstance(data, (bytes, bytearray)) else os.path.getsize(data)
+        return self.add_pcm(name, samples, segment.frame_rate, source=source, encoded_bytes=encoded_bytes, **extra)
+
+    def add_pcm(self, name, samples, sample_rate, source='upload', **extra):
+        """
+        Store already-decoded (frames, channels) float samples
+
+        The PCM file is written first and the JSON description last (both
+        atomically), so readers never see a half-written track.
+        """
+        samples = np.ascontiguousarray(samples, dtype=PCM_DTYPE)
+        pcm_path, _ = self._paths(name)
+        self._write_atomic(pcm_path, samples.tofile)
+        return self._describe(name, source, sample_rate, samples.shape[1], samples.shape[0], extra)
+
+    def add_file(self, name, path, sample_rate, channels, source='upload', **extra):
+        """
+        Decode any FFmpeg-readable file (e.g. a downloaded WebM/Opus or M4A
+        stream) straight into the PCM sidecar
+
+        FFmpeg writes float32 samples directly into the store file, so the
+        track is never held in memory or re-encoded to an intermediate format.
+        The source is converted to the given rate and channel count, which
+        lets renders at that rate use the memory map without resampling.
+
+        Args:
+            name: Track name (already sanitized)
+            path: Encoded audio file to decode
+            sample_rate: Sample rate of the stored PCM
+            channels: Channel count of the stored PCM
+            source: Where the track came from
+            **extra: Additional metadata to keep (e.g. title)
+
+        Returns:
+            Track metadata dictionary (see info)
+        """
+        ffmpeg_path = find_ffmpeg()
+        if not ffmpeg_path:
+            raise RuntimeError('FFmpeg is required to decode this file')
+        command = [ffmpeg_path, '-nostdin', '-v', 'error', '-i', path, '-vn',
+                   '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(sample_rate), 'pipe:1']
+
+        def decode(f):
+            result = subprocess.run(command, stdout=f, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise RuntimeError(f"FFmpeg could not decode audio: {result.stderr.decode('utf-8', 'replace').strip()[-500:]}")
+
+        pcm_path, _ = self._paths(name)
+        self._write_atomic(pcm_path, decode)
+        frames = os.path.getsize(pcm_path) // (np.dtype(PCM_DTYPE).itemsize * channels)
+        if not frames:
+            self.remove(name)
+            raise RuntimeError('Decoded audio is empty')
+        return self._describe(name, source, sample_rate, channels, frames,
+                              {'encoded_bytes': os.path.getsize(path), **extra})
+
+    def add_stream(self, name, stream, sample_rate, channels, source='upload', max_bytes=None, **extra):
+        """
+        Ingest encoded audio from a file-like stream, chunk by chunk
+
+        Each chunk is hashed, appended to a spool file and piped into FFmpeg,
+        which decodes straight into the PCM sidecar while the upload is still
+        arriving. Containers FFmpeg cannot read from a pipe (e.g. MP4 files
+        with their index at the end) are decoded from the spool file instead.
+        If a stored track has the same SHA-256, the decode is abandoned and
+        that track is returned.
+
+        Args:
+            name: Track name (already sanitized)
+            stream: Readable binary stream (e.g. a request body)
+            sample_rate: Sample rate of the stored PCM
+            channels: Channel count of the stored PCM
+            source: Where the track came from
+            max_bytes: Upload size limit (None = unlimited)
+            **extra: Additional metadata to keep
+
+        Raises:
+            UploadTooLargeError: If the stream exceeds max_bytes
+            RuntimeError: If FFmpeg is missing or the audio can't be decoded
+
+        Returns:
+            Track metadata dictionary (see info); ``duplicate`` is set when an
+            existing track was returned instead
+        """
+        ffmpeg_path = find_ffmpeg()
+        if not ffmpeg_path:
+            raise RuntimeError('FFmpeg is required to decode this file')
+        command = [ffmpeg_path, '-v', 'error', '-i', 'pipe:0', '-vn',
+                   '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(sample_rate), 'pipe:1']
+
+        digest = hashlib.sha256()
+        received = 0
+        spool_fd, spool_path = tempfile.mkstemp(dir=self.root, suffix='.upload')
+        pcm_fd, pcm_tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            # stderr goes to a file: a full pipe would stall FFmpeg while we are still feeding it
+            with os.fdopen(spool_fd, 'wb') as spool, os.fdopen(pcm_fd, 'wb') as pcm, tempfile.TemporaryFile() as errors:
+                process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=pcm, stderr=errors)
+                try:
+                    piping = True
+                    while True:
+                        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                        if max_bytes is not None and received > max_bytes:
+                            raise UploadTooLargeError(f'Upload exceeds {max_bytes} bytes')
+                        digest.update(chunk)
+                        spool.write(chunk)
+                        if piping:
+                            try:
+                                process.stdin.write(chunk)
+                            except BrokenPipeError:
+                                piping = False  # FFmpeg gave up on the pipe; the spool file still has everything
+
+                    sha256 = digest.hexdigest()
+                    existing = self.find(sha256)
+                    if existing is not None:
+                        print(f"[MUSIC] {name} is already stored as {existing['name']}")
+                        return {**existing, 'duplicate': True}
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                    piped_ok = process.wait() == 0
+                finally:
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+
+            if not received:
+                raise RuntimeError('Upload is empty')
+            frames = os.path.getsize(pcm_tmp_path) // (np.dtype(PCM_DTYPE).itemsize * channels)
+            if piped_ok and frames:
+                os.replace(pcm_tmp_path, self._paths(name)[0])
+                return self._describe(name, source, sample_rate, channels, frames,
+                                      {'encoded_bytes': received, 'sha256': sha256, **extra})
+            # Not decodable as a stream: decode the complete file from the spool
+            return self.add_file(name, spool_path, sample_rate, channels, source=source, sha256=sha256, **extra)
+        finally:
+            for path in (spool_path, pcm_tmp_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def find(self, sha256):
+        """Metadata of the stored track whose encoded source has this SHA-256, or None"""
+        for track in self.list():
+            if track.get('sha256') == sha256:
+                return track
+        return None
+
+    def _describe(self, name, source, sample_rate, channels, frames, extra):
+        _, meta_path = self._paths(name)
+        info = {
+            'name': name,
+            'source': source,
+            'sample_rate': int(sample_rate),
+            'channels': int(channels),
+            'frames': int(frames),
+            'duration_ms': int(round(1000 * frames / sample_rate)),
+            'pcm_bytes': int(frames * channels * np.dtype(PCM_DTYPE).itemsize),
+            'created': time.time(),
+            **extra
+        }
+        self._write_atomic(meta_path, lambda f: f.write(json.dumps(info).encode('utf-8')))
+        self.on_store()
+        return info
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def info(self, name):
+        """Metadata for a stored track, or None if it isn't stored"""
+        _, meta_path = self._paths(name)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __contains__(self, name):
+        return self.info(name) is not None
+
+    def list(self):
+        """Metadata of every stored track, oldest first"""
+        tracks = []
+        for filename in os.listdir(self.root):
+            if filename.endswith('.json'):
+                info = self.info(filename[:-len('.json')])
+                if info:
+                    tracks.append(info)
+        return sorted(tracks, key=lambda track: track['created'])
+
+    def open(self, name):
+        """
+        Open a stored track as a read-only memory map
+
+        Returns:
+            MusicSource, or None if the track isn't stored
+        """
+        info = self.info(name)
+        if not info:
+            return None
+        pcm_path, _ = self._paths(name)
+        try:
+            samples = np.memmap(pcm_path, dtype=PCM_DTYPE, mode='r', shape=(info['frames'], info['channels']))
+        except (OSError, ValueError):
+            return None
+        return MusicSource(name, samples, info['sample_rate'], info['duration_ms'])
+
+    def remove(self, name):
+        # Description first, so the track disappears from listings before its PCM does.
+        # Open memory maps stay valid after unlinking on POSIX; on Windows a mapped file can't be removed yet.
+        for path in reversed(self._paths(name)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[MUSIC] Could not remove {path}: {e}")
+
+    def evict(self):
+        """Remove the oldest tracks beyond max_entries or max_bytes; returns the number removed"""
+        if not self.max_entries and not self.max_bytes:
+            return 0
+        with self._lock:
+            tracks = self.list()
+            excess = max(0, len(tracks) - self.max_entries) if self.max_entries else 0
+            if self.max_bytes:
+                total = sum(track['pcm_bytes'] for track in tracks[excess:])
+                # The newest track stays even if it alone is over budget
+                while excess < len(tracks) - 1 and total > self.max_bytes:
+                    total -= tracks[excess]['pcm_bytes']
+                    excess += 1
+            for track in tracks[:excess]:
+                self.remove(track['name'])
+            return excess
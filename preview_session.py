@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Live Preview
+Short looping renders that follow parameter changes incrementally
+
+A preview session keeps a few seconds of the design rendered as a seamless
+loop, together with the output of every render step and every layer. When
+the configuration changes, the new plan is compiled (cheap, and usually a
+plan cache hit) and each step is identified by a content signature: its op,
+its parameters and the signatures of its inputs. Steps whose signature is
+already known are reused; only the ones a change actually touches (the
+oscillator whose frequency moved, the LFO whose depth changed and the
+products downstream of them) are synthesized again. Layers are re-summed
+only if one of their steps or factors changed, so gain and pan tweaks skip
+synthesis entirely.
+
+Pulse trains run as they do mid-render (they never stop early), and the
+loop length is rounded up to a whole number of pulse intervals where that
+stays short, so the loop repeats without a hiccup. Mastering is reduced to
+loudness normalization and a peak guard: the limiter would cost more than
+the whole incremental update.
+"""
+import hashlib
+import io
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import reduce
+from math import gcd
+
+import numpy as np
+
+from loop_render import LOOP_CROSSFADE_MS
+from signal_graph import compile_graph, db_to_gain, graph_hash
+from signal_mastering import LoudnessMeter, normalization_gain_db
+from uap_signal_generator import (
+    DEFAULT_CONFIG, array_to_segment, build_hybrid_graph, encode_signal, resample_audio
+)
+
+PREVIEW_SECONDS = 10
+PREVIEW_MAX_SECONDS = 30
+PREVIEW_IDLE_SECONDS = 600  # Sessions nobody has touched for this long are dropped
+PREVIEW_STEADY_FRAMES = 1 << 48  # Timeline length given to the renderer, so pulse trains never run out
+
+
+def step_signatures(plan):
+    """Content signature of every step of a plan (op, parameters and input signatures)"""
+    signatures = []
+    for step in plan.steps:
+        signatures.append(graph_hash({
+            'op': step.op, 'params': step.params, 'inputs': [signatures[i] for i in step.inputs]
+        }))
+    return signatures
+
+
+class PreviewClosedError(Exception):
+    """Raised when updating a session that has been dropped"""
+    pass
+
+
+def layer_signature(terms, signatures):
+    """Content signature of a layer's terms"""
+    return graph_hash([[None if step is None else signatures[step], [float(f) for f in factor]]
+                       for step, factor in terms])
+
+
+class PreviewSession:
+    """
+    One live preview: a looping render buffer plus its per-step and per-layer results
+
+    Args:
+        session_id: Identifier used in URLs
+        config: Configuration overrides (merged over DEFAULT_CONFIG)
+        music_source: Optional decoded music; the preview uses its opening seconds
+        seconds: Loop length before rounding to whole pulse intervals
+    """
+
+    def __init__(self, session_id, config, music_source=None, seconds=PREVIEW_SECONDS):
+        self.session_id = session_id
+        self.seconds = min(max(float(seconds), 1.0), PREVIEW_MAX_SECONDS)
+        self.music_source = music_source
+        self.config = dict(DEFAULT_CONFIG)
+        # Noise is seeded per session, so re-rendered noise keeps its character
+        self.noise_seed = int.from_bytes(hashlib.sha256(session_id.encode('utf-8')).digest()[:8], 'little')
+
+        self.version = 0
+        self.audio = None  # WAV bytes of the current loop
+        self.last_update = {}
+        self.last_used = time.monotonic()
+        self.closed = False
+
+        self._format = None  # (sample_rate, channels, frames) the cached results belong to
+        self._music = None
+        self._steps = {}  # Step signature -> (frames, 1 or channels) output
+        self._layers = {}  # Layer signature -> (frames, channels) layer mix
+        self._changed = threading.Condition()
+
+        self.update(config or {})
+
+    def _loop_frames(self, plan, sample_rate):
+        frames = int(self.seconds * sample_rate)
+        intervals = [int(sample_rate * step.params['interval_ms'] / 1000.0)
+                     for step in plan.steps if step.op == 'pulse_train']
+        if intervals:
+            grid = reduce(lambda a, b: a * b // gcd(a, b), intervals)
+            limit = int(PREVIEW_MAX_SECONDS * sample_rate)
+            if grid <= limit:
+                # Round up to whole grids, but never past PREVIEW_MAX_SECONDS
+                frames = max(1, min(-(-frames // grid), limit // grid)) * grid
+        return frames
+
+    def _music_excerpt(self, sample_rate, frames):
+        if self.music_source is None:
+            return None
+        source = self.music_source
+        excerpt = np.asarray(source.samples[:int(np.ceil(frames * source.sample_rate / sample_rate)) + 1])
+        if source.sample_rate != sample_rate:
+            excerpt = resample_audio(excerpt, source.sample_rate, sample_rate)
+        if len(excerpt) < frames:
+            # Short tracks loop within the preview, as the preview itself does
+            excerpt = np.resize(excerpt, (frames, excerpt.shape[1]))
+        return excerpt[:frames]
+
+    def _plan(self, config):
+        sample_rate, channels = int(config['sample_rate']), int(config['channels'])
+        has_music = self.music_source is not None
+        graph = config.get('graph') or build_hybrid_graph(config, has_music=has_music)
+        plan = compile_graph(graph, sample_rate, channels, has_music=has_music,
+                             min_audible_freq=float(config['min_audible_freq']))
+        return plan, sample_rate, channels, self._loop_frames(plan, sample_rate)
+
+    def pending_steps(self, overrides):
+        """
+        Number of steps an update with these overrides would synthesize (0 = a re-mix of cached results)
+
+        Raises:
+            As for ``update``
+        """
+        with self._changed:
+            plan, sample_rate, channels, frames = self._plan({**self.config, **overrides})
+            if self._format != (sample_rate, channels, frames):
+                return len(plan.steps)
+            return sum(1 for signature in step_signatures(plan) if signature not in self._steps)
+
+    def update(self, overrides):
+        """
+        Apply configuration overrides and re-render what they affect
+
+        Raises:
+            PreviewClosedError: If the session has been dropped
+            GraphValidationError: If a custom layer graph is invalid
+            TypeError, ValueError, KeyError: If the configuration is malformed
+
+        Returns:
+            Update summary: version, loop duration, render time and the steps and layers re-rendered
+        """
+        with self._changed:
+            if self.closed:
+                raise PreviewClosedError(f'Preview {self.session_id} has been dropped')
+            started = time.perf_counter()
+            config = {**self.config, **overrides}
+            has_music = self.music_source is not None
+            plan, sample_rate, channels, frames = self._plan(config)
+            crossfade = max(1, min(int(sample_rate * LOOP_CROSSFADE_MS / 1000), frames // 4))
+            render_frames = frames + crossfade
+            if self._format != (sample_rate, channels, frames):
+                self._steps, self._layers = {}, {}
+                self._music = self._music_excerpt(sample_rate, render_frames) if has_music else None
+                self._format = (sample_rate, channels, frames)
+
+            signatures = step_signatures(plan)
+            renderer = plan.renderer(PREVIEW_STEADY_FRAMES, music=self._music, noise_seed=self.noise_seed)
+            steps, rendered = {}, 0
+            for index, step in enumerate(plan.steps):
+                output = self._steps.get(signatures[index])
+                if output is None:
+                    inputs = [steps[signatures[i]] for i in step.inputs]
+                    output = renderer.render_step(index, step, inputs, 0, render_frames)
+                    rendered += 1
+                steps[signatures[index]] = output
+
+            layers, remixed = {}, 0
+            mix = np.zeros((render_frames, channels), dtype=np.float32)
+            for _, terms in plan.layers:
+                key = layer_signature(terms, signatures)
+                layer = self._layers.get(key)
+                if layer is None:
+                    layer = np.zeros((render_frames, channels), dtype=np.float32)
+                    for step, factor in terms:
+                        layer += factor if step is None else steps[signatures[step]] * factor
+                    remixed += 1
+                layers[key] = layer
+                mix += layer
+            # Only the current plan's results are kept, which bounds a session's memory
+            self._steps, self._layers = steps, layers
+
+            # Fade the continuation past the loop end into its start, as loop rendering does
+            fade_in = (np.arange(crossfade, dtype=np.float32) / crossfade)[:, None]
+            loop = mix[:frames]
+            loop[:crossfade] = mix[frames:] * (1 - fade_in) + loop[:crossfade] * fade_in
+
+            gain = 1.0
+            if config.get('mastering'):
+                meter = LoudnessMeter(sample_rate, channels)
+                meter.add(loop)
+                gain = db_to_gain(normalization_gain_db(meter.integrated_loudness(), config['target_lufs']))
+                peak = float(np.abs(loop).max()) * gain
+                ceiling = db_to_gain(config['true_peak_db'])
+                if peak > ceiling:
+                    gain *= ceiling / peak
+            loop *= gain
+
+            buffer = io.BytesIO()
+            encode_signal(array_to_segment(loop, sample_rate), buffer, 'wav')
+
+            self.config = config
+            self.audio = buffer.getvalue()
+            self.version += 1
+            self.last_used = time.monotonic()
+            self.last_update = {
+                'version': self.version,
+                'duration_ms': int(frames * 1000 / sample_rate),
+                'render_ms': round((time.perf_counter() - started) * 1000, 1),
+                'steps_rendered': rendered,
+                'steps_reused': len(plan.steps) - rendered,
+                'layers_remixed': remixed,
+                'layers': plan.layer_names
+            }
+            self._changed.notify_all()
+            return self.last_update
+
+    def wait_for_version(self, version, timeout):
+        """
+        Block until the preview is newer than ``version`` (or the session closes)
+
+        Returns:
+            The latest update summary, or None on timeout
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version or self.closed, timeout)
+            return self.last_update if self.version > version else None
+
+    def nbytes(self):
+        """Memory held by the session's step and layer results, music excerpt and current loop"""
+        arrays = [*self._steps.values(), *self._layers.values()]
+        if self._music is not None:
+            arrays.append(self._music)
+        return sum(array.nbytes for array in arrays) + len(self.audio or b'')
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._steps, self._layers = {}, {}
+            self._changed.notify_all()
+
+
+class PreviewRegistry:
+    """
+    Live preview sessions, dropped when idle or over the byte budget (see ``expire``)
+    or when the newest exceed ``max_sessions``
+
+    Args:
+        max_sessions: Sessions kept at once
+        idle_seconds: Idle time after which a session is dropped
+        max_bytes: Least recently used sessions are dropped while the sessions hold more (0 = unlimited)
+        on_change: Called after each render instead of running ``expire`` inline
+            (e.g. to have a background reaper run it)
+    """
+
+    def __init__(self, max_sessions, idle_seconds=PREVIEW_IDLE_SECONDS, max_bytes=0, on_change=None):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self.on_change = on_change or self.expire
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.updates = 0
+
+    def create(self, config, music_source=None, seconds=PREVIEW_SECONDS, run=None):
+        """
+        Start a session with its first render (errors as for ``PreviewSession.update``)
+
+        Args:
+            run: Optional callable that executes the render callable and returns its
+                result (e.g. on a render queue worker); by default it runs here
+        """
+        def start():
+            return PreviewSession(uuid.uuid4().hex, config, music_source, seconds)
+
+        session = run(start) if run else start()
+        with self._lock:
+            self._sessions[session.session_id] = session
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+        # Closed outside the registry lock: close() waits for a render in progress
+        for dropped in evicted:
+            dropped.close()
+        self.on_change()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_used = time.monotonic()
+            return session
+
+    def update(self, session, overrides, run=None):
+        """
+        Apply overrides to a session (errors as for ``PreviewSession.update``)
+
+        Args:
+            run: As for ``create``; used only when the update synthesizes steps,
+                so re-mixes of cached results stay on the calling thread
+        """
+        if run and session.pending_steps(overrides):
+            summary = run(lambda: session.update(overrides))
+        else:
+            summary = session.update(overrides)
+        with self._lock:
+            self.updates += 1
+        self.on_change()
+        return summary
+
+    def expire(self):
+        """
+        Drop sessions idle for longer than idle_seconds, then the least recently used
+        while the rest exceed max_bytes (run periodically and after renders)
+
+        Returns:
+            The number of sessions dropped
+        """
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            expired = [self._sessions.pop(sid) for sid, session in list(self._sessions.items())
+                       if session.last_used < cutoff]
+            if self.max_bytes:
+                total = sum(session.nbytes() for session in self._sessions.values())
+                # The most recently used session stays even if it alone is over budget
+                while len(self._sessions) > 1 and total > self.max_bytes:
+                    _, session = self._sessions.popitem(last=False)
+                    total -= session.nbytes()
+                    expired.append(session)
+        # Closed outside the registry lock: close() waits for a render in progress,
+        # which must not hold up get() and stats() for other sessions
+        for session in expired:
+            session.close()
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'updates': self.updates,
+                    'bytes': sum(session.nbytes() for session in self._sessions.values())}
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Render Cache
+Content-keyed cache of finished renders, and an opt-in warm-up that fills it
+
+The key covers the effective configuration (DEFAULT_CONFIG merged with the
+request's overrides), the duration, the exact stored music track and the
+output format, so equal keys mean equal render inputs. Downloads derive
+their strong ETags from it.
+
+Cached results hold the encoded MP3 together with its visualization data,
+so a repeat request completes without rendering, encoding or analysis.
+``CacheWarmer`` pre-renders common requests (e.g. every preset at 10 s) in
+the background at startup and optionally on a schedule.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from render_queue import QueueFullError
+from uap_signal_generator import DEFAULT_CONFIG
+
+# Bump when a change to the generator or encoder alters the output for the same inputs
+RENDER_FORMAT_VERSION = 2
+MUSIC_ONLY_KEYS = ('use_music_modulation', 'use_music_as_foundation')
+WARMUP_RETRY_S = 60  # Pause between warm-up passes while a pass keeps failing
+WARMUP_DEFER_S = 5  # Pause before retrying a pass cut short because user renders were waiting
+
+
+def _canonical(value):
+    """Normalize values that render identically (e.g. 100 and 100.0) to one JSON form"""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def render_key(config, duration_ms, music_info=None, output_format='mp3'):
+    """
+    Stable content hash of a render's inputs
+
+    Args:
+        config: Configuration overrides as sent by the client
+        duration_ms: Requested duration in milliseconds
+        music_info: Music store metadata of the track used, or None
+        output_format: Encoded output format
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    config = {key: _canonical(value) for key, value in {**DEFAULT_CONFIG, **(config or {})}.items()}
+    music = None
+    if music_info:
+        # A re-added track gets a new creation time, so it never matches an older render
+        music = {key: music_info.get(key) for key in ('name', 'created', 'frames', 'sample_rate', 'channels')}
+    else:
+        # Music options have no effect without music
+        for key in MUSIC_ONLY_KEYS:
+            config.pop(key, None)
+    canonical = json.dumps({
+        'version': RENDER_FORMAT_VERSION,
+        'config': config,
+        'duration_ms': int(duration_ms),
+        'music': music,
+        'format': output_format
+    }, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def content_etag(key, data):
+    """
+    Strong ETag for encoded render output
+
+    Unseeded noise layers make renders with the same key differ byte for
+    byte, so the key is combined with a short digest of the bytes themselves.
+    """
+    digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+    return f'{key[:32]}-{digest}'
+
+
+class RenderCache:
+    """
+    LRU cache of finished render results, bounded by encoded size
+
+    Args:
+        max_bytes: Total MP3 bytes kept (least recently used results are evicted)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(result):
+        return len(result.get('mp3_data') or b'')
+
+    def get(self, key):
+        """Cached result for a render key, or None"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, result):
+        """Store a result (treated as read-only from now on); results larger than the budget are skipped"""
+        size = self._size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._size(previous)
+            self._entries[key] = result
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class CacheWarmer:
+    """
+    Background thread pre-rendering common requests into a RenderCache
+
+    A pass stops early, and is retried after WARMUP_DEFER_S, while ``busy``
+    reports user work waiting or ``render`` raises QueueFullError.
+
+    Args:
+        cache: RenderCache to fill
+        jobs: List of (render key, request data) pairs
+        render: Callable taking request data and returning the task result dict
+            (e.g. by running it as a background render queue job)
+        interval_s: Re-run the warm-up this often (0 = once), restoring evicted entries
+        busy: Optional callable; true while user renders are waiting
+    """
+
+    def __init__(self, cache, jobs, render, interval_s=0, busy=None):
+        self.cache = cache
+        self.jobs = list(jobs)
+        self.render = render
+        self.interval_s = interval_s
+        self.busy = busy
+        self.state = 'idle'
+        self.completed = 0
+        self.failed = 0
+        self.current = None
+        self.passes = 0
+        self.last_pass_s = None
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name='render-warmup', daemon=True)
+        self._thread.start()
+
+    def status(self):
+        """Warm-up progress for /health"""
+        total = len(self.jobs)
+        return {
+            'state': self.state,
+            'completed': self.completed,
+            'failed': self.failed,
+            'total': total,
+            'progress': int(100 * (self.completed + self.failed) / total) if total else 100,
+            'current': self.current,
+            'passes': self.passes,
+            'last_pass_s': self.last_pass_s
+        }
+
+    def run_pass(self):
+        """
+        Render every job whose result isn't cached yet
+
+        Returns:
+            The number of failures (state is 'deferred' if the pass was cut short)
+        """
+        self.state = 'running'
+        self.completed = self.failed = 0
+        started = time.perf_counter()
+        for key, data in self.jobs:
+            self.current = f"{data.get('preset_name', 'custom')} ({int(data.get('duration', 10000))} ms)"
+            if key not in self.cache:
+                try:
+                    if self.busy and self.busy():
+                        raise QueueFullError('User renders are waiting')
+                    self.cache.put(key, self.render(data))
+                except QueueFullError:
+                    self.current = None
+                    self.state = 'deferred'
+                    return self.failed
+                except Exception as e:
+                    self.failed += 1
+                    print(f"[WARMUP] {self.current} failed: {e}")
+                    continue
+            self.completed += 1
+        self.current = None
+        self.passes += 1
+        self.last_pass_s = round(time.perf_counter() - started, 2)
+        self.state = 'done'
+        print(f"[WARMUP] Pass {self.passes}: {self.completed}/{len(self.jobs)} cached in {self.last_pass_s}s")
+        return self.failed
+
+    def _loop(self):
+        while True:
+            failed = self.run_pass()
+            if self.state == 'deferred':
+                time.sleep(WARMUP_DEFER_S)
+                continue
+            if not self.interval_s:
+                if not failed:
+                    return
+                # e.g. FFmpeg briefly unavailable at boot; keep trying the failed renders
+                time.sleep(WARMUP_RETRY_S)
+                continue
+            self.state = 'waiting'
+            time.sleep(self.interval_s)
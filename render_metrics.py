@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Render Metrics
+Per-stage render spans (wall/CPU time, allocations, buffer sizes), progress
+and ETA estimation from historical stage throughput, and a small
+Prometheus-compatible registry for the /metrics endpoint
+"""
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Allocation tracing is costly, so it is opt-in (set PROFILE_ALLOCATIONS=true)
+PROFILE_ALLOCATIONS = os.getenv('PROFILE_ALLOCATIONS', 'false').lower() == 'true'
+# tracemalloc's peak is process-wide, so traced spans run one at a time (re-entrant for nested spans)
+_allocation_trace_lock = threading.RLock()
+
+# Seconds per work unit for each stage, used until real renders have been measured.
+# Units: bytes of input for load_music, frames x (steps + layers) for render,
+# frames x channels for the audio passes, and one unit per plan compilation.
+DEFAULT_SECONDS_PER_UNIT = {
+    'load_music': 1e-7,
+    'compile_plan': 2e-3,
+    'render': 1.5e-8,
+    'mastering': 3e-7,
+    'finalize': 5e-9,
+    'encode': 3e-7,
+    'visualize': 5e-9
+}
+THROUGHPUT_SMOOTHING = 0.2  # Weight of the newest measurement in the moving average
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class ThroughputModel:
+    """
+    Moving average of seconds per work unit for each render stage
+
+    Seeded with DEFAULT_SECONDS_PER_UNIT and refined from every finished
+    render, so estimates track the machine the app actually runs on.
+    """
+
+    def __init__(self, defaults=None):
+        self._seconds_per_unit = dict(defaults or DEFAULT_SECONDS_PER_UNIT)
+        self._lock = threading.Lock()
+
+    def seconds_per_unit(self, stage):
+        with self._lock:
+            return self._seconds_per_unit.get(stage, 0.0)
+
+    def predict(self, stage, units):
+        """Predicted wall time (s) for a stage of the given size"""
+        return self.seconds_per_unit(stage) * units
+
+    def observe(self, stage, units, seconds):
+        if units <= 0:
+            return
+        rate = seconds / units
+        with self._lock:
+            previous = self._seconds_per_unit.get(stage)
+            self._seconds_per_unit[stage] = rate if previous is None else (
+                previous + THROUGHPUT_SMOOTHING * (rate - previous))
+
+
+THROUGHPUT = ThroughputModel()
+
+
+class RenderProfile:
+    """
+    Collects timing spans for one render and estimates its progress
+
+    Wall time uses ``perf_counter``; CPU time uses ``thread_time`` so
+    concurrent renders on other threads don't inflate each other's figures.
+    Work a stage hands to other threads or processes (the render pool, slice
+    workers) is added from the span's ``offloaded_cpu_s`` attribute.
+
+    Stages announced with ``expect`` are sized in work units and priced
+    with the throughput model; ``progress()`` combines those predictions
+    with measured time (and, inside the current stage, the measured rate
+    of ``advance`` calls) into a percentage and ETA.
+    """
+
+    def __init__(self, trace_allocations=None, trailing_stages=(), model=None):
+        """
+        Args:
+            trace_allocations: Record bytes allocated per stage (defaults to PROFILE_ALLOCATIONS)
+            trailing_stages: Stages run by the caller after the generator (e.g. encode), sized
+                in frames x channels once the generator announces the audio size
+            model: ThroughputModel used for predictions (defaults to the shared THROUGHPUT)
+        """
+        self.spans = []
+        self.trace_allocations = PROFILE_ALLOCATIONS if trace_allocations is None else trace_allocations
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.model = model or THROUGHPUT
+        self.trailing_stages = tuple(trailing_stages)
+        self.expected = {}
+        self.samples_total = None
+        self.samples_rendered = 0
+        self._current = None  # (stage, wall start, units done, units total)
+        self._started = time.perf_counter()
+
+    def expect(self, audio_units=None, **stage_units):
+        """
+        Announce upcoming stages and their size in work units
+
+        Args:
+            audio_units: Frames x channels of the finished audio; sizes the trailing stages
+            **stage_units: Work units per stage name
+        """
+        self.expected.update(stage_units)
+        if audio_units is not None:
+            for stage in self.trailing_stages:
+                self.expected[stage] = audio_units
+
+    def predicted_seconds(self):
+        """Predicted wall time of all expected stages, from the throughput model alone"""
+        return sum(self.model.predict(stage, units) for stage, units in self.expected.items())
+
+    def advance(self, units, samples=0):
+        """Record work done inside the current stage (and samples rendered, if any)"""
+        if self._current:
+            stage, started, done, total = self._current
+            self._current = (stage, started, done + units, total)
+        self.samples_rendered += samples
+
+    def progress(self):
+        """
+        Current progress estimate
+
+        Returns:
+            Dictionary with progress (0-99 until the caller finishes), eta_s,
+            elapsed_s, predicted_total_s, stage, samples_rendered and samples_total
+        """
+        now = time.perf_counter()
+        finished = {span['stage'] for span in self.spans}
+        remaining = 0.0
+        stage = None
+        if self._current:
+            stage, started, done, total = self._current
+            stage_elapsed = now - started
+            predicted = self.model.predict(stage, self.expected.get(stage, 0))
+            if total and done:
+                # Extrapolate from the rate measured so far in this stage
+                remaining += stage_elapsed * max(0, total - done) / done
+            else:
+                remaining += max(0.0, predicted - stage_elapsed)
+            finished.add(stage)
+        for name, units in self.expected.items():
+            if name not in finished:
+                remaining += self.model.predict(name, units)
+
+        elapsed = now - self._started
+        predicted_total = elapsed + remaining
+        percent = int(99 * elapsed / predicted_total) if predicted_total > 0 else 0
+        return {
+            'progress': min(99, percent),
+            'eta_s': round(remaining, 1),
+            'elapsed_s': round(elapsed, 1),
+            'predicted_total_s': round(predicted_total, 1),
+            'stage': stage,
+            'samples_rendered': self.samples_rendered,
+            'samples_total': self.samples_total
+        }
+
+    @contextmanager
+    def span(self, stage, units=None, **attributes):
+        """
+        Time a stage; yields the span's attribute dict so callers can add
+        details (e.g. buffer sizes) once they are known
+
+        With allocation tracing on, spans of concurrent renders take turns:
+        tracemalloc's peak is process-wide, and a span running alongside
+        another would reset or inflate its figure. The wait is not timed.
+
+        Args:
+            stage: Stage name
+            units: Total work units, if ``advance`` will report progress within the stage
+            **attributes: Initial span attributes
+        """
+        if self.trace_allocations:
+            _allocation_trace_lock.acquire()
+            tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        self._current = (stage, wall_start, 0, units)
+        try:
+            yield attributes
+        finally:
+            if self.trace_allocations:
+                allocated_peak = tracemalloc.get_traced_memory()[1]
+                _allocation_trace_lock.release()
+            self._current = None
+            span = {
+                'stage': stage,
+                'wall_s': round(time.perf_counter() - wall_start, 6),
+                'cpu_s': round(time.thread_time() - cpu_start + attributes.get('offloaded_cpu_s', 0.0), 6),
+                'allocated_bytes': None,
+                'attributes': attributes
+            }
+            if self.trace_allocations:
+                span['allocated_bytes'] = max(0, allocated_peak - allocated_before)
+            self.spans.append(span)
+
+    def as_dict(self):
+        return {
+            'spans': self.spans,
+            'total_wall_s': round(sum(span['wall_s'] for span in self.spans), 6),
+            'total_cpu_s': round(sum(span['cpu_s'] for span in self.spans), 6),
+            'work_units': dict(self.expected)
+        }
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in Prometheus text format"""
+
+    def __init__(self, name, documentation, label_names, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.setdefault(label_values, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    labels = _format_labels(self.label_names, label_values, [('le', repr(float(bound)))])
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.label_names, label_values, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {series["count"]}')
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f'{self.name}_sum{labels} {series["sum"]}')
+                lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter in Prometheus text format"""
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'uap_render_stage_seconds', 'Wall time spent in each render stage', ('stage', 'preset')))
+STAGE_CPU_SECONDS = REGISTRY.register(Histogram(
+    'uap_render_stage_cpu_seconds', 'CPU time spent in each render stage', ('stage', 'preset')))
+RENDER_SECONDS = REGISTRY.register(Histogram(
+    'uap_render_seconds', 'Wall time for a complete render task', ('preset',)))
+RENDERS_TOTAL = REGISTRY.register(Counter(
+    'uap_renders_total', 'Render tasks finished, by outcome', ('preset', 'status')))
+
+
+def record_profile(profile, preset, status='completed'):
+    """Feed a finished render's spans into the Prometheus histograms and the throughput model"""
+    for span in profile.spans:
+        STAGE_SECONDS.observe(span['wall_s'], span['stage'], preset)
+        STAGE_CPU_SECONDS.observe(span['cpu_s'], span['stage'], preset)
+        if status == 'completed' and span['stage'] in profile.expected:
+            profile.model.observe(span['stage'], profile.expected[span['stage']], span['wall_s'])
+    RENDER_SECONDS.observe(sum(span['wall_s'] for span in profile.spans), preset)
+    RENDERS_TOTAL.inc(preset, status)
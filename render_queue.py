@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Render Queue
+Bounded, priority-aware job queue with per-client fairness and cost-based
+admission control, drained by a fixed pool of worker threads
+"""
+import itertools
+import threading
+import time
+
+# Priority classes by estimated render time: short renders run ahead of hour-long ones
+PRIORITY_THRESHOLDS_S = (15.0, 120.0)
+# A waiting job gains one priority class per this many seconds, so long renders can't starve
+PRIORITY_AGING_S = 120.0
+
+
+class QueueFullError(Exception):
+    """Raised when a job is refused by admission control"""
+
+
+class RenderJob:
+    """One queued or running render"""
+
+    def __init__(self, job_id, client_id, cost_s, run, seq, background=False):
+        self.job_id = job_id
+        self.client_id = client_id
+        self.cost_s = cost_s
+        self.run = run
+        self.seq = seq
+        self.background = background
+        self.priority = sum(cost_s > threshold for threshold in PRIORITY_THRESHOLDS_S)
+        self.submitted = time.monotonic()
+        self.status = 'queued'
+
+
+class RenderQueue:
+    """
+    Job queue replacing the old fixed concurrent-task counter
+
+    Jobs are admitted only while the queue has room: at most
+    ``max_queued`` waiting jobs, ``max_per_client`` queued-or-running jobs
+    per client and ``max_queued_cost_s`` seconds of estimated work waiting.
+    A job is always admitted when nothing is waiting, so a single long
+    render can still run on an idle server.
+
+    Workers take the job whose client has the fewest running renders,
+    then the best priority class (aged by waiting time), then the oldest.
+
+    Background jobs (e.g. cache warm-up) run only when no other job is
+    waiting. They are admitted only into an empty queue and don't count
+    against the admission limits of other jobs.
+    """
+
+    def __init__(self, workers, max_queued, max_per_client, max_queued_cost_s):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.max_queued_cost_s = max_queued_cost_s
+        self._queued = []
+        self._jobs = {}
+        self._running_by_client = {}
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def submit(self, job_id, client_id, cost_s, run, background=False, max_per_client=None):
+        """
+        Admit a job or refuse it
+
+        Args:
+            job_id: Unique job (task) ID
+            client_id: Fairness key, e.g. the API key or client address
+            cost_s: Estimated render time in seconds
+            run: Zero-argument callable executed on a worker thread
+            background: Run only when nothing else is waiting
+            max_per_client: Queued-or-running jobs allowed for this client_id
+                (default: the queue's max_per_client)
+
+        Returns:
+            The job's initial queue position (1 = next to run)
+
+        Raises:
+            QueueFullError: If admission control rejects the job
+        """
+        with self._condition:
+            client_jobs = sum(1 for job in self._queued if job.client_id == client_id)
+            client_jobs += self._running_by_client.get(client_id, 0)
+            limit = self.max_per_client if max_per_client is None else max_per_client
+            if client_jobs >= limit:
+                raise QueueFullError(f'Too many renders in progress for this client (max {limit})')
+            if background and self._queued:
+                raise QueueFullError('Render queue is busy')
+            waiting = [job for job in self._queued if not job.background]
+            if len(waiting) >= self.max_queued:
+                raise QueueFullError(f'Render queue is full ({self.max_queued} waiting)')
+            queued_cost = sum(job.cost_s for job in waiting)
+            if waiting and queued_cost + cost_s > self.max_queued_cost_s:
+                raise QueueFullError('Render queue is at capacity, please try again later')
+
+            job = RenderJob(job_id, client_id, cost_s, run, next(self._seq), background)
+            self._queued.append(job)
+            self._jobs[job_id] = job
+            self._ensure_workers()
+            self._condition.notify()
+            return self._position(job)
+
+    def cancel(self, job_id):
+        """
+        Remove a job that has not started yet
+
+        Returns:
+            True if the job was waiting and is now cancelled
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if not job or job.status != 'queued':
+                return False
+            self._queued.remove(job)
+            job.status = 'cancelled'
+            del self._jobs[job_id]
+            return True
+
+    def position(self, job_id):
+        """1-based queue position of a waiting job, or None if it isn't waiting"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if not job or job.status != 'queued':
+                return None
+            return self._position(job)
+
+    def waiting(self):
+        """Number of jobs waiting, background jobs excluded"""
+        with self._condition:
+            return sum(1 for job in self._queued if not job.background)
+
+    def stats(self):
+        with self._condition:
+            waiting = [job for job in self._queued if not job.background]
+            return {
+                'workers': self.workers,
+                'queued': len(waiting),
+                'queued_background': len(self._queued) - len(waiting),
+                'running': sum(self._running_by_client.values()),
+                'queued_cost_s': round(sum(job.cost_s for job in waiting), 1)
+            }
+
+    def _sort_key(self, job, now):
+        aged_priority = job.priority - (now - job.submitted) / PRIORITY_AGING_S
+        return (job.background, self._running_by_client.get(job.client_id, 0), aged_priority, job.seq)
+
+    def _position(self, job):
+        now = time.monotonic()
+        key = self._sort_key(job, now)
+        return 1 + sum(1 for other in self._queued if self._sort_key(other, now) < key)
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f'render-worker-{len(self._threads)}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queued:
+                    self._condition.wait()
+                now = time.monotonic()
+                job = min(self._queued, key=lambda queued: self._sort_key(queued, now))
+                self._queued.remove(job)
+                job.status = 'running'
+                self._running_by_client[job.client_id] = self._running_by_client.get(job.client_id, 0) + 1
+
+            try:
+                job.run()
+            except Exception as e:
+                print(f"[QUEUE] Job {job.job_id} raised: {e}")
+            finally:
+                with self._condition:
+                    self._running_by_client[job.client_id] -= 1
+                    if not self._running_by_client[job.client_id]:
+                        del self._running_by_client[job.client_id]
+                    self._jobs.pop(job.job_id, None)
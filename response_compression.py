@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Response Compression
+gzip / Brotli for JSON, text and event-stream responses
+
+``init_app`` registers an ``after_request`` hook that compresses buffered
+responses of compressible types when the client's ``Accept-Encoding``
+allows it. Streamed responses (Server-Sent Events) are compressed by
+wrapping their generator in ``compress_stream``, which flushes after each
+chunk so every event still reaches the client immediately.
+
+Brotli is used when the optional ``brotli`` package is installed and the
+client prefers it; gzip (standard library) otherwise. Audio is never
+compressed: MP3 doesn't shrink, and range requests must address the
+stored bytes.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli  # Optional: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024  # Smaller bodies aren't worth the encoding overhead
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5  # Fast setting; higher qualities cost far more CPU than they save bytes here
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'text/event-stream', 'text/html', 'text/css', 'text/plain', 'application/javascript',
+    'text/javascript', 'application/vnd.apple.mpegurl', 'application/octet-stream'
+}
+
+
+def choose_encoding(accept_encoding):
+    """
+    Best supported content coding for an Accept-Encoding header
+
+    The coding with the highest q-value wins; Brotli is preferred over gzip
+    only when the client rates them equally.
+
+    Returns:
+        'br', 'gzip' or None
+    """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for coding in ('br', 'gzip'):
+        if coding == 'br' and brotli is None:
+            continue
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress a generator of str/bytes chunks, flushing after each one
+
+    Yields:
+        Compressed bytes, one piece per input chunk
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        flush, finish = compressor.flush, compressor.finish
+        process = compressor.process
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        flush, finish = (lambda: compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+        process = compressor.compress
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        yield process(chunk) + flush()
+    yield finish()
+
+
+def compress_response(response, accept_encoding):
+    """Compress a buffered response in place if it is worth it and the client accepts it"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # A strong ETag names the uncompressed bytes; the compressed form is only equivalent
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """Compress eligible responses of a Flask app"""
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, request.headers.get('Accept-Encoding'))
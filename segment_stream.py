@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Segmented Streams
+HLS-style playlists of fixed-length segments, each rendered on first request
+
+A stream describes a render (config, duration, music) without rendering
+it. Its playlist lists every segment up front; a segment is rendered from
+its own start time (see ``sliced_render.render_slice``), mastered, encoded
+to MP3 and cached the first time a player asks for it. A listener seeking
+to minute 45 therefore costs one segment of work, not a full render.
+
+Every segment of a stream draws noise from one per-stream seed and runs
+its filters in from before its start, so the rendered samples join up
+exactly. Segments are HLS packed audio: an ID3 PRIV timestamp followed by
+bare MP3 frames. Segment lengths are whole MP3 frames, and each segment is
+encoded with the audio around it and cut to the frames covering its own
+span, so segments carry no encoder delay or padding and decode
+back to back as one continuous stream.
+Mastering uses one normalization gain per stream, measured when the
+stream is set up over a few probe windows spread across the timeline (the
+whole timeline when it is short). Each segment is limited with the limiter's full look-around
+context, so its peaks match a full-length render.
+"""
+import hashlib
+import io
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from render_cache import RenderCache
+from signal_graph import compile_graph, db_to_gain, settle_frames
+from signal_mastering import (
+    LoudnessMeter, limit_true_peak, limiter_context_frames, normalization_gain_db
+)
+from sliced_render import render_slice
+from uap_signal_generator import (
+    DEFAULT_CONFIG, MP3_MAX_SAMPLE_RATE, RENDER_BLOCK_FRAMES, array_to_segment, build_hybrid_graph, encode_signal,
+    resample_audio
+)
+
+SEGMENT_SECONDS = 10
+LOUDNESS_PROBE_WINDOWS = 12  # Windows rendered to measure a long stream's loudness
+LOUDNESS_PROBE_SECONDS = 5
+
+
+def loudness_probe_ms(duration_ms):
+    """Audio rendered to measure a mastered stream's loudness (the probe windows, or the whole timeline)"""
+    return min(duration_ms, LOUDNESS_PROBE_WINDOWS * LOUDNESS_PROBE_SECONDS * 1000)
+
+# LAME's 576-sample encoder delay plus the decoder's 529: decoded sample k is input sample k - 1105
+MP3_CODEC_DELAY = 1105
+MP3_MARGIN_SAMPLES = 4608  # Stream audio encoded on each side of a segment and then dropped (4 MPEG-1 frames)
+# No bit reservoir, so every frame holds its own data and frames can be cut apart; no Xing or ID3 header
+PACKED_MP3_PARAMETERS = ['-reservoir', '0', '-write_xing', '0', '-id3v2_version', '0']
+# Frame header tables by MPEG version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MPEG1_BITRATES_KBPS = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MPEG2_BITRATES_KBPS = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+HLS_TIMESTAMP_OWNER = b'com.apple.streaming.transportStreamTimestamp\x00'
+
+
+def mp3_frame_samples(sample_rate):
+    """Samples per MP3 frame at a sample rate (MPEG-1 or MPEG-2/2.5 Layer III)"""
+    if sample_rate in MP3_SAMPLE_RATES[3]:
+        return 1152
+    if sample_rate in MP3_SAMPLE_RATES[2] + MP3_SAMPLE_RATES[0]:
+        return 576
+    raise ValueError(f'No MP3 sample rate {sample_rate}')
+
+
+def split_mp3_frames(data):
+    """
+    Split bare MP3 data (no ID3 or Xing header) into its frames
+
+    Returns:
+        List of frame byte strings
+    """
+    frames = []
+    offset = 0
+    while offset + 4 <= len(data):
+        header = data[offset:offset + 4]
+        if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+            raise ValueError(f'No MP3 frame at byte {offset}')
+        version = (header[1] >> 3) & 3
+        mpeg1 = version == 3
+        bitrate = (MPEG1_BITRATES_KBPS if mpeg1 else MPEG2_BITRATES_KBPS)[header[2] >> 4] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][(header[2] >> 2) & 3]
+        length = (144 if mpeg1 else 72) * bitrate // sample_rate + ((header[2] >> 1) & 1)
+        frames.append(data[offset:offset + length])
+        offset += length
+    return frames
+
+
+def hls_timestamp_tag(seconds):
+    """ID3v2.4 tag carrying the HLS packed-audio timestamp (a 33-bit, 90 kHz MPEG-TS PTS)"""
+    payload = HLS_TIMESTAMP_OWNER + struct.pack('>Q', int(round(seconds * 90000)) & (2 ** 33 - 1))
+    frame = b'PRIV' + syncsafe(len(payload)) + b'\x00\x00' + payload
+    return b'ID3\x04\x00\x00' + syncsafe(len(frame)) + frame
+
+
+def syncsafe(size):
+    """ID3v2.4 size: four bytes of seven bits each"""
+    return bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+class SegmentedRender:
+    """
+    One render published as fixed-length segments
+
+    Args:
+        stream_id: Identifier used in playlist URLs (the render key)
+        config: Configuration overrides (merged over DEFAULT_CONFIG)
+        duration_ms: Duration when no music is used
+        music_source: Optional decoded music (e.g. a MusicStore track); the stream follows its length
+        segment_seconds: Segment length
+    """
+
+    def __init__(self, stream_id, config, duration_ms, music_source=None, segment_seconds=SEGMENT_SECONDS):
+        self.stream_id = stream_id
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        # Rendered at the MP3 rate, since resampling a segment on export would shift its frames
+        self.sample_rate = min(int(self.config['sample_rate']), MP3_MAX_SAMPLE_RATE)
+        self.mp3_frame = mp3_frame_samples(self.sample_rate)
+        self.channels = int(self.config['channels'])
+        self.mastering = bool(self.config.get('mastering'))
+
+        self.music = None
+        if music_source is not None:
+            self.music = music_source.samples
+            if music_source.sample_rate != self.sample_rate:
+                self.music = resample_audio(np.asarray(self.music), music_source.sample_rate, self.sample_rate)
+            self.total_frames = len(self.music)
+        else:
+            self.total_frames = int(self.sample_rate * (duration_ms / 1000.0))
+
+        has_music = self.music is not None
+        graph = self.config.get('graph') or build_hybrid_graph(self.config, has_music=has_music)
+        self.plan = compile_graph(graph, self.sample_rate, self.channels, has_music=has_music,
+                                  min_audible_freq=float(self.config['min_audible_freq']))
+        # The envelope range needs one pass over the track; every segment reuses it
+        self.music_range = self.plan.renderer(self.total_frames, music=self.music).music_range if has_music else None
+        self.run_in = settle_frames(self.plan)
+        # Derived from the ID, so a stream registered again (after eviction) renders the same audio
+        self.noise_seed = int.from_bytes(hashlib.sha256(stream_id.encode('utf-8')).digest()[:8], 'little')
+
+        # Whole MP3 frames, so segments split the encoded stream at frame boundaries
+        self.segment_frames = max(1, round(segment_seconds * self.sample_rate / self.mp3_frame)) * self.mp3_frame
+        self.segment_count = max(1, -(-self.total_frames // self.segment_frames))
+        self._gain = None
+        self._lock = threading.Lock()
+        if self.mastering:
+            # Measured up front, so the first segment request doesn't pay for the loudness probe
+            self.gain()
+
+    @property
+    def duration_s(self):
+        return self.total_frames / self.sample_rate
+
+    def segment_duration_s(self, index):
+        start = index * self.segment_frames
+        return min(self.segment_frames, self.total_frames - start) / self.sample_rate
+
+    def playlist(self, segment_url):
+        """
+        HLS media playlist (VOD) listing every segment
+
+        Args:
+            segment_url: Callable mapping a segment index to its URL
+        """
+        target = int(round(self.segment_frames / self.sample_rate))
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{target}', '#EXT-X-MEDIA-SEQUENCE:0',
+                 '#EXT-X-PLAYLIST-TYPE:VOD']
+        for index in range(self.segment_count):
+            lines.append(f'#EXTINF:{self.segment_duration_s(index):.3f},')
+            lines.append(segment_url(index))
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def _render(self, start, stop):
+        mix, _ = render_slice(self.plan, self.total_frames, start, stop, self.run_in, RENDER_BLOCK_FRAMES,
+                              music=self.music, music_range=self.music_range, noise_seed=self.noise_seed)
+        return mix
+
+    def full_mix(self):
+        """The whole stream rendered and mastered in one piece, for checking segments against"""
+        mix = self._render(0, self.total_frames)
+        if self.mastering:
+            limit_true_peak(mix, self.sample_rate, ceiling_db=self.config['true_peak_db'], gain=self.gain())
+        return mix
+
+    def gain(self):
+        """Normalization gain (linear) for the whole stream, measured once"""
+        with self._lock:
+            if self._gain is None:
+                self._gain = db_to_gain(normalization_gain_db(self._probe_loudness(), self.config['target_lufs']))
+            return self._gain
+
+    def _probe_loudness(self):
+        meter = LoudnessMeter(self.sample_rate, self.channels)
+        window = int(LOUDNESS_PROBE_SECONDS * self.sample_rate)
+        if self.total_frames <= window * LOUDNESS_PROBE_WINDOWS:
+            starts = range(0, self.total_frames, window)
+        else:
+            spacing = (self.total_frames - window) / (LOUDNESS_PROBE_WINDOWS - 1)
+            starts = [int(i * spacing) for i in range(LOUDNESS_PROBE_WINDOWS)]
+        for start in starts:
+            meter.add(self._render(start, min(start + window, self.total_frames)))
+        return meter.integrated_loudness()
+
+    def render_segment(self, index):
+        """
+        Render, master and encode one segment
+
+        The encoder is fed the segment plus at least MP3_MARGIN_SAMPLES of the
+        stream on each side, with the lead-in sized so that the codec delay
+        ends on a frame boundary. Only the frames that decode to the
+        segment's own span are kept. The last segment is padded with
+        silence to a whole frame.
+
+        Returns:
+            Packed audio bytes (ID3 timestamp tag and MP3 frames)
+        """
+        start = index * self.segment_frames
+        stop = min(start + self.segment_frames, self.total_frames)
+        frame_count = -(-(stop - start) // self.mp3_frame)
+        skipped = -(-(MP3_MARGIN_SAMPLES + MP3_CODEC_DELAY) // self.mp3_frame)
+        lead, trail = skipped * self.mp3_frame - MP3_CODEC_DELAY, MP3_MARGIN_SAMPLES
+        context = limiter_context_frames(self.sample_rate) if self.mastering else 0
+        # Render the limiter's context on both sides too, so segment edges are limited as in a full render
+        first = max(0, start - max(lead, context))
+        last = min(self.total_frames, start + frame_count * self.mp3_frame + max(trail, context))
+        mix = self._render(first, last)
+        if self.mastering:
+            limit_true_peak(mix, self.sample_rate, ceiling_db=self.config['true_peak_db'], gain=self.gain())
+
+        # The encoder input, with silence where it runs past either end of the stream
+        window = np.zeros((lead + frame_count * self.mp3_frame + trail, self.channels), dtype=mix.dtype)
+        begin = start - lead
+        window[first - begin:last - begin] = mix
+        buffer = io.BytesIO()
+        encode_signal(array_to_segment(window, self.sample_rate), buffer, 'mp3', PACKED_MP3_PARAMETERS)
+        frames = split_mp3_frames(buffer.getvalue())
+        kept = frames[skipped:skipped + frame_count]
+        return hls_timestamp_tag(start / self.sample_rate) + b''.join(kept)
+
+
+class StreamRegistry:
+    """
+    Known streams (LRU by count) and their rendered segments (LRU by bytes)
+
+    Concurrent requests for the same missing segment wait for a single render.
+
+    Args:
+        max_streams: Stream definitions kept
+        max_segment_bytes: Total MP3 bytes of cached segments
+    """
+
+    def __init__(self, max_streams, max_segment_bytes):
+        self.max_streams = max_streams
+        self.segments = RenderCache(max_segment_bytes)
+        self._streams = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.rendered = 0
+
+    def add(self, stream):
+        """Register a stream (an existing stream with the same ID is kept)"""
+        with self._lock:
+            existing = self._streams.get(stream.stream_id)
+            if existing is not None:
+                self._streams.move_to_end(stream.stream_id)
+                return existing
+            self._streams[stream.stream_id] = stream
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+            return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is not None:
+                self._streams.move_to_end(stream_id)
+            return stream
+
+    def segment(self, stream, index, run=None, timeout=None):
+        """
+        MP3 bytes of one segment, rendering it on first request
+
+        Args:
+            stream: SegmentedRender the segment belongs to
+            index: Segment index
+            run: Optional callable that executes the render callable and returns its
+                result (e.g. on a render queue worker); by default it runs here
+            timeout: Seconds to wait for another request's render of the same segment
+
+        Raises:
+            IndexError: If the stream has no such segment
+            TimeoutError: If another request's render isn't done within ``timeout``
+        """
+        if not 0 <= index < stream.segment_count:
+            raise IndexError(f'No segment {index}')
+        key = f'{stream.stream_id}/{index}'
+        cached = self.segments.get(key)
+        if cached is not None:
+            return cached['mp3_data']
+
+        with self._lock:
+            event = self._in_flight.get(key)
+            owner = event is None
+            if owner:
+                event = self._in_flight[key] = threading.Event()
+        if not owner:
+            if not event.wait(timeout):
+                raise TimeoutError(f'Segment {index} not rendered within {timeout:g} s')
+            cached = self.segments.get(key)
+            if cached is not None:
+                return cached['mp3_data']
+            # The render we waited for failed; try ourselves
+            return self.segment(stream, index, run, timeout)
+
+        started = []
+
+        def release():
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+        def render():
+            # Cached and released by the render itself, so a caller that stops waiting
+            # doesn't lose it or let another request start the same render
+            with self._lock:
+                started.append(True)
+            try:
+                data = stream.render_segment(index)
+                self.segments.put(key, {'mp3_data': data})
+                with self._lock:
+                    self.rendered += 1
+                return data
+            finally:
+                release()
+
+        try:
+            return run(render) if run else render()
+        finally:
+            with self._lock:
+                never_ran = not started
+            if never_ran:
+                release()
+
+    def stats(self):
+        with self._lock:
+            streams, rendered = len(self._streams), self.rendered
+        return {'streams': streams, 'segments_rendered': rendered, 'segment_cache': self.segments.stats()}
@@ -0,0 +1,909 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Signal Layer Graph
+Declarative layer graphs (oscillators, noise, filters, LFOs, pulse trains,
+music sources, gains and mixes), validated and compiled once into an
+optimized render plan that is cached by content hash
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+MAX_GRAPH_NODES = 64
+PLAN_CACHE_SIZE = 64
+DEFAULT_MIN_AUDIBLE_FREQ = 20.0  # Lower edge of the audible pass-band (Hz)
+SILENCE_DB = -120.0  # Gains at or below this are treated as zero
+NODE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_]{1,50}$')
+FILTER_MODES = ('lowpass', 'highpass', 'bandpass')
+
+# Node type -> (required params, optional params with defaults)
+NODE_SCHEMAS = {
+    'oscillator': ({'freq'}, {}),
+    'noise': (set(), {'seed': None}),
+    'filter': ({'input', 'cutoff'}, {'mode': 'lowpass', 'order': 1}),
+    'lfo': ({'rate'}, {'depth': 1.0}),
+    'pulse_train': ({'freq', 'pulse_ms', 'interval_ms'},
+                    {'tremolo_rate': None, 'tremolo_depth': 0.0, 'fit_last': False}),
+    'music': (set(), {'envelope': False}),
+    'gain': ({'input'}, {'gain_db': 0.0, 'pan': 0.0, 'enabled': True}),
+    'multiply': ({'inputs'}, {}),
+    'mix': ({'inputs'}, {}),
+}
+
+
+class GraphValidationError(ValueError):
+    """Raised when a layer graph is malformed"""
+
+
+# ---------------------------------------------------------------------------
+# DSP primitives
+# ---------------------------------------------------------------------------
+
+def db_to_gain(db):
+    """Convert a gain in dB to a linear amplitude factor"""
+    return 10.0 ** (db / 20.0)
+
+
+def pan_gains(pan, channels):
+    """
+    Per-channel gains for a pan position
+
+    Uses a balance law so a centred layer keeps unity level in every channel,
+    which keeps stereo mixes level-matched with the mono mix.
+
+    Args:
+        pan: -1.0 (left) to 1.0 (right), 0.0 is centre
+        channels: Number of output channels (1 or 2)
+
+    Returns:
+        float32 array of shape (channels,)
+    """
+    if channels == 1:
+        return np.ones(1, dtype=np.float32)
+    pan = float(np.clip(pan, -1.0, 1.0))
+    return np.array([min(1.0, 1.0 - pan), min(1.0, 1.0 + pan)], dtype=np.float32)
+
+
+def oscillator(freqs, start, num_frames, sample_rate):
+    """
+    Phase-coherent sine oscillator bank
+
+    All oscillators share one sample-index time base, so a pair of
+    frequencies starts in phase and stays locked for the whole render.
+
+    Args:
+        freqs: Frequency in Hz, or a sequence with one frequency per column
+        start: Index of the first frame to render
+        num_frames: Number of frames to render
+        sample_rate: Sample rate in Hz
+
+    Returns:
+        float32 array of shape (num_frames, len(freqs))
+    """
+    cycles_per_frame = np.atleast_1d(np.asarray(freqs, dtype=np.float64)) / sample_rate
+    frame_index = np.arange(start, start + num_frames, dtype=np.float64)
+    phase = np.mod(np.outer(frame_index, cycles_per_frame), 1.0)
+    return np.sin(2 * np.pi * phase).astype(np.float32)
+
+
+def tremolo_lfo(rate, depth, start, num_frames, sample_rate):
+    """Tremolo gain curve (1 - depth ... 1) as a (num_frames, 1) array"""
+    return (1 - depth) + depth * oscillator(rate, start, num_frames, sample_rate)
+
+
+def pulse_train(freq, start, num_frames, sample_rate, pulse_frames, interval_frames,
+                pulse_count, tremolo_rate=None, tremolo_depth=0.0):
+    """
+    Repeating tone bursts rendered analytically for any frame range
+
+    Each burst restarts its oscillator (and optional tremolo) at phase 0,
+    matching a short tone overlaid every ``interval_frames``.
+
+    Returns:
+        float32 array of shape (num_frames, 1)
+    """
+    frame_index = np.arange(start, start + num_frames)
+    position = frame_index % interval_frames
+    active = (position < pulse_frames) & (frame_index // interval_frames < pulse_count)
+
+    burst = np.zeros((num_frames, 1), dtype=np.float32)
+    if not active.any():
+        return burst
+
+    tau = position[active] / sample_rate
+    tone = np.sin(2 * np.pi * freq * tau)
+    if tremolo_rate is not None:
+        tone *= (1 - tremolo_depth) + tremolo_depth * np.sin(2 * np.pi * tremolo_rate * tau)
+    burst[active, 0] = tone
+    return burst
+
+
+def one_pole_lowpass(cutoff, sample_rate):
+    """
+    One-pole RC low-pass as (b, a) coefficients
+
+    Same response as pydub's ``low_pass_filter`` (6 dB/octave above cutoff).
+    """
+    rc = 1.0 / (cutoff * 2 * np.pi)
+    dt = 1.0 / sample_rate
+    alpha = dt / (rc + dt)
+    return np.array([alpha]), np.array([1.0, alpha - 1.0])
+
+
+# ---------------------------------------------------------------------------
+# Validation
+# ---------------------------------------------------------------------------
+
+def _number(node_id, name, value, minimum=None, maximum=None):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+        raise GraphValidationError(f"Node '{node_id}': '{name}' must be a finite number")
+    if minimum is not None and value < minimum:
+        raise GraphValidationError(f"Node '{node_id}': '{name}' must be >= {minimum}")
+    if maximum is not None and value > maximum:
+        raise GraphValidationError(f"Node '{node_id}': '{name}' must be <= {maximum}")
+    return float(value)
+
+
+def _references(node):
+    if 'input' in node:
+        return [node['input']]
+    return list(node.get('inputs', []))
+
+
+def validate_graph(graph):
+    """
+    Validate a layer graph and return it with defaults filled in
+
+    A graph is ``{"nodes": {id: {"type": ..., ...}}, "output": id}``.
+
+    Raises:
+        GraphValidationError: If the graph is malformed, references unknown
+            nodes or contains a cycle
+
+    Returns:
+        Normalized graph dictionary
+    """
+    if not isinstance(graph, dict) or not isinstance(graph.get('nodes'), dict):
+        raise GraphValidationError("Graph must be an object with a 'nodes' mapping")
+    nodes = graph['nodes']
+    if not nodes or len(nodes) > MAX_GRAPH_NODES:
+        raise GraphValidationError(f"Graph must have between 1 and {MAX_GRAPH_NODES} nodes")
+
+    normalized = {}
+    for node_id, node in nodes.items():
+        if not isinstance(node_id, str) or not NODE_ID_PATTERN.match(node_id):
+            raise GraphValidationError(f"Invalid node id: {node_id!r}")
+        if not isinstance(node, dict) or node.get('type') not in NODE_SCHEMAS:
+            raise GraphValidationError(f"Node '{node_id}': unknown type {node.get('type') if isinstance(node, dict) else node!r}")
+
+        required, optional = NODE_SCHEMAS[node['type']]
+        params = set(node) - {'type'}
+        missing = required - params
+        unknown = params - required - set(optional)
+        if missing:
+            raise GraphValidationError(f"Node '{node_id}': missing {sorted(missing)}")
+        if unknown:
+            raise GraphValidationError(f"Node '{node_id}': unknown parameters {sorted(unknown)}")
+        normalized[node_id] = {**optional, **node}
+        _validate_params(node_id, normalized[node_id])
+
+    output = graph.get('output')
+    if not isinstance(output, str) or output not in normalized:
+        raise GraphValidationError(f"Output node {output!r} does not exist")
+
+    for node_id, node in normalized.items():
+        for ref in _references(node):
+            if not isinstance(ref, str) or ref not in normalized:
+                raise GraphValidationError(f"Node '{node_id}': unknown input {ref!r}")
+
+    # Depth-first cycle check
+    visiting, done = set(), set()
+
+    def visit(node_id):
+        if node_id in done:
+            return
+        if node_id in visiting:
+            raise GraphValidationError(f"Graph contains a cycle through '{node_id}'")
+        visiting.add(node_id)
+        for ref in _references(normalized[node_id]):
+            visit(ref)
+        visiting.discard(node_id)
+        done.add(node_id)
+
+    for node_id in normalized:
+        visit(node_id)
+
+    return {'nodes': normalized, 'output': output}
+
+
+def _validate_params(node_id, node):
+    node_type = node['type']
+    if node_type == 'oscillator':
+        freqs = node['freq'] if isinstance(node['freq'], list) else [node['freq']]
+        if not 1 <= len(freqs) <= 2:
+            raise GraphValidationError(f"Node '{node_id}': 'freq' must be a number or a [left, right] pair")
+        for freq in freqs:
+            _number(node_id, 'freq', freq, minimum=0)
+    elif node_type == 'noise':
+        if node['seed'] is not None and (isinstance(node['seed'], bool) or not isinstance(node['seed'], int)):
+            raise GraphValidationError(f"Node '{node_id}': 'seed' must be an integer")
+    elif node_type == 'filter':
+        if node['mode'] not in FILTER_MODES:
+            raise GraphValidationError(f"Node '{node_id}': 'mode' must be one of {FILTER_MODES}")
+        if node['mode'] == 'bandpass':
+            if not isinstance(node['cutoff'], list) or len(node['cutoff']) != 2:
+                raise GraphValidationError(f"Node '{node_id}': bandpass 'cutoff' must be [low, high]")
+            low = _number(node_id, 'cutoff', node['cutoff'][0], minimum=1)
+            high = _number(node_id, 'cutoff', node['cutoff'][1], minimum=1)
+            if low >= high:
+                raise GraphValidationError(f"Node '{node_id}': bandpass low cutoff must be below high cutoff")
+        else:
+            _number(node_id, 'cutoff', node['cutoff'], minimum=1)
+        if isinstance(node['order'], bool) or node['order'] not in range(1, 9):
+            raise GraphValidationError(f"Node '{node_id}': 'order' must be an integer from 1 to 8")
+    elif node_type == 'lfo':
+        _number(node_id, 'rate', node['rate'], minimum=0)
+        _number(node_id, 'depth', node['depth'], minimum=0, maximum=1)
+    elif node_type == 'pulse_train':
+        _number(node_id, 'freq', node['freq'], minimum=0)
+        pulse_ms = _number(node_id, 'pulse_ms', node['pulse_ms'], minimum=1)
+        interval_ms = _number(node_id, 'interval_ms', node['interval_ms'], minimum=1)
+        if pulse_ms > interval_ms:
+            raise GraphValidationError(f"Node '{node_id}': 'pulse_ms' must not exceed 'interval_ms'")
+        if node['tremolo_rate'] is not None:
+            _number(node_id, 'tremolo_rate', node['tremolo_rate'], minimum=0)
+        _number(node_id, 'tremolo_depth', node['tremolo_depth'], minimum=0, maximum=1)
+    elif node_type == 'gain':
+        _number(node_id, 'gain_db', node['gain_db'], maximum=24)
+        _number(node_id, 'pan', node['pan'], minimum=-1, maximum=1)
+        if not isinstance(node['enabled'], bool):
+            raise GraphValidationError(f"Node '{node_id}': 'enabled' must be true or false")
+    elif node_type in ('multiply', 'mix'):
+        if not isinstance(node['inputs'], list) or not node['inputs']:
+            raise GraphValidationError(f"Node '{node_id}': 'inputs' must be a non-empty list")
+
+
+def graph_hash(graph):
+    """Stable content hash of a graph (key order independent)"""
+    canonical = json.dumps(graph, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+# ---------------------------------------------------------------------------
+
+class RenderStep:
+    """One deduplicated operation in a render plan"""
+
+    def __init__(self, op, params, inputs=()):
+        self.op = op
+        self.params = params
+        self.inputs = tuple(inputs)
+
+    def __repr__(self):
+        return f"RenderStep({self.op}, {self.params}, inputs={self.inputs})"
+
+
+class RenderPlan:
+    """
+    Compiled, immutable render plan
+
+    ``steps`` are in dependency order; each layer is a list of
+    ``(step_index, per_channel_factor)`` terms, with gains, pans and
+    constants already folded into the factors. ``pruned`` lists the layers
+    skipped entirely, as ``{'layer': name, 'reason': ...}``. Use
+    ``renderer()`` to get a stateful per-render executor.
+    """
+
+    def __init__(self, key, sample_rate, channels, steps, layers, pruned):
+        self.key = key
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.steps = steps
+        self.layers = layers
+        self.pruned = pruned
+        # Reverse edges, for scheduling steps as soon as their inputs are done
+        self.dependents = [[] for _ in steps]
+        for index, step in enumerate(steps):
+            for source in set(step.inputs):
+                self.dependents[source].append(index)
+
+    @property
+    def layer_names(self):
+        return [name for name, _ in self.layers]
+
+    def renderer(self, total_frames, music=None, **kwargs):
+        return PlanRenderer(self, total_frames, music, **kwargs)
+
+
+class _PlanCompiler:
+    """Folds a validated graph into deduplicated render steps"""
+
+    def __init__(self, graph, sample_rate, channels, has_music, min_audible_freq):
+        self.nodes = graph['nodes']
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.has_music = has_music
+        self.min_audible_freq = min_audible_freq
+        self.steps = []
+        self.step_index = {}
+        self.node_terms = {}
+        self.silence_reasons = {}
+
+    def add_step(self, op, params, inputs=()):
+        """Add a step, or reuse an identical one (shared node deduplication)"""
+        key = (op, json.dumps(params, sort_keys=True), tuple(inputs))
+        if key not in self.step_index:
+            self.step_index[key] = len(self.steps)
+            self.steps.append(RenderStep(op, params, inputs))
+        return self.step_index[key]
+
+    def ones(self):
+        return np.ones(self.channels, dtype=np.float32)
+
+    def materialize(self, terms):
+        """Turn a term list into a single step (constant terms become a const step)"""
+        if len(terms) == 1 and terms[0][0] is not None and np.all(terms[0][1] == 1):
+            return terms[0][0]
+        inputs = []
+        factors = []
+        for step, factor in terms:
+            inputs.append(self.add_step('const', {}) if step is None else step)
+            factors.append([float(f) for f in factor])
+        return self.add_step('sum', {'factors': factors}, inputs)
+
+    def terms(self, node_id, audio=True):
+        """
+        Compile a node into terms: [(step index or None for a DC constant, factor)]
+
+        ``audio`` is True when the node is heard directly (through gains,
+        mixes and filters) and False when it only modulates another signal,
+        where sub-audio content still matters.
+        """
+        key = (node_id, audio)
+        if key not in self.node_terms:
+            reason = self.inaudible_reason(node_id) if audio else None
+            if reason:
+                self.node_terms[key] = self.silence(node_id, reason)
+            else:
+                self.node_terms[key] = self._compile(node_id, self.nodes[node_id], audio)
+        return self.node_terms[key]
+
+    def silence(self, node_id, reason):
+        """Record why a node compiles to nothing and return the empty term list"""
+        self.silence_reasons.setdefault(node_id, reason)
+        return []
+
+    def max_freq(self, node_id):
+        """Upper bound on a node's frequency content, or None if unbounded/unknown"""
+        node = self.nodes[node_id]
+        node_type = node['type']
+        if node_type == 'oscillator':
+            return max(node['freq']) if isinstance(node['freq'], list) else node['freq']
+        if node_type == 'lfo':
+            return node['rate'] if node['depth'] else 0.0
+        if node_type in ('gain', 'filter'):
+            return self.max_freq(node['input'])
+        if node_type in ('mix', 'multiply'):
+            bounds = [self.max_freq(ref) for ref in node['inputs']]
+            if any(bound is None for bound in bounds):
+                return None
+            # A product's spectrum extends to the sum of its inputs' bandwidths
+            return max(bounds) if node_type == 'mix' else sum(bounds)
+        return None
+
+    def inaudible_reason(self, node_id):
+        """Why a directly heard node cannot be heard in this render, or None"""
+        node = self.nodes[node_id]
+        nyquist = self.sample_rate / 2
+        if node['type'] in ('oscillator', 'pulse_train'):
+            freqs = node['freq'] if isinstance(node['freq'], list) else [node['freq']]
+            if min(freqs) >= nyquist:
+                return f"above Nyquist ({min(freqs):g} Hz >= {nyquist:g} Hz)"
+
+        bound = self.max_freq(node_id)
+        if bound is not None and bound < self.min_audible_freq:
+            return f"below audible band ({bound:g} Hz < {self.min_audible_freq:g} Hz)"
+        return None
+
+    def _compile(self, node_id, node, audio):
+        node_type = node['type']
+
+        if node_type == 'oscillator':
+            freqs = node['freq'] if isinstance(node['freq'], list) else [node['freq']]
+            if len(freqs) > self.channels:
+                raise GraphValidationError(f"Node '{node_id}': a frequency pair needs a stereo render")
+            if all(freq == 0 for freq in freqs):
+                return self.silence(node_id, 'zero frequency')  # sin(0) is silence
+            return [(self.add_step('oscillator', {'freqs': [float(f) for f in freqs]}), self.ones())]
+
+        if node_type == 'noise':
+            # Unseeded noise nodes are independent sources, so never share them
+            params = {'seed': node['seed']} if node['seed'] is not None else {'node': node_id}
+            return [(self.add_step('noise', params), self.ones())]
+
+        if node_type == 'lfo':
+            if node['depth'] == 0 or node['rate'] == 0:
+                return [(None, self.ones())]  # Constant unity gain
+            return [(self.add_step('lfo', {'rate': float(node['rate']), 'depth': float(node['depth'])}), self.ones())]
+
+        if node_type == 'pulse_train':
+            if node['freq'] == 0:
+                return self.silence(node_id, 'zero frequency')
+            params = {key: node[key] for key in ('freq', 'pulse_ms', 'interval_ms', 'tremolo_rate', 'tremolo_depth', 'fit_last')}
+            return [(self.add_step('pulse_train', params), self.ones())]
+
+        if node_type == 'music':
+            if not self.has_music:
+                # Without music a modulation envelope passes the carrier through unchanged
+                if node['envelope']:
+                    return [(None, self.ones())]
+                return self.silence(node_id, 'no music source')
+            return [(self.add_step('music', {'envelope': bool(node['envelope'])}), self.ones())]
+
+        if node_type == 'gain':
+            if not node['enabled']:
+                return self.silence(node_id, 'disabled')
+            if node['gain_db'] <= SILENCE_DB:
+                return self.silence(node_id, 'zero gain')
+            factor = db_to_gain(node['gain_db']) * pan_gains(node['pan'], self.channels)
+            return [(step, term_factor * factor) for step, term_factor in self.terms(node['input'], audio)]
+
+        if node_type == 'mix':
+            merged = OrderedDict()
+            for ref in node['inputs']:
+                for step, factor in self.terms(ref, audio):
+                    merged[step] = merged.get(step, 0) + factor
+            return [(step, factor) for step, factor in merged.items() if np.any(factor != 0)]
+
+        if node_type == 'multiply':
+            factor = self.ones()
+            steps = []
+            for ref in node['inputs']:
+                terms = self.terms(ref, audio=False)
+                if not terms:
+                    return []  # Anything times silence is silence
+                if len(terms) == 1 and terms[0][0] is None:
+                    factor = factor * terms[0][1]
+                elif len(terms) == 1:
+                    steps.append(terms[0][0])
+                    factor = factor * terms[0][1]
+                else:
+                    steps.append(self.materialize(terms))
+            if not steps:
+                return [(None, factor)]
+            if len(steps) == 1:
+                return [(steps[0], factor)]
+            return [(self.add_step('multiply', {}, sorted(steps)), factor)]
+
+        if node_type == 'filter':
+            return self._compile_filter(node_id, node, audio)
+
+        raise GraphValidationError(f"Node '{node_id}': unsupported type {node_type}")
+
+    def _compile_filter(self, node_id, node, audio):
+        terms = self.terms(node['input'], audio)
+        if not terms:
+            return []
+        nyquist = self.sample_rate / 2
+        mode, cutoff = node['mode'], node['cutoff']
+
+        # Cutoffs at or above Nyquist fold to a pass-through or silence
+        if mode == 'lowpass' and cutoff >= nyquist:
+            return terms
+        if mode == 'highpass' and cutoff >= nyquist:
+            return self.silence(node_id, 'filter pass-band above Nyquist')
+        if mode == 'bandpass':
+            if cutoff[0] >= nyquist:
+                return self.silence(node_id, 'filter pass-band above Nyquist')
+            if cutoff[1] >= nyquist:
+                mode, cutoff = 'highpass', cutoff[0]
+
+        # Filters are linear: pull a single term's factor outside the filter
+        if len(terms) == 1 and terms[0][0] is not None:
+            source, factor = terms[0]
+        else:
+            source, factor = self.materialize(terms), self.ones()
+
+        params = {'mode': mode, 'cutoff': cutoff, 'order': int(node['order'])}
+        return [(self.add_step('filter', params, [source]), factor)]
+
+    def prune_reason(self, layer_id):
+        """First recorded silence reason in a pruned layer's subtree"""
+        stack, seen = [layer_id], set()
+        while stack:
+            node_id = stack.pop()
+            if node_id in self.silence_reasons:
+                return self.silence_reasons[node_id]
+            if node_id not in seen:
+                seen.add(node_id)
+                stack.extend(reversed(_references(self.nodes[node_id])))
+        return 'silent'
+
+    def compile(self, output):
+        output_node = self.nodes[output]
+        layer_ids = output_node['inputs'] if output_node['type'] == 'mix' else [output]
+
+        layers, pruned = [], []
+        for layer_id in layer_ids:
+            terms = [(step, factor) for step, factor in self.terms(layer_id) if np.any(factor != 0)]
+            if terms:
+                layers.append((layer_id, terms))
+            else:
+                pruned.append({'layer': layer_id, 'reason': self.prune_reason(layer_id)})
+
+        # Drop steps no layer depends on (e.g. nodes folded away as constants)
+        used = set()
+        stack = [step for _, terms in layers for step, _ in terms if step is not None]
+        while stack:
+            index = stack.pop()
+            if index not in used:
+                used.add(index)
+                stack.extend(self.steps[index].inputs)
+        remap = {old: new for new, old in enumerate(sorted(used))}
+        steps = [RenderStep(self.steps[old].op, self.steps[old].params, [remap[i] for i in self.steps[old].inputs])
+                 for old in sorted(used)]
+        layers = [(name, [(remap.get(step), factor.astype(np.float32)) for step, factor in terms])
+                  for name, terms in layers]
+        return steps, layers, pruned
+
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def compile_graph(graph, sample_rate, channels, has_music=False, min_audible_freq=DEFAULT_MIN_AUDIBLE_FREQ):
+    """
+    Validate and compile a layer graph into a RenderPlan
+
+    Constants (gains, pans, zero-depth LFOs, silent sources) are folded,
+    layers that reduce to silence are pruned, nodes unreachable from the
+    output are dropped and identical nodes are shared. Disabled and
+    zero-gain layers, and tones that are entirely above Nyquist or below
+    the audible band, are pruned before any synthesis happens. Plans are
+    cached by content hash, so repeat renders of a design skip compilation.
+
+    Args:
+        graph: Layer graph dictionary (see validate_graph)
+        sample_rate: Render sample rate in Hz
+        channels: Output channel count
+        has_music: Whether a music source will be supplied to the renderer
+        min_audible_freq: Heard tones entirely below this frequency (Hz) are pruned; 0 keeps them
+
+    Returns:
+        RenderPlan
+    """
+    try:
+        key = graph_hash({
+            'graph': graph, 'sample_rate': sample_rate, 'channels': channels,
+            'has_music': bool(has_music), 'min_audible_freq': min_audible_freq
+        })
+    except (TypeError, ValueError):
+        raise GraphValidationError("Graph must be JSON-serializable")
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    normalized = validate_graph(graph)
+    compiler = _PlanCompiler(normalized, sample_rate, channels, has_music, min_audible_freq)
+    steps, layers, pruned = compiler.compile(normalized['output'])
+    plan = RenderPlan(key, sample_rate, channels, steps, layers, pruned)
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+
+MUSIC_SCAN_FRAMES = 1 << 20  # Chunk size for the envelope range scan
+SETTLE_LEVEL = 1e-7  # Filter start-up residue treated as gone (below float32 resolution)
+PARALLEL_MIN_FRAMES = 4096  # Shorter blocks render inline: pool hand-offs would cost more than they save
+
+_render_threads = os.cpu_count() or 1
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def set_render_threads(threads):
+    """
+    Size the thread pool that renders independent plan steps concurrently
+
+    The pool is shared by every render in the process, so concurrent
+    renders compete for the same threads instead of multiplying them.
+
+    Args:
+        threads: Worker threads (0 = one per CPU core, 1 = render every step inline)
+    """
+    global _render_threads, _render_pool
+    threads = int(threads) or os.cpu_count() or 1
+    with _render_pool_lock:
+        if threads != _render_threads:
+            # Renders holding the old pool finish on it; its threads exit once it is released
+            _render_pool = None
+        _render_threads = threads
+
+
+def render_pool():
+    """The shared step pool, or None when rendering single-threaded"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_threads <= 1:
+            return None
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=_render_threads, thread_name_prefix='render-step')
+        return _render_pool
+
+
+class PlanRenderer:
+    """
+    Stateful executor for one render of a plan
+
+    Blocks must be requested in order, since noise generators and filters
+    carry state from one block to the next.
+
+    ``music`` may be any (frames, channels) float array, including a
+    ``numpy.memmap``: it is only ever read one block at a time and matched
+    to the plan's channel layout per block, so long sources page in lazily.
+    A renderer for one slice of the timeline may get just that slice of the
+    music, with ``music_offset`` (the frame index of its first row) and the
+    whole track's ``music_range`` for envelope scaling. ``noise_seed`` seeds
+    noise nodes that have no seed of their own, so renderers covering
+    different parts of one timeline draw the same noise.
+
+    Within a block, steps whose inputs are ready run concurrently on the
+    shared render pool (NumPy and SciPy release the GIL in their kernels),
+    and each layer is summed into the mix as soon as its steps are done.
+    Layers are still summed in plan order, so the output is bit-identical
+    to a single-threaded render.
+    """
+
+    def __init__(self, plan, total_frames, music=None, music_offset=0, music_range=None, noise_seed=None):
+        self.plan = plan
+        self.total_frames = total_frames
+        self.music = music
+        self.music_offset = music_offset
+        self.noise_seed = noise_seed
+        self.state = {}
+        self.music_range = music_range
+        self.op_seconds = {}  # Cumulative time per op, for render profiling (summed across threads)
+        self.offloaded_cpu_s = 0.0  # CPU time of steps run on pool threads (not the calling thread's)
+        self.pool = render_pool() if len(plan.steps) > 1 else None
+
+        if music is not None and music_range is None and any(step.op == 'music' and step.params['envelope'] for step in plan.steps):
+            music_min, music_max = np.inf, -np.inf
+            for offset in range(0, len(music), MUSIC_SCAN_FRAMES):
+                chunk = self.music_block(music_offset + offset, MUSIC_SCAN_FRAMES)
+                music_min, music_max = min(music_min, float(chunk.min())), max(music_max, float(chunk.max()))
+            if music_max > music_min:
+                self.music_range = (music_min, music_max)
+
+    def seek(self, frame):
+        """
+        Prepare a fresh renderer to start at ``frame`` instead of 0
+
+        Seeded noise generators skip ahead to exactly the values a render
+        from the beginning would draw there. Filter states start from zero,
+        so render some frames before the ones you keep (see
+        ``settle_frames``).
+        """
+        for index, step in enumerate(self.plan.steps):
+            if step.op == 'noise' and self._noise_seed(index, step) is not None:
+                rng = np.random.default_rng(self._noise_seed(index, step))
+                rng.bit_generator.advance(frame)  # One uniform draw per frame
+                self.state[index] = rng
+
+    def _noise_seed(self, index, step):
+        if step.params.get('seed') is not None:
+            return step.params['seed']
+        return None if self.noise_seed is None else [self.noise_seed, index]
+
+    def music_block(self, start, num_frames):
+        """Music frames [start, start + num_frames), downmixed or duplicated to the plan's channel count"""
+        start -= self.music_offset
+        block = np.asarray(self.music[start:start + num_frames], dtype=np.float32)
+        channels = self.plan.channels
+        if block.shape[1] != channels:
+            if channels == 1 or block.shape[1] != 1:
+                block = block.mean(axis=1, keepdims=True)
+            block = np.repeat(block, channels, axis=1)
+        return block
+
+    def render_block(self, start, num_frames):
+        """Render frames [start, start + num_frames) as a (num_frames, channels) mix"""
+        if self.pool is not None and num_frames >= PARALLEL_MIN_FRAMES:
+            return self._render_block_parallel(start, num_frames)
+
+        outputs = [None] * len(self.plan.steps)
+        for index, step in enumerate(self.plan.steps):
+            outputs[index] = self._timed_step(index, [outputs[i] for i in step.inputs], start, num_frames)[1]
+
+        mix_start = time.perf_counter()
+        mix = np.zeros((num_frames, self.plan.channels), dtype=np.float32)
+        for _, terms in self.plan.layers:
+            self._mix_layer(mix, terms, outputs)
+        self.op_seconds['mix'] = self.op_seconds.get('mix', 0.0) + time.perf_counter() - mix_start
+        return mix
+
+    def _render_block_parallel(self, start, num_frames):
+        steps, layers = self.plan.steps, self.plan.layers
+        outputs = [None] * len(steps)
+        waiting = [len(set(step.inputs)) for step in steps]
+        pending = set()
+
+        def submit(index):
+            inputs = [outputs[i] for i in steps[index].inputs]
+            pending.add(self.pool.submit(self._timed_step, index, inputs, start, num_frames, False))
+
+        for index, count in enumerate(waiting):
+            if not count:
+                submit(index)
+
+        mix = np.zeros((num_frames, self.plan.channels), dtype=np.float32)
+        next_layer = 0
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, output, seconds, cpu_seconds = future.result()
+                outputs[index] = output
+                op = steps[index].op
+                self.op_seconds[op] = self.op_seconds.get(op, 0.0) + seconds
+                self.offloaded_cpu_s += cpu_seconds
+                for dependent in self.plan.dependents[index]:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        submit(dependent)
+
+            # Mix finished layers while the pool keeps rendering, without reordering the sum
+            mix_start = time.perf_counter()
+            while next_layer < len(layers) and all(
+                    step is None or outputs[step] is not None for step, _ in layers[next_layer][1]):
+                self._mix_layer(mix, layers[next_layer][1], outputs)
+                next_layer += 1
+            self.op_seconds['mix'] = self.op_seconds.get('mix', 0.0) + time.perf_counter() - mix_start
+        return mix
+
+    def _timed_step(self, index, inputs, start, num_frames, record=True):
+        """
+        Run one step; returns (index, output, seconds, CPU seconds of the running thread),
+        adding the time to op_seconds when record is set
+        """
+        step = self.plan.steps[index]
+        step_start, cpu_start = time.perf_counter(), time.thread_time()
+        output = self.render_step(index, step, inputs, start, num_frames)
+        seconds = time.perf_counter() - step_start
+        if record:
+            self.op_seconds[step.op] = self.op_seconds.get(step.op, 0.0) + seconds
+        return index, output, seconds, time.thread_time() - cpu_start
+
+    @staticmethod
+    def _mix_layer(mix, terms, outputs):
+        for step, factor in terms:
+            mix += factor if step is None else outputs[step] * factor
+
+    def render_step(self, index, step, inputs, start, num_frames):
+        sample_rate = self.plan.sample_rate
+        params = step.params
+        op = step.op
+
+        if op == 'oscillator':
+            return oscillator(params['freqs'], start, num_frames, sample_rate)
+
+        if op == 'lfo':
+            return tremolo_lfo(params['rate'], params['depth'], start, num_frames, sample_rate)
+
+        if op == 'pulse_train':
+            pulse_frames = int(sample_rate * params['pulse_ms'] / 1000.0)
+            interval_frames = int(sample_rate * params['interval_ms'] / 1000.0)
+            remaining = self.total_frames - pulse_frames if params['fit_last'] else self.total_frames
+            pulse_count = max(0, -(-remaining // interval_frames))
+            return pulse_train(
+                params['freq'], start, num_frames, sample_rate, pulse_frames, interval_frames, pulse_count,
+                tremolo_rate=params['tremolo_rate'], tremolo_depth=params['tremolo_depth']
+            )
+
+        if op == 'noise':
+            if index not in self.state:
+                self.state[index] = np.random.default_rng(self._noise_seed(index, step))
+            return self.state[index].uniform(-1.0, 1.0, (num_frames, 1)).astype(np.float32)
+
+        if op == 'music':
+            block = self.music_block(start, num_frames)
+            if params['envelope']:
+                if self.music_range:
+                    music_min, music_max = self.music_range
+                    block = (block - music_min) / (music_max - music_min)
+                else:
+                    block = np.full_like(block, 0.5)
+            if len(block) < num_frames:
+                block = np.concatenate([block, np.zeros((num_frames - len(block), block.shape[1]), dtype=np.float32)])
+            return block
+
+        if op == 'filter':
+            return self.render_filter(index, params, inputs[0])
+
+        if op == 'multiply':
+            product = inputs[0]
+            for other in inputs[1:]:
+                product = product * other
+            return product
+
+        if op == 'sum':
+            total = np.zeros((num_frames, self.plan.channels), dtype=np.float32)
+            for source, factor in zip(inputs, params['factors']):
+                total += source * np.asarray(factor, dtype=np.float32)
+            return total
+
+        if op == 'const':
+            return np.ones((num_frames, 1), dtype=np.float32)
+
+        raise ValueError(f"Unknown render op: {op}")
+
+    def render_filter(self, index, params, source):
+        # scipy.signal takes about a second to import, so it loads on the first filter rather than at startup
+        from scipy.signal import butter, lfilter, sosfilt
+        if index not in self.state:
+            sample_rate = self.plan.sample_rate
+            if params['order'] == 1 and params['mode'] == 'lowpass':
+                b, a = one_pole_lowpass(params['cutoff'], sample_rate)
+                self.state[index] = {'ba': (b, a), 'zi': np.zeros((1, source.shape[1]))}
+            else:
+                sos = butter(params['order'], params['cutoff'], btype=params['mode'], fs=sample_rate, output='sos')
+                self.state[index] = {'sos': sos, 'zi': np.zeros((sos.shape[0], 2, source.shape[1]))}
+
+        state = self.state[index]
+        if 'sos' in state:
+            filtered, state['zi'] = sosfilt(state['sos'], source, axis=0, zi=state['zi'])
+        else:
+            filtered, state['zi'] = lfilter(*state['ba'], source, axis=0, zi=state['zi'])
+        return filtered.astype(np.float32)
+
+
+def filter_settle_frames(params, sample_rate, level=SETTLE_LEVEL):
+    """
+    Frames after which a filter's response to its initial state has decayed below ``level``
+
+    Derived from the filter's slowest pole, whose contribution shrinks by
+    its radius every frame.
+    """
+    from scipy.signal import butter
+    if params['order'] == 1 and params['mode'] == 'lowpass':
+        _, a = one_pole_lowpass(params['cutoff'], sample_rate)
+        radius = abs(a[1])
+    else:
+        sos = butter(params['order'], params['cutoff'], btype=params['mode'], fs=sample_rate, output='sos')
+        radius = max(float(np.abs(np.roots(section[3:])).max()) for section in sos)
+    if radius <= 0:
+        return 1
+    if radius >= 1:
+        raise ValueError('Filter is not stable')
+    return int(np.ceil(np.log(level) / np.log(radius)))
+
+
+def settle_frames(plan, level=SETTLE_LEVEL):
+    """
+    Frames a renderer started mid-timeline must render before its output can be kept
+
+    Every other op is computed analytically from the absolute frame index
+    (or, for seeded noise, skipped ahead exactly), so only filter states
+    need a run-in; chained filters add up.
+    """
+    settle = [0] * len(plan.steps)
+    for index, step in enumerate(plan.steps):
+        upstream = max((settle[i] for i in step.inputs), default=0)
+        own = filter_settle_frames(step.params, plan.sample_rate, level) if step.op == 'filter' else 0
+        settle[index] = upstream + own
+    return max(settle, default=0)
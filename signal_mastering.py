@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Signal Mastering
+Loudness measurement (BS.1770-style), loudness normalization and a
+look-ahead true-peak limiter, all operating on float (frames, channels) blocks
+"""
+import numpy as np
+
+DEFAULT_TARGET_LUFS = -16.0
+DEFAULT_TRUE_PEAK_DB = -1.0
+DEFAULT_LOOKAHEAD_MS = 10.0
+MAX_NORMALIZATION_GAIN_DB = 20.0  # Never boost near-silent mixes into a wall of noise
+TRUE_PEAK_OVERSAMPLING = 4
+
+# BS.1770 gating
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+GATE_BLOCK_SECONDS = 0.4
+GATE_STEP_SECONDS = 0.1  # 75% overlap between gating blocks
+
+
+def k_weighting_sos(sample_rate):
+    """
+    K-weighting filter (BS.1770 pre-filter + RLB high-pass) for any sample rate
+
+    Bilinear-transform designs matching the BS.1770 reference
+    coefficients at 48 kHz (as used by libebur128).
+
+    Returns:
+        Second-order sections array for ``scipy.signal.sosfilt``
+    """
+    # Stage 1: high-shelf pre-filter (head acoustics)
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10.0 ** (3.999843853973347 / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    # Stage 2: RLB high-pass
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    return np.array([shelf, high_pass])
+
+
+class LoudnessMeter:
+    """
+    Streaming integrated-loudness meter
+
+    Feed mix blocks in order with ``add``; filter state and partial
+    100 ms gating steps carry across calls, so memory stays at one
+    energy value per channel per 100 ms regardless of render length.
+    """
+
+    def __init__(self, sample_rate, channels):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # Imported on first use: scipy.signal is the bulk of the app's import time
+        from scipy.signal import sosfilt
+        self._sosfilt = sosfilt
+        self._sos = k_weighting_sos(sample_rate)
+        self._zi = np.zeros((self._sos.shape[0], 2, channels))
+        self._step_frames = int(round(sample_rate * GATE_STEP_SECONDS))
+        self._pending = np.zeros((0, channels))
+        self._step_energy = []
+
+    def add(self, block):
+        """Measure a (frames, channels) block"""
+        weighted, self._zi = self._sosfilt(self._sos, block, axis=0, zi=self._zi)
+        squared = np.concatenate([self._pending, weighted * weighted])
+
+        whole_steps = len(squared) // self._step_frames
+        if whole_steps:
+            steps = squared[:whole_steps * self._step_frames]
+            self._step_energy.append(steps.reshape(whole_steps, self._step_frames, self.channels).mean(axis=1))
+        self._pending = squared[whole_steps * self._step_frames:]
+
+    def integrated_loudness(self):
+        """
+        Gated integrated loudness in LUFS
+
+        Returns:
+            Loudness in LUFS, or -inf if the programme is silent or shorter than one gating block
+        """
+        steps_per_block = int(round(GATE_BLOCK_SECONDS / GATE_STEP_SECONDS))
+        if not self._step_energy:
+            return float('-inf')
+        step_energy = np.concatenate(self._step_energy)
+        if len(step_energy) < steps_per_block:
+            return float('-inf')
+
+        # 400 ms blocks from four consecutive 100 ms steps (channel weights are 1.0 for L/R/mono)
+        cumulative = np.concatenate([np.zeros((1, self.channels)), np.cumsum(step_energy, axis=0)])
+        block_energy = (cumulative[steps_per_block:] - cumulative[:-steps_per_block]) / steps_per_block
+        block_power = block_energy.sum(axis=1)
+
+        with np.errstate(divide='ignore'):
+            block_loudness = -0.691 + 10 * np.log10(block_power)
+
+        gated = block_power[block_loudness > ABSOLUTE_GATE_LUFS]
+        if not len(gated):
+            return float('-inf')
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE_LU
+        gated = block_power[block_loudness > max(relative_gate, ABSOLUTE_GATE_LUFS)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def normalization_gain_db(measured_lufs, target_lufs=DEFAULT_TARGET_LUFS):
+    """Gain (dB) that brings a measured loudness to the target, capped for near-silent input"""
+    if not np.isfinite(measured_lufs):
+        return 0.0
+    return float(min(target_lufs - measured_lufs, MAX_NORMALIZATION_GAIN_DB))
+
+
+def _limiter_gain(segment, ceiling, lookahead_frames):
+    """
+    Smooth gain curve keeping a segment's true peak under the ceiling
+
+    The required gain per frame is spread backwards over the look-ahead
+    window (running minimum) and then averaged over the same window, so
+    the curve ramps down before each overshoot and never exceeds the
+    required gain at the overshoot itself.
+    """
+    from scipy.ndimage import minimum_filter1d, uniform_filter1d
+    from scipy.signal import resample_poly
+
+    oversampled = resample_poly(segment, TRUE_PEAK_OVERSAMPLING, 1, axis=0)
+    frame_peak = np.abs(oversampled).max(axis=1).reshape(-1, TRUE_PEAK_OVERSAMPLING).max(axis=1)
+    frame_peak = np.maximum(frame_peak, np.abs(segment).max(axis=1))
+
+    required = np.minimum(1.0, ceiling / np.maximum(frame_peak, 1e-12))
+    window = lookahead_frames + 1
+    held = minimum_filter1d(required, window, origin=-(window // 2), mode='nearest')
+    return uniform_filter1d(held, window, origin=(window - 1) // 2, mode='nearest')
+
+
+def limiter_context_frames(sample_rate, lookahead_ms=DEFAULT_LOOKAHEAD_MS):
+    """Frames on either side of a frame that can influence the limiter's gain there"""
+    lookahead_frames = max(1, int(sample_rate * lookahead_ms / 1000.0))
+    return 2 * lookahead_frames + 32  # Covers both filter windows and the oversampling FIR
+
+
+def limit_true_peak(buffer, sample_rate, ceiling_db=DEFAULT_TRUE_PEAK_DB, lookahead_ms=DEFAULT_LOOKAHEAD_MS,
+                    gain=1.0, block_frames=65536, on_block=None):
+    """
+    Apply gain and a look-ahead true-peak limiter to a (frames, channels) buffer in place
+
+    Works block by block with enough surrounding context that the result
+    is identical to processing the whole buffer at once.
+
+    Args:
+        buffer: float32 (frames, channels) mix buffer, modified in place
+        sample_rate: Sample rate in Hz
+        ceiling_db: True-peak ceiling in dBTP
+        lookahead_ms: Look-ahead (and release) time in milliseconds
+        gain: Linear gain applied before limiting (e.g. loudness normalization)
+        block_frames: Frames processed per block
+        on_block: Optional callback(num_frames) after each block, for progress reporting
+
+    Returns:
+        Maximum gain reduction applied by the limiter, in dB (0.0 if it never engaged)
+    """
+    ceiling = 10.0 ** (ceiling_db / 20.0)
+    lookahead_frames = max(1, int(sample_rate * lookahead_ms / 1000.0))
+    context = limiter_context_frames(sample_rate, lookahead_ms)
+    total_frames = len(buffer)
+    min_gain = 1.0
+
+    # Unprocessed frames preceding the current block (the block loop overwrites the buffer)
+    history = np.zeros((0, buffer.shape[1]), dtype=buffer.dtype)
+    for start in range(0, total_frames, block_frames):
+        stop = min(start + block_frames, total_frames)
+        block = buffer[start:stop]
+        segment = np.concatenate([history, block, buffer[stop:stop + context]]) * gain
+
+        block_gain = _limiter_gain(segment, ceiling, lookahead_frames)[len(history):len(history) + len(block)]
+        min_gain = min(min_gain, float(block_gain.min()))
+
+        history = np.concatenate([history, block])[-context:].copy()
+        block *= (gain * block_gain)[:, None].astype(buffer.dtype)
+        if on_block:
+            on_block(len(block))
+
+    return float(-20 * np.log10(min_gain)) if min_gain < 1.0 else 0.0
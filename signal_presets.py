@@ -77,7 +77,9 @@ SIGNAL_PRESETS = {
             "ambient_freq": 432,
             "use_music_modulation": True,
             "use_tremolo": True,
-            "tremolo_depth": 0.6
+            "tremolo_depth": 0.6,
+            "channels": 2,
+            "binaural_beat_freq": 6.0
         }
     },
     "golden_ratio": {
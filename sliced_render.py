@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Time-Sliced Rendering
+Renders long timelines as independent slices on a pool of worker processes
+
+Every render op except filters is a function of the absolute frame index
+(oscillators, LFOs and pulse trains), or can be skipped ahead exactly
+(seeded noise). A slice can therefore start anywhere: its renderer runs
+in from a few hundred frames before the slice, long enough for filter
+states to decay below float32 resolution, and discards those frames.
+Unseeded noise is drawn from one per-render ``noise_seed`` shared by all
+slices, so seams are bit-exact for filter-free designs and inaudible
+otherwise.
+
+Slices are aligned to the render block grid and handed back in timeline
+order, so the caller meters and assembles them exactly as it would blocks
+from a single renderer. Off by default; enable with ``set_render_processes``
+(``RENDER_PROCESSES`` in the app).
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from signal_graph import settle_frames
+
+SLICE_MIN_SECONDS = 120  # Shorter renders aren't worth the hand-off to other processes
+MAX_SLICE_SECONDS = 90  # Bounds per-slice transfers and keeps progress moving on long renders
+MAX_IN_FLIGHT_PER_PROCESS = 2  # Slices submitted ahead of the one being assembled
+
+_render_processes = 0
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _init_worker(threads):
+    # Split the cores between processes instead of giving each a full thread pool
+    from signal_graph import set_render_threads
+    set_render_threads(threads)
+
+
+def set_render_processes(processes):
+    """
+    Enable time-sliced rendering across worker processes
+
+    Args:
+        processes: Worker processes (0 or 1 = render every timeline in-process)
+    """
+    global _render_processes, _process_pool
+    with _process_pool_lock:
+        processes = max(0, int(processes))
+        if processes != _render_processes and _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+        _render_processes = processes
+
+
+def process_pool():
+    """The shared slice pool, or None when time slicing is off"""
+    global _process_pool
+    with _process_pool_lock:
+        if _render_processes <= 1:
+            return None
+        if _process_pool is None:
+            threads = max(1, (os.cpu_count() or 1) // _render_processes)
+            _process_pool = ProcessPoolExecutor(max_workers=_render_processes, initializer=_init_worker,
+                                                initargs=(threads,))
+        return _process_pool
+
+
+def plan_slices(total_frames, sample_rate, block_frames):
+    """
+    Split a timeline into slices for the process pool
+
+    Returns:
+        List of (start, stop) frame ranges on the block grid, or [] if the
+        render should stay in-process
+    """
+    if _render_processes <= 1 or total_frames < SLICE_MIN_SECONDS * sample_rate:
+        return []
+    blocks = -(-total_frames // block_frames)
+    max_slice_blocks = max(1, int(MAX_SLICE_SECONDS * sample_rate) // block_frames)
+    count = min(blocks, max(_render_processes, -(-blocks // max_slice_blocks)))
+    bounds = [round(i * blocks / count) * block_frames for i in range(count + 1)]
+    bounds[-1] = total_frames
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+
+
+def render_slice(plan, total_frames, start, stop, run_in, block_frames, music=None, music_offset=0,
+                 music_range=None, noise_seed=None):
+    """
+    Render frames [start, stop) of a plan with a fresh renderer (runs in a worker process)
+
+    Slices of one render given the same ``noise_seed`` line up exactly, unseeded noise included.
+
+    Returns:
+        (float32 (stop - start, channels) mix, stats): stats holds the per-op seconds
+        (``op_seconds``) and the CPU time of the calling thread (``thread_cpu_s``)
+        and of the render pool's threads (``offloaded_cpu_s``)
+    """
+    cpu_start = time.thread_time()
+    first = max(0, start - run_in)
+    renderer = plan.renderer(total_frames, music=music, music_offset=music_offset, music_range=music_range,
+                             noise_seed=noise_seed)
+    renderer.seek(first)
+    if first < start:
+        # Run-in: settles filter states, then is thrown away
+        for block_start in range(first, start, block_frames):
+            renderer.render_block(block_start, min(block_frames, start - block_start))
+
+    mix = np.empty((stop - start, plan.channels), dtype=np.float32)
+    for block_start in range(start, stop, block_frames):
+        num_frames = min(block_frames, stop - block_start)
+        mix[block_start - start:block_start - start + num_frames] = renderer.render_block(block_start, num_frames)
+    return mix, {'op_seconds': renderer.op_seconds, 'thread_cpu_s': time.thread_time() - cpu_start,
+                 'offloaded_cpu_s': renderer.offloaded_cpu_s}
+
+
+def render_sliced(plan, total_frames, slices, block_frames, music=None, music_range=None, stats=None,
+                  noise_seed=None):
+    """
+    Render slices on the process pool, yielding them in timeline order
+
+    Only a few slices are in flight at once, which bounds the memory held
+    by music excerpts and finished slices waiting for their turn. Closing
+    the generator early (e.g. on cancellation) drops the slices not yet
+    started.
+
+    Args:
+        plan: RenderPlan (sent to the workers)
+        total_frames: Length of the whole render
+        slices: Frame ranges from plan_slices
+        block_frames: Block size used inside each slice
+        music: Optional (frames, channels) music array; each worker gets only its excerpt
+        music_range: Envelope range of the whole track (from the parent's renderer)
+        stats: Optional PlanRenderer whose ``op_seconds`` and ``offloaded_cpu_s`` accumulate
+            the workers' per-op time and CPU time
+        noise_seed: Seed for noise nodes without their own; without one, each slice
+            draws independent noise and the seams don't line up
+
+    Yields:
+        (start frame, (frames, channels) float32 mix)
+    """
+    pool = process_pool()
+    run_in = settle_frames(plan)
+    pending = deque()
+    queued = iter(slices)
+    max_in_flight = MAX_IN_FLIGHT_PER_PROCESS * _render_processes
+
+    def submit_next():
+        start, stop = next(queued, (None, None))
+        if start is None:
+            return
+        excerpt, offset = None, 0
+        if music is not None:
+            offset = max(0, start - run_in)
+            excerpt = np.array(music[offset:stop])
+        pending.append((start, pool.submit(render_slice, plan, total_frames, start, stop, run_in, block_frames,
+                                           excerpt, offset, music_range, noise_seed)))
+
+    try:
+        for _ in range(max_in_flight):
+            submit_next()
+        while pending:
+            start, future = pending.popleft()
+            mix, slice_stats = future.result()
+            submit_next()
+            if stats is not None:
+                for op, value in slice_stats['op_seconds'].items():
+                    stats.op_seconds[op] = stats.op_seconds.get(op, 0.0) + value
+                # Everything a worker process spends is off the calling thread
+                stats.offloaded_cpu_s += slice_stats['thread_cpu_s'] + slice_stats['offloaded_cpu_s']
+            yield start, mix
+    finally:
+        for _, future in pending:
+            future.cancel()
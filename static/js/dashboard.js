@@ -3,9 +3,16 @@
 let currentTaskId = null;
 let currentFilename = null;
 let currentWaveform = null;
+let currentPresetConfig = {};
 let loadingModal = null;
 let progressInterval = null;
+let pendingTaskId = null;  // Generation currently queued or running
 let audioPlayer = null;
+let previewSessionId = null;  // Live preview session, while the preview switch is on
+let previewInFlight = false;
+let previewPending = false;  // Parameters changed while an update was in flight
+// Web Crypto can only digest a whole buffer, so larger files skip the duplicate pre-check
+const UPLOAD_HASH_MAX_BYTES = 64 * 1024 * 1024;
 
 // Web Audio API variables
 let audioContext = null;
@@ -54,6 +61,12 @@ function initializeEventListeners() {
         downloadYoutubeBtn.addEventListener('click', handleYoutubeDownload);
     }
 
+    // Cancel generation button
+    const cancelGenerationBtn = document.getElementById('cancelGenerationBtn');
+    if (cancelGenerationBtn) {
+        cancelGenerationBtn.addEventListener('click', cancelGeneration);
+    }
+
     // Tremolo depth slider
     document.getElementById('tremoloDepth').addEventListener('input', function (e) {
         document.getElementById('tremoloDepthValue').textContent = e.target.value;
@@ -64,6 +77,12 @@ function initializeEventListeners() {
         document.getElementById('tremoloSettings').style.display = e.target.checked ? 'block' : 'none';
     });
 
+    // Live preview: re-render a short loop whenever a parameter changes
+    document.getElementById('livePreviewSwitch').addEventListener('change', handlePreviewSwitch);
+    document.querySelectorAll('.freq-input, #tremoloDepth, #tremoloSwitch').forEach(function (input) {
+        input.addEventListener('input', updatePreview);
+    });
+
     // Generate button
     const generateBtn = document.getElementById('generateBtn');
     if (generateBtn) {
@@ -105,6 +124,7 @@ function initializeEventListeners() {
 function handlePresetChange(e) {
     const presetName = e.target.value;
     if (!presetName) {
+        currentPresetConfig = {};
         document.getElementById('presetDescription').classList.add('d-none');
         return;
     }
@@ -119,12 +139,14 @@ function handlePresetChange(e) {
 
             // Update configuration
             const config = preset.config;
+            currentPresetConfig = config;
             document.getElementById('baseToneFreq').value = config.base_tone_freq;
             document.getElementById('schumannFreq').value = config.schumann_freq;
             document.getElementById('dnaRepairFreq').value = config.dna_repair_freq;
             document.getElementById('ambientFreq').value = config.ambient_freq;
             document.getElementById('chirpFreq').value = config.chirp_freq;
             document.getElementById('ultrasonicFreq').value = config.ultrasonic_freq;
+            document.getElementById('sampleRate').value = config.sample_rate || 44100;
 
             document.getElementById('useMusicSwitch').checked = config.use_music_modulation;
             handleMusicSwitchChange({ target: document.getElementById('useMusicSwitch') });
@@ -219,20 +241,22 @@ function handleMusicUpload() {
         return;
     }
 
-    const formData = new FormData();
-    formData.append('file', file);
-
     loadingModal.show();
 
-    fetch('/api/upload_music', {
-        method: 'POST',
-        body: formData
-    })
+    // The file is sent as the raw request body, so the server decodes it as it arrives;
+    // with its hash up front, a track that is already stored isn't uploaded again
+    fileSha256(file)
+        .then(hash => fetch(`/api/upload_music?filename=${encodeURIComponent(file.name)}&sha256=${hash}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: file
+        }))
         .then(response => response.json())
         .then(data => {
             loadingModal.hide();
             if (data.status === 'success') {
-                alert(`Music file uploaded successfully!\nDuration: ${Math.round(data.duration_seconds)} seconds`);
+                const note = data.duplicate ? `\nAlready stored as ${data.filename}` : '';
+                alert(`Music file uploaded successfully!\nDuration: ${Math.round(data.duration_seconds)} seconds${note}`);
                 loadMusicFiles();
                 fileInput.value = '';
             } else {
@@ -246,6 +270,18 @@ function handleMusicUpload() {
         });
 }
 
+function fileSha256(file) {
+    // Web Crypto is only available in secure contexts (HTTPS or localhost); the server hashes anyway.
+    // Hashing reads the whole file into memory, so large files are uploaded without the pre-check
+    if (!window.crypto || !window.crypto.subtle || file.size > UPLOAD_HASH_MAX_BYTES) {
+        return Promise.resolve('');
+    }
+    return file.arrayBuffer()
+        .then(buffer => window.crypto.subtle.digest('SHA-256', buffer))
+        .then(digest => Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join(''))
+        .catch(() => '');
+}
+
 function handleYoutubeDownload() {
     const urlInput = document.getElementById('youtubeUrl');
     const url = urlInput.value.trim();
@@ -260,8 +296,8 @@ function handleYoutubeDownload() {
         return;
     }
 
-    loadingModal.show();
-    document.getElementById('progressText').textContent = 'Downloading audio from YouTube...';
+    showProgressModal();
+    updateProgressDisplay(0, 'Downloading audio from YouTube...');
 
     fetch('/api/download_youtube', {
         method: 'POST',
@@ -272,50 +308,92 @@ function handleYoutubeDownload() {
     })
         .then(response => response.json())
         .then(data => {
-            loadingModal.hide();
-            if (data.status === 'success') {
-                const cacheMsg = data.cached ? ' (from cache)' : '';
-                const title = data.title ? `"${data.title}"` : 'Audio';
-                alert(`${title} downloaded successfully!${cacheMsg}\nDuration: ${Math.round(data.duration_seconds)} seconds`);
-
-                // Reload music files and auto-select the new one
-                loadMusicFiles().then(() => {
-                    const selector = document.getElementById('musicFileSelector');
-                    selector.value = data.filename;
-
-                    // Enable music switch if not already enabled
-                    const musicSwitch = document.getElementById('useMusicSwitch');
-                    if (!musicSwitch.checked) {
-                        musicSwitch.checked = true;
-                        handleMusicSwitchChange({ target: musicSwitch });
-                    }
-                });
-
-                urlInput.value = '';
+            if (data.status === 'started') {
+                // The download runs in the background; follow it over SSE
+                listenToYoutubeProgress(data.job_id, urlInput);
+            } else if (data.status === 'success') {
+                hideProgressModal();
+                youtubeAudioReady(data, urlInput);
             } else {
+                hideProgressModal();
                 alert('Error downloading YouTube audio: ' + data.message);
             }
         })
         .catch(error => {
-            loadingModal.hide();
+            hideProgressModal();
             console.error('Error downloading YouTube audio:', error);
             alert('Error downloading YouTube audio: ' + error.message);
         });
 }
 
-function handleGenerateSignal() {
-    const config = {
+function listenToYoutubeProgress(jobId, urlInput) {
+    const eventSource = new EventSource(`/api/youtube_progress/${jobId}`);
+
+    eventSource.onmessage = function (event) {
+        const data = JSON.parse(event.data);
+        const eta = data.status === 'downloading' && data.eta_s > 0 ? ` (~${Math.ceil(data.eta_s)}s left)` : '';
+        updateProgressDisplay(data.progress, data.message + eta);
+
+        if (data.status === 'completed') {
+            eventSource.close();
+            hideProgressModal();
+            youtubeAudioReady({ ...data.result, cached: false }, urlInput);
+        } else if (data.status === 'error') {
+            eventSource.close();
+            hideProgressModal();
+            alert('Error downloading YouTube audio: ' + data.error);
+        }
+    };
+
+    eventSource.onerror = function (error) {
+        console.error('SSE error:', error);
+        eventSource.close();
+        hideProgressModal();
+        alert('Connection error during YouTube download');
+    };
+}
+
+function youtubeAudioReady(data, urlInput) {
+    const cacheMsg = data.cached ? ' (from cache)' : '';
+    const title = data.title ? `"${data.title}"` : 'Audio';
+    alert(`${title} downloaded successfully!${cacheMsg}\nDuration: ${Math.round(data.duration_seconds)} seconds`);
+
+    // Reload music files and auto-select the new one
+    loadMusicFiles().then(() => {
+        const selector = document.getElementById('musicFileSelector');
+        selector.value = data.filename;
+
+        // Enable music switch if not already enabled
+        const musicSwitch = document.getElementById('useMusicSwitch');
+        if (!musicSwitch.checked) {
+            musicSwitch.checked = true;
+            handleMusicSwitchChange({ target: musicSwitch });
+        }
+    });
+
+    urlInput.value = '';
+}
+
+function collectConfig() {
+    // Preset-only settings (e.g. stereo/binaural) carry through; form inputs override
+    return {
+        ...currentPresetConfig,
         base_tone_freq: parseInt(document.getElementById('baseToneFreq').value),
         schumann_freq: parseFloat(document.getElementById('schumannFreq').value),
         dna_repair_freq: parseInt(document.getElementById('dnaRepairFreq').value),
         ambient_freq: parseInt(document.getElementById('ambientFreq').value),
         chirp_freq: parseInt(document.getElementById('chirpFreq').value),
         ultrasonic_freq: parseInt(document.getElementById('ultrasonicFreq').value),
+        sample_rate: parseInt(document.getElementById('sampleRate').value),
         use_music_modulation: document.getElementById('useMusicSwitch').checked,
         use_music_as_foundation: document.getElementById('musicFoundationSwitch').checked,
         use_tremolo: document.getElementById('tremoloSwitch').checked,
         tremolo_depth: parseFloat(document.getElementById('tremoloDepth').value) / 100
     };
+}
+
+function handleGenerateSignal() {
+    const config = collectConfig();
 
     const useMusic = document.getElementById('useMusicSwitch').checked;
     const musicFile = useMusic ? document.getElementById('musicFileSelector').value : null;
@@ -330,6 +408,10 @@ function handleGenerateSignal() {
     };
 
     const hasMusic = useMusic && musicFile;
+    // A new generation replaces any render still in flight
+    if (pendingTaskId) {
+        cancelGeneration();
+    }
     showProgressModal(hasMusic);
 
     fetch('/api/generate', {
@@ -347,6 +429,8 @@ function handleGenerateSignal() {
         })
         .then(data => {
             if (data.status === 'started') {
+                pendingTaskId = data.task_id;
+                document.getElementById('cancelGenerationBtn').disabled = false;
                 // Start listening to progress updates with slight delay
                 setTimeout(() => {
                     listenToProgress(data.task_id);
@@ -363,12 +447,105 @@ function handleGenerateSignal() {
         });
 }
 
+// ========== Live Preview ==========
+
+function handlePreviewSwitch(e) {
+    const previewPlayer = document.getElementById('previewPlayer');
+    if (!e.target.checked) {
+        previewSessionId = null;
+        previewPlayer.pause();
+        previewPlayer.classList.add('d-none');
+        return;
+    }
+
+    const useMusic = document.getElementById('useMusicSwitch').checked;
+    fetch('/api/preview', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            config: collectConfig(),
+            use_music: useMusic,
+            music_file: useMusic ? document.getElementById('musicFileSelector').value : null
+        })
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'success') {
+                throw new Error(data.message);
+            }
+            previewSessionId = data.session_id;
+            previewPlayer.classList.remove('d-none');
+            previewPlayer.src = data.audio_url;
+            previewPlayer.play();
+        })
+        .catch(error => {
+            e.target.checked = false;
+            console.error('Error starting preview:', error);
+            alert('Error starting preview: ' + error.message);
+        });
+}
+
+function updatePreview() {
+    if (!previewSessionId) {
+        return;
+    }
+    // One update at a time; changes made meanwhile are sent together when it returns
+    if (previewInFlight) {
+        previewPending = true;
+        return;
+    }
+    previewInFlight = true;
+    previewPending = false;
+
+    fetch(`/api/preview/${previewSessionId}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ config: collectConfig() })
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'success' || !previewSessionId) {
+                return;
+            }
+            // Swap in the new loop at the same position
+            const previewPlayer = document.getElementById('previewPlayer');
+            const position = previewPlayer.currentTime;
+            const playing = !previewPlayer.paused;
+            previewPlayer.src = data.audio_url;
+            previewPlayer.addEventListener('loadedmetadata', function () {
+                previewPlayer.currentTime = position % previewPlayer.duration;
+                if (playing) {
+                    previewPlayer.play();
+                }
+            }, { once: true });
+        })
+        .catch(error => console.error('Error updating preview:', error))
+        .finally(() => {
+            previewInFlight = false;
+            if (previewPending) {
+                updatePreview();
+            }
+        });
+}
+
+function cancelGeneration() {
+    // The SSE stream reports the final 'cancelled' status and closes the modal
+    if (!pendingTaskId) return;
+    document.getElementById('cancelGenerationBtn').disabled = true;
+    fetch(`/api/cancel/${pendingTaskId}`, { method: 'POST' })
+        .catch(error => console.error('Error cancelling generation:', error));
+}
+
 function listenToProgress(taskId) {
     const eventSource = new EventSource(`/api/progress/${taskId}`);
 
     eventSource.onmessage = function (event) {
         const data = JSON.parse(event.data);
-        updateProgressDisplay(data.progress, data.message);
+        updateProgressDisplay(data.progress, formatProgressMessage(data));
+
+        if (['completed', 'error', 'cancelled'].includes(data.status)) {
+            pendingTaskId = null;
+        }
 
         if (data.status === 'completed' && data.result) {
             eventSource.close();
@@ -377,17 +554,21 @@ function listenToProgress(taskId) {
             // Display the results
             currentTaskId = taskId;  // Store task ID for downloads
             currentFilename = data.result.filename;
-            currentWaveform = data.result.waveform;
+            const visualization = decodeVisualization(data.result);
+            currentWaveform = visualization.waveform;
             displaySignalInfo(data.result);
-            drawWaveform(data.result.waveform);
-            drawSpectrum(data.result.fft);
-            drawSpectrogram(data.result.waveform, data.result.duration_ms);
+            drawWaveform(visualization.waveform);
+            drawSpectrum(visualization.fft);
+            drawSpectrogram(visualization.waveform, data.result.duration_ms);
             showDownloadButton(taskId, data.result.filename);  // Pass task_id
 
         } else if (data.status === 'error') {
             eventSource.close();
             hideProgressModal();
             alert('Error generating signal: ' + data.error);
+        } else if (data.status === 'cancelled') {
+            eventSource.close();
+            hideProgressModal();
         }
     };
 
@@ -399,6 +580,38 @@ function listenToProgress(taskId) {
     };
 }
 
+function decodeVisualization(result) {
+    // The final progress event carries quantized base64 arrays (value = q * scale + offset);
+    // results requested with ?visualization=json carry plain float lists instead
+    if (!result.visualization) {
+        return { waveform: result.waveform, fft: result.fft };
+    }
+    const typedArrays = { int8: Int8Array, uint8: Uint8Array, int16: Int16Array, uint16: Uint16Array };
+    const decode = name => {
+        const array = result.visualization.arrays[name];
+        const bytes = Uint8Array.from(atob(array.data), c => c.charCodeAt(0));
+        const values = new typedArrays[array.dtype](bytes.buffer, 0, array.count);
+        return Array.from(values, q => q * array.scale + array.offset);
+    };
+    return {
+        waveform: decode('waveform'),
+        fft: { frequencies: decode('fft_frequencies'), magnitudes: decode('fft_magnitudes') }
+    };
+}
+
+function formatProgressMessage(data) {
+    // Append the server's estimate, e.g. "Mixing all signal layers... (1.2M / 2.6M samples, ~4s left)"
+    const details = [];
+    if (data.samples_total) {
+        const fmt = n => n >= 1e6 ? (n / 1e6).toFixed(1) + 'M' : Math.round(n / 1e3) + 'k';
+        details.push(`${fmt(data.samples_rendered || 0)} / ${fmt(data.samples_total)} samples`);
+    }
+    if (data.status === 'running' && data.eta_s > 0) {
+        details.push(`~${Math.ceil(data.eta_s)}s left`);
+    }
+    return details.length ? `${data.message} (${details.join(', ')})` : data.message;
+}
+
 function updateProgressDisplay(progress, message) {
     const progressBar = document.getElementById('progressBar');
     const progressSpinner = document.getElementById('progressSpinner');
@@ -424,6 +637,7 @@ function showProgressModal(withMusic = false) {
     progressBar.setAttribute('aria-valuenow', '0');
     progressSpinner.style.opacity = '0.2';
     progressText.textContent = 'Initializing...';
+    document.getElementById('cancelGenerationBtn').disabled = true;
 
     loadingModal.show();
 
@@ -3,42 +3,99 @@
 UAP Signal Generator - Enhanced Multi-Layer Approach
 Combines amplitude modulation, tremolo, and carrier waves for intelligent contact signaling
 """
-from pydub.generators import Sine, WhiteNoise
-from pydub import AudioSegment
-from pydub.effects import low_pass_filter
 import numpy as np
-from scipy.fftpack import fft
-from scipy.signal import hilbert
-import pydub
+from signal_graph import compile_graph, db_to_gain, DEFAULT_MIN_AUDIBLE_FREQ
+from sliced_render import plan_slices, render_sliced
+from loop_render import loop_period, loop_work_frames, render_loop, meter_loop, limit_looped
+from signal_mastering import (
+    LoudnessMeter, limit_true_peak, normalization_gain_db,
+    DEFAULT_TARGET_LUFS, DEFAULT_TRUE_PEAK_DB
+)
+from render_metrics import RenderProfile
+from functools import lru_cache
 import os
 import shutil
+from math import gcd
+
+# Where to look for FFmpeg when it isn't on PATH
+FFMPEG_FALLBACK_PATHS = [
+    "C:\\Users\\Duncan\\FFmpeg\\bin\\ffmpeg.exe",  # Windows
+    '/usr/bin/ffmpeg',  # Standard Linux
+    '/app/.apt/usr/bin/ffmpeg',  # Heroku with apt buildpack
+    '/app/vendor/ffmpeg/ffmpeg',  # Static build
+]
 
-# Configure FFmpeg - check multiple locations
-ffmpeg_path = shutil.which('ffmpeg')
-if not ffmpeg_path:
-    # Try common paths
-    possible_paths = [
-        "C:\\Users\\Duncan\\FFmpeg\\bin\\ffmpeg.exe",  # Windows
-        '/usr/bin/ffmpeg',  # Standard Linux
-        '/app/.apt/usr/bin/ffmpeg',  # Heroku with apt buildpack
-        '/app/vendor/ffmpeg/ffmpeg',  # Static build
-    ]
-    for path in possible_paths:
-        if os.path.exists(path):
-            ffmpeg_path = path
-            break
 
-if ffmpeg_path:
-    # Set environment variable for ffmpeg location
-    os.environ['FFMPEG_BINARY'] = ffmpeg_path
-    os.environ['FFPROBE_BINARY'] = ffmpeg_path.replace('ffmpeg', 'ffprobe')
+@lru_cache(maxsize=None)
+def find_ffmpeg():
+    """
+    Locate FFmpeg (PATH first, then common install folders)
     
-    AudioSegment.converter = ffmpeg_path
-    AudioSegment.ffmpeg = ffmpeg_path
-    AudioSegment.ffprobe = ffmpeg_path.replace('ffmpeg', 'ffprobe')
-    print(f"FFmpeg configured at: {ffmpeg_path}")
-else:
-    print("WARNING: FFmpeg not found!")
+    Runs on first use rather than at import and is memoized, so the
+    filesystem is probed once per process.
+    
+    Returns:
+        Path to the ffmpeg binary, or None
+    """
+    ffmpeg_path = shutil.which('ffmpeg')
+    if not ffmpeg_path:
+        ffmpeg_path = next((path for path in FFMPEG_FALLBACK_PATHS if os.path.exists(path)), None)
+    
+    if ffmpeg_path:
+        # Set environment variable for ffmpeg location
+        os.environ['FFMPEG_BINARY'] = ffmpeg_path
+        os.environ['FFPROBE_BINARY'] = ffmpeg_path.replace('ffmpeg', 'ffprobe')
+        print(f"FFmpeg configured at: {ffmpeg_path}")
+    else:
+        print("WARNING: FFmpeg not found!")
+    return ffmpeg_path
+
+
+@lru_cache(maxsize=None)
+def audio_segment_class():
+    """pydub's AudioSegment, imported on first use and pointed at FFmpeg"""
+    from pydub import AudioSegment
+    ffmpeg_path = find_ffmpeg()
+    if ffmpeg_path:
+        AudioSegment.converter = ffmpeg_path
+        AudioSegment.ffmpeg = ffmpeg_path
+        AudioSegment.ffprobe = ffmpeg_path.replace('ffmpeg', 'ffprobe')
+    return AudioSegment
+
+
+# Render settings
+DEFAULT_SAMPLE_RATE = 44100
+SUPPORTED_SAMPLE_RATES = (44100, 48000, 96000)
+RENDER_BLOCK_FRAMES = 65536  # Frames mixed per block (bounds temporary buffers)
+TYPICAL_UNITS_PER_FRAME = 15  # Plan steps + layers of a typical design, for estimates made before compiling
+MUSIC_BYTES_PER_SECOND = 16000  # ~128 kbps; sizes a music render before the file is decoded
+SUPPORTED_CHANNELS = (1, 2)
+MP3_MAX_SAMPLE_RATE = 48000  # MPEG-1 Layer III tops out at 48 kHz; high-rate renders are downsampled on export
+
+# Default configuration (presets and API requests are merged over this)
+DEFAULT_CONFIG = {
+    'base_tone_freq': 100,
+    'schumann_freq': 7.83,
+    'dna_repair_freq': 528,
+    'ultrasonic_freq': 17000,
+    'chirp_freq': 2500,
+    'ambient_freq': 432,
+    'use_music_modulation': True,
+    'use_music_as_foundation': False,
+    'use_tremolo': True,
+    'tremolo_depth': 0.5,
+    'sample_rate': DEFAULT_SAMPLE_RATE,  # Synthesis runs natively at this rate
+    'channels': 1,  # 1 = mono, 2 = stereo
+    'binaural_beat_freq': 0,  # Hz offset between left/right ears (stereo only, 0 = off)
+    'binaural_layers': ['base_tone'],  # Layers rendered as binaural pairs
+    'layer_pan': {},  # Layer name -> pan (-1.0 left ... 0.0 centre ... 1.0 right)
+    'disabled_layers': [],  # Layer names to leave out of the mix
+    'min_audible_freq': DEFAULT_MIN_AUDIBLE_FREQ,  # Tone layers entirely below this are skipped (0 keeps them)
+    'mastering': True,  # Loudness normalization + true-peak limiting on the final mix
+    'target_lufs': DEFAULT_TARGET_LUFS,
+    'true_peak_db': DEFAULT_TRUE_PEAK_DB,
+    'loop_synthesis': True  # Music-free renders longer than two periods render one period and tile it
+}
 
 
 def apply_amplitude_modulation(carrier, modulator):
@@ -52,9 +109,9 @@ def apply_amplitude_modulation(carrier, modulator):
     Returns:
         AudioSegment with amplitude modulation applied
     """
-    # Convert both to mono to ensure compatibility
-    carrier = carrier.set_channels(1)
-    modulator = modulator.set_channels(1)
+    # Match the modulator's channel layout to the carrier (stereo stays stereo)
+    if carrier.channels != modulator.channels:
+        modulator = modulator.set_channels(carrier.channels)
     
     # Ensure both signals have same sample rate
     if carrier.frame_rate != modulator.frame_rate:
@@ -65,9 +122,12 @@ def apply_amplitude_modulation(carrier, modulator):
     carrier = carrier[:min_length]
     modulator = modulator[:min_length]
     
-    # Convert to numpy arrays
+    # Convert to numpy arrays (interleaved channels line up frame by frame)
     carrier_array = np.array(carrier.get_array_of_samples(), dtype=np.float32)
     mod_array = np.array(modulator.get_array_of_samples(), dtype=np.float32)
+    min_samples = min(len(carrier_array), len(mod_array))
+    carrier_array = carrier_array[:min_samples]
+    mod_array = mod_array[:min_samples]
     
     # Normalize modulator to 0-1 range
     if mod_array.max() != mod_array.min():
@@ -81,7 +141,7 @@ def apply_amplitude_modulation(carrier, modulator):
     # Convert back to AudioSegment
     modulated_int16 = np.clip(modulated, -32768, 32767).astype(np.int16)
     
-    return AudioSegment(
+    return audio_segment_class()(
         modulated_int16.tobytes(),
         frame_rate=carrier.frame_rate,
         sample_width=carrier.sample_width,
@@ -109,17 +169,17 @@ def apply_tremolo(audio, rate=7.83, depth=0.5):
     t = np.linspace(0, duration_ms / 1000.0, num_samples)
     lfo = 1 - depth + depth * np.sin(2 * np.pi * rate * t)
     
-    # Apply to audio
-    audio_array = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    # Apply to audio - one row per frame so every channel shares the LFO
+    audio_array = np.array(audio.get_array_of_samples(), dtype=np.float32).reshape(-1, audio.channels)
     
     # Match lengths
     min_len = min(len(audio_array), len(lfo))
-    tremolo_audio = audio_array[:min_len] * lfo[:min_len]
+    tremolo_audio = audio_array[:min_len] * lfo[:min_len, None]
     
     # Convert back to int16
     tremolo_int16 = np.clip(tremolo_audio, -32768, 32767).astype(np.int16)
     
-    return AudioSegment(
+    return audio_segment_class()(
         tremolo_int16.tobytes(),
         frame_rate=audio.frame_rate,
         sample_width=audio.sample_width,
@@ -127,149 +187,470 @@ def apply_tremolo(audio, rate=7.83, depth=0.5):
     )
 
 
-def generate_hybrid_uap_signal(music_file_path=None, duration_ms=10000, config=None, progress_callback=None):
+def segment_to_array(segment, channels):
     """
-    Generate hybrid multi-layer UAP contact signal
+    Convert an AudioSegment to a float32 (frames, channels) array in -1..1
+    
+    Mono sources are duplicated to every channel; multi-channel sources
+    are downmixed when a mono render is requested.
+    """
+    full_scale = float(1 << (8 * segment.sample_width - 1))
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    samples = samples.reshape(-1, segment.channels) / full_scale
+    
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1 or samples.shape[1] != 1:
+        samples = samples.mean(axis=1, keepdims=True)
+    return np.repeat(samples, channels, axis=1)
+
+
+def resample_audio(samples, orig_rate, target_rate):
+    """
+    Resample a (frames, channels) array with a polyphase FIR filter
+    
+    Uses the smallest integer up/down ratio (e.g. 160/147 for 44.1 -> 48 kHz),
+    which is far faster than pydub's sample-by-sample ``set_frame_rate``.
+    """
+    if orig_rate == target_rate:
+        return samples
+    from scipy.signal import resample_poly
+    divisor = gcd(int(orig_rate), int(target_rate))
+    up, down = int(target_rate) // divisor, int(orig_rate) // divisor
+    return resample_poly(samples, up, down, axis=0).astype(np.float32)
+
+
+def array_to_segment(buffer, sample_rate):
+    """Convert a float (frames, channels) array in -1..1 to a 16-bit AudioSegment"""
+    int16_buffer = np.clip(buffer * 32767.0, -32768, 32767).astype(np.int16)
+    return audio_segment_class()(
+        np.ascontiguousarray(int16_buffer).tobytes(),
+        frame_rate=sample_rate,
+        sample_width=2,
+        channels=buffer.shape[1]
+    )
+
+
+def encode_signal(signal, target, audio_format='mp3', parameters=()):
+    """
+    Encode a rendered AudioSegment
     
     Args:
-        music_file_path: Path to music file (optional)
-        duration_ms: Duration in milliseconds if no music file
-        config: Dictionary with tone configurations
-        progress_callback: Optional callback function(progress, message) for progress updates
+        signal: AudioSegment from generate_hybrid_uap_signal
+        target: Output path or writable binary file object
+        audio_format: 'mp3' (needs FFmpeg) or 'wav'
+        parameters: Extra FFmpeg output options
+    """
+    export_parameters = list(parameters)
+    if audio_format == 'mp3' and signal.frame_rate > MP3_MAX_SAMPLE_RATE:
+        export_parameters += ['-ar', str(MP3_MAX_SAMPLE_RATE)]
+    signal.export(target, format=audio_format, parameters=export_parameters or None)
+
+
+def build_hybrid_graph(config, has_music=False):
+    """
+    Express the built-in hybrid signal as a declarative layer graph
+    
+    Args:
+        config: Full configuration dictionary (DEFAULT_CONFIG merged with overrides)
+        has_music: Whether a music source is available
     
     Returns:
-        Tuple of (composite_signal, metadata)
+        Layer graph dictionary for signal_graph.compile_graph
     """
-    # Default configuration
-    if config is None:
-        config = {
-            'base_tone_freq': 100,
-            'schumann_freq': 7.83,
-            'dna_repair_freq': 528,
-            'ultrasonic_freq': 17000,
-            'chirp_freq': 2500,
-            'ambient_freq': 432,
-            'use_music_modulation': True,
-            'use_music_as_foundation': False,
-            'use_tremolo': True,
-            'tremolo_depth': 0.5
+    channels = int(config['channels'])
+    binaural_beat = float(config.get('binaural_beat_freq') or 0)
+    binaural = channels == 2 and binaural_beat > 0
+    layer_pan = config.get('layer_pan') or {}
+    disabled_layers = set(config.get('disabled_layers') or [])
+    use_tremolo = config['use_tremolo']
+    schumann_freq = config['schumann_freq']
+    music_as_foundation = bool(config.get('use_music_as_foundation')) and has_music
+    music_modulation = bool(config['use_music_modulation']) and has_music
+    
+    nodes = {}
+    
+    def tone(name, freq):
+        # Binaural layers get a phase-coherent pair split evenly around the tone
+        if binaural and name in config['binaural_layers']:
+            freq = [freq - binaural_beat / 2, freq + binaural_beat / 2]
+        nodes[f'{name}_osc'] = {'type': 'oscillator', 'freq': freq}
+        return f'{name}_osc'
+    
+    def layer(name, source, gain_db, modulators=()):
+        if modulators:
+            nodes[f'{name}_mod'] = {'type': 'multiply', 'inputs': [source, *modulators]}
+            source = f'{name}_mod'
+        nodes[name] = {
+            'type': 'gain', 'input': source, 'gain_db': gain_db,
+            'pan': layer_pan.get(name, 0.0), 'enabled': name not in disabled_layers
         }
+        return name
     
-    # Load music file if provided
-    if progress_callback:
-        progress_callback(5, 'Loading music file...')
+    def tremolo(depth):
+        if not use_tremolo:
+            return ()
+        node_id = f'tremolo_{int(round(depth * 100))}'
+        nodes[node_id] = {'type': 'lfo', 'rate': schumann_freq, 'depth': depth}
+        return (node_id,)
     
-    if music_file_path and os.path.exists(music_file_path):
-        music_file = AudioSegment.from_file(music_file_path)
-        music_duration = len(music_file)
-    else:
-        music_file = None
-        music_duration = duration_ms
+    if has_music:
+        nodes['music_source'] = {'type': 'music'}
+    music_envelope = ()
+    if music_modulation:
+        nodes['music_envelope'] = {'type': 'music', 'envelope': True}
+        music_envelope = ('music_envelope',)
     
-    if progress_callback:
-        progress_callback(15, 'Generating foundation layers...')
+    layers = []
     
     # LAYER 1: Foundation (Steady, Natural)
-    if config.get('use_music_as_foundation') and music_file:
+    if music_as_foundation:
         # Use music as the foundation layer - keep it prominent
-        base_tone = music_file.apply_gain(-3)
-        schumann_carrier = Sine(config['schumann_freq']).to_audio_segment(duration=music_duration).apply_gain(-18)
+        layers.append(layer('music_base', 'music_source', -3))
+        layers.append(layer('schumann_carrier', tone('schumann_carrier', schumann_freq), -18, tremolo(0.3)))
     else:
         # Use synthetic tones as foundation
-        base_tone = Sine(config['base_tone_freq']).to_audio_segment(duration=music_duration).apply_gain(-6)
-        schumann_carrier = Sine(config['schumann_freq']).to_audio_segment(duration=music_duration).apply_gain(-12)
+        layers.append(layer('base_tone', tone('base_tone', config['base_tone_freq']), -6))
+        layers.append(layer('schumann_carrier', tone('schumann_carrier', schumann_freq), -12, tremolo(0.3)))
     
-    # Apply slow tremolo to Schumann if enabled
-    if config['use_tremolo']:
-        schumann_carrier = apply_tremolo(schumann_carrier, rate=config['schumann_freq'], depth=0.3)
+    # LAYER 2: Human Enhancement (Music-Modulated)
+    # Music modulates DNA repair and ambient pad - showing human creativity
+    layers.append(layer('dna_repair_tone', tone('dna_repair_tone', config['dna_repair_freq']), -9, music_envelope))
+    layers.append(layer('ambient_pad', tone('ambient_pad', config['ambient_freq']), -9, music_envelope))
+    
+    # LAYER 3: Attention Signals (Pulsing/Organic) - a chirp every 2 s, a ping every 3.5 s
+    nodes['chirps_pulse'] = {
+        'type': 'pulse_train', 'freq': config['chirp_freq'], 'pulse_ms': 300, 'interval_ms': 2000,
+        'tremolo_rate': schumann_freq if use_tremolo else None, 'tremolo_depth': config['tremolo_depth']
+    }
+    layers.append(layer('chirps', 'chirps_pulse', -3))
+    nodes['ultrasonic_pulse'] = {
+        'type': 'pulse_train', 'freq': config['ultrasonic_freq'], 'pulse_ms': 500, 'interval_ms': 3500,
+        'fit_last': True  # Ensure last ping fits
+    }
+    layers.append(layer('ultrasonic_ping', 'ultrasonic_pulse', -3))
     
-    if progress_callback:
-        progress_callback(30, 'Creating human enhancement layers...')
+    # LAYER 4: Breath Layer (Life Indicator)
+    nodes['breath_noise'] = {'type': 'noise'}
+    nodes['breath_filtered'] = {'type': 'filter', 'input': 'breath_noise', 'cutoff': 300}
+    layers.append(layer('breath_layer', 'breath_filtered', -18, tremolo(0.4)))
     
-    # LAYER 2: Human Enhancement (Music-Modulated)
-    dna_repair_tone = Sine(config['dna_repair_freq']).to_audio_segment(duration=music_duration).apply_gain(-9)
-    ambient_pad = Sine(config['ambient_freq']).to_audio_segment(duration=music_duration).apply_gain(-9)
+    # Overlay music if present and not used as foundation
+    if has_music and not music_as_foundation:
+        layers.append(layer('music', 'music_source', -3))
     
-    if music_file and config['use_music_modulation']:
-        if progress_callback:
-            progress_callback(45, 'Applying music modulation...')
-        # Music modulates DNA repair and ambient pad - showing human creativity
-        dna_repair_tone = apply_amplitude_modulation(dna_repair_tone, music_file)
-        ambient_pad = apply_amplitude_modulation(ambient_pad, music_file)
+    nodes['mix'] = {'type': 'mix', 'inputs': layers}
+    return {'nodes': nodes, 'output': 'mix'}
+
+
+def _expect_render_work(profile, total_frames, channels, units_per_frame, mastering, work_frames=None):
+    """
+    Size the render stages in work units: synthesis scales with samples x plan size, the audio passes with samples x channels
+
+    ``work_frames`` is the number of frames actually synthesized and mastered
+    when it differs from the output length (looped renders).
+    """
+    work_frames = total_frames if work_frames is None else work_frames
+    profile.expect(
+        audio_units=total_frames * channels,
+        render=work_frames * units_per_frame,
+        mastering=work_frames * channels if mastering else 0,
+        finalize=total_frames * channels
+    )
+
+
+def _expect_provisional_work(profile, config, duration_ms, music_bytes, music_ms=None):
+    """Size every stage before the music is decoded and the plan compiled"""
+    sample_rate, channels = int(config['sample_rate']), int(config['channels'])
+    profile.expect(load_music=music_bytes, compile_plan=1)
+    if music_ms is not None:
+        estimated_frames = int(sample_rate * music_ms / 1000.0)
+    elif music_bytes:
+        estimated_frames = int(sample_rate * music_bytes / MUSIC_BYTES_PER_SECOND)
+    else:
+        estimated_frames = int(sample_rate * (duration_ms / 1000.0))
+    _expect_render_work(profile, estimated_frames, channels, TYPICAL_UNITS_PER_FRAME, bool(config.get('mastering')))
+
+
+def estimate_render_seconds(duration_ms=10000, config=None, music_bytes=0, music_ms=None, trailing_stages=()):
+    """
+    Predict how long a render will take, from measured stage throughput
     
-    if progress_callback:
-        progress_callback(60, 'Generating attention signals...')
+    Args:
+        duration_ms: Duration in milliseconds if no music file
+        config: Dictionary with tone configurations (merged over DEFAULT_CONFIG)
+        music_bytes: Size of the encoded music file in bytes (0 if none or already decoded)
+        music_ms: Duration of already-decoded music (e.g. a MusicStore track), if known
+        trailing_stages: Caller stages after generation to include (e.g. 'encode')
     
-    # LAYER 3: Attention Signals (Pulsing/Organic)
-    ultrasonic_ping = Sine(config['ultrasonic_freq']).to_audio_segment(duration=500).apply_gain(-3)
-    chirps = Sine(config['chirp_freq']).to_audio_segment(duration=300).apply_gain(-3)
+    Returns:
+        Estimated wall time in seconds
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    profile = RenderProfile(trailing_stages=trailing_stages)
+    _expect_provisional_work(profile, config, duration_ms, music_bytes, music_ms)
+    return profile.predicted_seconds()
+
+
+def validate_output_format(config):
+    """
+    Check a configuration's sample rate and channel count
     
-    # Apply tremolo to chirps
-    if config['use_tremolo']:
-        chirps = apply_tremolo(chirps, rate=config['schumann_freq'], depth=config['tremolo_depth'])
+    Args:
+        config: Configuration overrides (missing keys fall back to DEFAULT_CONFIG)
     
-    # Create chirp sequence - repeat throughout the duration
-    chirp_sequence = AudioSegment.silent(duration=music_duration)
-    chirp_interval = 2000  # Place a chirp every 2 seconds
-    position = 0
-    while position < music_duration:
-        chirp_sequence = chirp_sequence.overlay(chirps, position=position)
-        position += chirp_interval
+    Returns:
+        Tuple of (sample_rate, channels)
     
-    if progress_callback:
-        progress_callback(70, 'Creating life indicator layer...')
+    Raises:
+        ValueError: If either is unsupported (the message names which)
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    try:
+        sample_rate, channels = int(config['sample_rate']), int(config['channels'])
+    except (TypeError, ValueError):
+        raise ValueError('Sample rate and channels must be integers')
+    if sample_rate not in SUPPORTED_SAMPLE_RATES:
+        raise ValueError(f"Unsupported sample rate: {sample_rate}")
+    if channels not in SUPPORTED_CHANNELS:
+        raise ValueError(f"Unsupported channel count: {channels}")
+    return sample_rate, channels
+
+
+class RenderCancelled(Exception):
+    """Raised inside a render when its cancel event is set"""
+
+
+def generate_hybrid_uap_signal(music_file_path=None, duration_ms=10000, config=None, progress_callback=None,
+                               profile=None, cancel_event=None, music_source=None):
+    """
+    Generate hybrid multi-layer UAP contact signal
     
-    # LAYER 4: Breath Layer (Life Indicator)
-    breath_layer = low_pass_filter(
-        WhiteNoise().to_audio_segment(duration=music_duration),
-        cutoff=300
-    ).apply_gain(-18)
-    
-    if config['use_tremolo']:
-        breath_layer = apply_tremolo(breath_layer, rate=config['schumann_freq'], depth=0.4)
-    
-    # Create ultrasonic ping sequence - repeat throughout the duration
-    ultrasonic_sequence = AudioSegment.silent(duration=music_duration)
-    ping_interval = 3500  # Place an ultrasonic ping every 3.5 seconds
-    position = 0
-    while position < music_duration - 500:  # Ensure last ping fits
-        ultrasonic_sequence = ultrasonic_sequence.overlay(ultrasonic_ping, position=position)
-        position += ping_interval
-    
-    if progress_callback:
-        progress_callback(80, 'Mixing all signal layers...')
-    
-    # Combine all layers
-    composite_signal = base_tone.overlay(schumann_carrier)
-    composite_signal = composite_signal.overlay(dna_repair_tone)
-    composite_signal = composite_signal.overlay(ambient_pad)
-    composite_signal = composite_signal.overlay(breath_layer)
-    composite_signal = composite_signal.overlay(chirp_sequence)
-    composite_signal = composite_signal.overlay(ultrasonic_sequence)
+    The signal is described as a layer graph (the built-in hybrid design,
+    or a custom ``config['graph']``), compiled into a cached render plan and
+    rendered block by block into a (frames, channels) mix buffer.
     
-    # Overlay music if present and not used as foundation
-    if music_file and not config.get('use_music_as_foundation'):
-        composite_signal = composite_signal.overlay(music_file.apply_gain(-3))
+    Args:
+        music_file_path: Path to music file (optional)
+        duration_ms: Duration in milliseconds if no music file
+        config: Dictionary with tone configurations (merged over DEFAULT_CONFIG)
+        progress_callback: Optional callback function(progress, message) for progress updates;
+            progress is estimated from the plan's work units and measured stage throughput
+        profile: Optional RenderProfile collecting per-stage spans and progress estimates
+            (a new one is used if omitted)
+        cancel_event: Optional threading.Event; once set, the render stops at the next
+            checkpoint (every stage boundary and every mixing/limiter block)
+        music_source: Optional already-decoded music (e.g. a memory-mapped MusicStore track)
+            with ``samples`` (frames, channels), ``sample_rate`` and ``duration_ms``; used
+            instead of music_file_path and read block by block without copying
+    
+    Returns:
+        Tuple of (composite_signal, metadata)
     
-    if progress_callback:
-        progress_callback(95, 'Finalizing signal...')
+    Raises:
+        RenderCancelled: If cancel_event was set during the render
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    sample_rate, channels = validate_output_format(config)
+    profile = profile or RenderProfile()
+    
+    def report(message):
+        # Every progress report doubles as a cancellation checkpoint
+        if cancel_event is not None and cancel_event.is_set():
+            raise RenderCancelled('Render cancelled')
+        if progress_callback:
+            progress_callback(profile.progress()['progress'], message)
+    
+    # Load music file if provided
+    has_music_file = music_source is None and bool(music_file_path and os.path.exists(music_file_path))
+    mastering = bool(config.get('mastering'))
+    if music_source is not None:
+        # Decoded sources only cost load time when they need resampling
+        resample_bytes = music_source.samples.nbytes if music_source.sample_rate != sample_rate else 0
+        _expect_provisional_work(profile, config, duration_ms, resample_bytes, music_source.duration_ms)
+    else:
+        _expect_provisional_work(profile, config, duration_ms,
+                                 os.path.getsize(music_file_path) if has_music_file else 0)
+    report('Loading music file...')
+    
+    music = None
+    with profile.span('load_music') as span:
+        if music_source is not None:
+            # Matching sources stay memory-mapped; the renderer adapts channels per block
+            music = music_source.samples
+            if music_source.sample_rate != sample_rate:
+                music = resample_audio(np.asarray(music), music_source.sample_rate, sample_rate)
+                span['music_buffer_bytes'] = music.nbytes
+            music_duration = music_source.duration_ms
+            total_frames = len(music)
+        elif has_music_file:
+            music_file = audio_segment_class().from_file(music_file_path)
+            music = resample_audio(segment_to_array(music_file, channels), music_file.frame_rate, sample_rate)
+            music_duration = len(music_file)
+            total_frames = len(music)
+            span['music_buffer_bytes'] = music.nbytes
+        else:
+            music_duration = duration_ms
+            total_frames = int(sample_rate * (duration_ms / 1000.0))
+    
+    report('Compiling signal layers...')
+    
+    custom_graph = config.get('graph')
+    with profile.span('compile_plan') as span:
+        graph = custom_graph or build_hybrid_graph(config, has_music=music is not None)
+        plan = compile_graph(
+            graph, sample_rate, channels, has_music=music is not None,
+            min_audible_freq=float(config['min_audible_freq'])
+        )
+        renderer = plan.renderer(total_frames, music=music)
+        span.update({'steps': len(plan.steps), 'layers': len(plan.layers)})
+    
+    music_as_foundation = bool(config.get('use_music_as_foundation')) and music is not None
+    music_modulation = bool(config['use_music_modulation']) and music is not None
+    
+    # Mix all layers block by block into a (frames, channels) buffer,
+    # metering loudness as each block completes
+    meter = LoudnessMeter(sample_rate, channels) if mastering else None
+    
+    units_per_frame = len(plan.steps) + len(plan.layers)
+    profile.samples_total = total_frames
+    period = loop_period(plan, total_frames) if config.get('loop_synthesis') and music is None else None
+    work_frames = loop_work_frames(plan, total_frames, period) if period else total_frames
+    _expect_render_work(profile, total_frames, channels, units_per_frame, mastering, work_frames)
+    slices = [] if period else plan_slices(total_frames, sample_rate, RENDER_BLOCK_FRAMES)
+    loop_info = None
+    with profile.span('render', units=work_frames * units_per_frame) as span:
+        if period:
+            # Music-free designs repeat: render one period and tile it
+            def loop_progress(num_frames):
+                profile.advance(num_frames * units_per_frame, samples=num_frames)
+                report('Mixing all signal layers...')
+            
+            mix, loop_info = render_loop(plan, total_frames, period, RENDER_BLOCK_FRAMES, on_block=loop_progress)
+            if meter:
+                # A periodic programme's loudness is the loudness of one period
+                meter_loop(meter, loop_info, RENDER_BLOCK_FRAMES)
+            profile.advance(0, samples=total_frames - profile.samples_rendered)
+            span.update({'loop_period_frames': period, 'loop_tail_frames': total_frames - loop_info['tail_start']})
+        elif slices:
+            mix = np.zeros((total_frames, channels), dtype=np.float32)
+            # Long timelines render as slices on worker processes, assembled here in order; one
+            # fresh seed per render keeps unseeded noise continuous across the slices
+            parts = render_sliced(plan, total_frames, slices, RENDER_BLOCK_FRAMES, music=music,
+                                  music_range=renderer.music_range, stats=renderer,
+                                  noise_seed=int(np.random.SeedSequence().entropy))
+            try:
+                for start, part in parts:
+                    block = mix[start:start + len(part)]
+                    block += part
+                    if meter:
+                        for offset in range(0, len(block), RENDER_BLOCK_FRAMES):
+                            meter.add(block[offset:offset + RENDER_BLOCK_FRAMES])
+                    
+                    profile.advance(len(part) * units_per_frame, samples=len(part))
+                    report('Mixing all signal layers...')
+            finally:
+                parts.close()
+            span['slices'] = len(slices)
+        else:
+            mix = np.zeros((total_frames, channels), dtype=np.float32)
+            for start in range(0, total_frames, RENDER_BLOCK_FRAMES):
+                num_frames = min(RENDER_BLOCK_FRAMES, total_frames - start)
+                block = mix[start:start + num_frames]
+                block += renderer.render_block(start, num_frames)
+                if meter:
+                    meter.add(block)
+                
+                profile.advance(num_frames * units_per_frame, samples=num_frames)
+                report('Mixing all signal layers...')
+        span.update({
+            'frames': total_frames,
+            'blocks': -(-total_frames // RENDER_BLOCK_FRAMES),
+            'block_frames': RENDER_BLOCK_FRAMES,
+            'mix_buffer_bytes': mix.nbytes,
+            'op_seconds': {op: round(seconds, 6) for op, seconds in renderer.op_seconds.items()},
+            # CPU time of render pool threads and slice workers, added to the span's cpu_s
+            'offloaded_cpu_s': renderer.offloaded_cpu_s + (loop_info['offloaded_cpu_s'] if loop_info else 0.0)
+        })
+    
+    mastering_info = {'enabled': mastering}
+    if mastering:
+        report('Mastering (loudness & true-peak limiting)...')
+        
+        def limiter_progress(num_frames):
+            profile.advance(num_frames * channels)
+            report('Mastering (loudness & true-peak limiting)...')
+        
+        with profile.span('mastering', units=work_frames * channels):
+            measured_lufs = meter.integrated_loudness()
+            gain_db = normalization_gain_db(measured_lufs, config['target_lufs'])
+            if loop_info:
+                limiter_reduction_db = limit_looped(
+                    mix, loop_info, sample_rate, ceiling_db=config['true_peak_db'], gain=db_to_gain(gain_db)
+                )
+                limiter_progress(work_frames)
+            else:
+                limiter_reduction_db = limit_true_peak(
+                    mix, sample_rate, ceiling_db=config['true_peak_db'], gain=db_to_gain(gain_db),
+                    on_block=limiter_progress
+                )
+        mastering_info.update({
+            'measured_lufs': round(measured_lufs, 2) if np.isfinite(measured_lufs) else None,
+            'target_lufs': config['target_lufs'],
+            'normalization_gain_db': round(gain_db, 2),
+            'true_peak_ceiling_db': config['true_peak_db'],
+            'limiter_max_reduction_db': round(limiter_reduction_db, 2)
+        })
+    
+    report('Finalizing signal...')
+    
+    with profile.span('finalize') as span:
+        composite_signal = array_to_segment(mix, sample_rate)
+        span['segment_bytes'] = len(composite_signal.raw_data)
     
     # Metadata
-    foundation_layers = ['music_base', 'schumann_carrier'] if config.get('use_music_as_foundation') and music_file else ['base_tone', 'schumann_carrier']
-    metadata = {
-        'duration_ms': music_duration,
-        'layers': {
+    if custom_graph:
+        layer_groups = {'custom': plan.layer_names}
+    else:
+        foundation_layers = ['music_base', 'schumann_carrier'] if music_as_foundation else ['base_tone', 'schumann_carrier']
+        layer_groups = {
             'foundation': foundation_layers,
             'human_enhancement': ['dna_repair_tone', 'ambient_pad'],
             'attention': ['chirps', 'ultrasonic_ping'],
             'life_indicator': ['breath_layer']
+        }
+        # Only layers that were mixed: pruned and disabled ones are listed in pruned_layers instead
+        mixed = set(plan.layer_names)
+        layer_groups = {group: [name for name in names if name in mixed] for group, names in layer_groups.items()}
+    binaural_layers = [
+        node_id for node_id, node in graph['nodes'].items()
+        if node.get('type') == 'oscillator' and isinstance(node.get('freq'), list)
+    ]
+    metadata = {
+        'duration_ms': music_duration,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'layers': layer_groups,
+        'render_plan': {
+            'key': plan.key,
+            'steps': len(plan.steps),
+            'layers': plan.layer_names,
+            'loop_period_s': round(period / sample_rate, 3) if period else None
         },
+        'pruned_layers': plan.pruned,
         'modulation': {
-            'music_modulation': config['use_music_modulation'] and music_file is not None,
+            'music_modulation': music_modulation,
             'music_as_foundation': config.get('use_music_as_foundation', False),
             'tremolo': config['use_tremolo'],
             'tremolo_rate': config['schumann_freq']
-        }
+        },
+        'mastering': mastering_info,
+        'binaural': {
+            'enabled': bool(binaural_layers),
+            'beat_freq': float(config.get('binaural_beat_freq') or 0) if binaural_layers else 0,
+            'layers': [node_id[:-len('_osc')] if node_id.endswith('_osc') else node_id for node_id in binaural_layers]
+        },
+        'profile': profile.as_dict()
     }
     
     return composite_signal, metadata
@@ -277,7 +658,8 @@ def generate_hybrid_uap_signal(music_file_path=None, duration_ms=10000, config=N
 
 if __name__ == "__main__":
     # Example usage - generate signal without music
-    # To use music, provide path to your audio file or use the web dashboard
+    # To use music, provide path to your audio file or use the web dashboard;
+    # for bulk or offline renders use batch_render.py
     
     signal, meta = generate_hybrid_uap_signal(duration_ms=10000)
     
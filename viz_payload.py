@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+UAP Visualization Payloads
+Compact encodings of waveform and spectrum data for the API
+
+A finished render carries a 1000-point waveform and a 512-bin spectrum.
+As JSON float lists they cost around 40 KB per result. Quantized they
+take under 3 KB, with errors far below a pixel on the dashboard canvases:
+the waveform (-1..1) as int8, spectrum magnitudes (0..1) and frequencies
+as uint16. Each array is sent with a ``scale`` and an ``offset``, and a
+value is ``q * scale + offset``.
+
+Two encodings are offered. ``base64`` is JSON-friendly and is what the
+progress stream embeds in its final event. ``binary`` is a single buffer
+for ``fetch().arrayBuffer()``:
+
+    b'UAPV' | uint32 LE header length | JSON header | arrays
+
+The header lists every array's dtype, count, scale, offset and
+``byte_offset`` (counted from the end of the header). The header is
+padded and the arrays aligned to 4 bytes, so each array can be viewed in
+place as a typed array.
+"""
+import base64
+import json
+import struct
+
+import numpy as np
+
+BINARY_MAGIC = b'UAPV'
+BINARY_VERSION = 1
+JSON_DECIMALS = 4  # Precision of float lists in plain JSON responses
+
+
+def quantize(values, dtype):
+    """
+    Quantize floats to an integer dtype over their own range
+
+    Signed types are symmetric around zero (offset 0); unsigned types span [min, max].
+
+    Returns:
+        (integer array, scale, offset) with values ~= q * scale + offset
+    """
+    values = np.asarray(values, dtype=np.float64)
+    info = np.iinfo(dtype)
+    if not len(values):
+        return np.zeros(0, dtype=dtype), 1.0, 0.0
+    if info.min < 0:
+        offset = 0.0
+        span = float(np.abs(values).max())
+        scale = span / info.max if span else 1.0
+    else:
+        offset = float(values.min())
+        span = float(values.max()) - offset
+        scale = span / info.max if span else 1.0
+    quantized = np.clip(np.round((values - offset) / scale), info.min, info.max).astype(dtype)
+    return quantized, scale, offset
+
+
+def visualization_arrays(result):
+    """Quantized visualization arrays of a task result: {name: (array, scale, offset)}"""
+    fft = result.get('fft') or {}
+    return {
+        'waveform': quantize(result.get('waveform') or [], np.int8),
+        'fft_frequencies': quantize(fft.get('frequencies') or [], np.uint16),
+        'fft_magnitudes': quantize(fft.get('magnitudes') or [], np.uint16)
+    }
+
+
+def _describe(array, scale, offset):
+    return {'dtype': array.dtype.name, 'count': len(array), 'scale': scale, 'offset': offset}
+
+
+def encode_base64(result):
+    """Visualization data as JSON-friendly base64 arrays"""
+    arrays = {}
+    for name, (array, scale, offset) in visualization_arrays(result).items():
+        arrays[name] = {**_describe(array, scale, offset),
+                        'data': base64.b64encode(array.astype(array.dtype.newbyteorder('<')).tobytes()).decode('ascii')}
+    return {'encoding': 'base64', 'version': BINARY_VERSION, 'duration_ms': result.get('duration_ms'),
+            'arrays': arrays}
+
+
+def encode_binary(result):
+    """Visualization data as one binary buffer (see the module docstring for the layout)"""
+    arrays, chunks, position = {}, [], 0
+    for name, (array, scale, offset) in visualization_arrays(result).items():
+        data = array.astype(array.dtype.newbyteorder('<')).tobytes()
+        arrays[name] = {**_describe(array, scale, offset), 'byte_offset': position}
+        padding = -len(data) % 4
+        chunks.append(data + b'\0' * padding)
+        position += len(data) + padding
+
+    header = json.dumps({'version': BINARY_VERSION, 'duration_ms': result.get('duration_ms'), 'arrays': arrays},
+                        separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(len(BINARY_MAGIC) + 4 + len(header)) % 4)
+    return BINARY_MAGIC + struct.pack('<I', len(header)) + header + b''.join(chunks)
+
+
+def round_floats(values, decimals=JSON_DECIMALS):
+    """Float list rounded for plain JSON (full float repr roughly triples the payload)"""
+    return np.round(np.asarray(values, dtype=np.float64), decimals).tolist()
+
+
+def encode_json(result):
+    """Visualization data as plain (rounded) float lists, in the original result layout"""
+    fft = result.get('fft') or {}
+    return {'waveform': round_floats(result.get('waveform') or []),
+            'fft': {name: round_floats(values) for name, values in fft.items()}}
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+UAP YouTube Ingestion
+Background, deduplicated YouTube audio ingestion into the music store
+
+Downloads run on a small worker pool instead of the request thread. yt-dlp
+progress hooks feed a per-job progress record that the app streams over
+SSE, and concurrent requests for the same video join the job already in
+flight instead of downloading it twice. The best audio stream is fetched
+as-is (no MP3 post-processing) and decoded by FFmpeg straight into the
+store's PCM form.
+
+The extractor is pluggable: ``YtDlpExtractor`` talks to YouTube, while
+``LocalExtractor`` serves files from a local directory with the same
+progress hooks, so the whole pipeline can be exercised without network
+access (``YOUTUBE_EXTRACTOR=local:/path/to/dir``).
+"""
+import glob
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from uap_signal_generator import DEFAULT_SAMPLE_RATE
+
+DOWNLOAD_PROGRESS_SHARE = 85  # Percent of the bar covered by the download; decoding fills the rest
+FINISHED_JOB_TTL_S = 600  # Finished jobs stay queryable this long
+LOCAL_CHUNK_BYTES = 256 * 1024
+
+
+class IngestJob:
+    """One YouTube ingestion, shared by every request for the same video"""
+
+    def __init__(self, video_id, url, name):
+        self.job_id = str(uuid.uuid4())
+        self.video_id = video_id
+        self.url = url
+        self.name = name
+        self.status = 'queued'
+        self.progress = 0
+        self.message = 'Waiting for a download slot...'
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.eta_s = None
+        self.result = None
+        self.error = None
+        self.finished = None
+
+    def snapshot(self):
+        """JSON-serializable state for SSE and polling"""
+        return {
+            'job_id': self.job_id,
+            'video_id': self.video_id,
+            'filename': self.name,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'eta_s': self.eta_s,
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class YtDlpExtractor:
+    """
+    Downloads the best audio stream with yt-dlp, without post-processing
+
+    Args:
+        options: Extra YoutubeDL options (cookies, extractor args, ...), or a
+            zero-argument callable returning them for each download
+    """
+
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def extract(self, video_id, url, output_dir, progress_hook):
+        """
+        Download one video's audio
+
+        Returns:
+            (path of the downloaded audio file, title)
+        """
+        import yt_dlp
+
+        options = dict(self.options() if callable(self.options) else self.options)
+        options.update({
+            'format': 'bestaudio/best',
+            'outtmpl': os.path.join(output_dir, f'{video_id}.%(ext)s'),
+            'progress_hooks': [progress_hook],
+            'noprogress': True
+        })
+        options.pop('postprocessors', None)
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=True)
+            downloads = info.get('requested_downloads') or []
+            path = downloads[0].get('filepath') if downloads else None
+            return path or ydl.prepare_filename(info), info.get('title', 'Unknown')
+
+
+class LocalExtractor:
+    """
+    Stand-in extractor serving ``<directory>/<video_id>.<ext>`` files
+
+    Copies the file in chunks and reports yt-dlp-shaped progress, so the
+    ingestion pipeline (progress, dedup, decoding) can run without network.
+
+    Args:
+        directory: Folder holding one audio file per video ID
+        chunk_delay_s: Pause after each chunk, to simulate a slow download
+    """
+
+    def __init__(self, directory, chunk_delay_s=0.0):
+        self.directory = directory
+        self.chunk_delay_s = chunk_delay_s
+
+    def extract(self, video_id, url, output_dir, progress_hook):
+        matches = sorted(glob.glob(os.path.join(glob.escape(self.directory), glob.escape(video_id) + '.*')))
+        if not matches:
+            raise FileNotFoundError(f'No local audio for video {video_id}')
+        source = matches[0]
+        target = os.path.join(output_dir, os.path.basename(source))
+        total = os.path.getsize(source)
+        downloaded = 0
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            while True:
+                chunk = src.read(LOCAL_CHUNK_BYTES)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                downloaded += len(chunk)
+                progress_hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total})
+                if self.chunk_delay_s:
+                    time.sleep(self.chunk_delay_s)
+        progress_hook({'status': 'finished', 'downloaded_bytes': downloaded, 'total_bytes': total, 'filename': target})
+        return target, video_id
+
+
+def make_extractor(spec, ytdlp_options=None):
+    """
+    Build an extractor from a YOUTUBE_EXTRACTOR setting
+
+    Args:
+        spec: 'yt-dlp' (default) or 'local:<directory>'
+        ytdlp_options: Options (or options callable) for the yt-dlp extractor
+    """
+    spec = (spec or 'yt-dlp').strip()
+    if spec.startswith('local:'):
+        return LocalExtractor(spec[len('local:'):])
+    if spec != 'yt-dlp':
+        raise ValueError(f'Unknown YouTube extractor: {spec}')
+    return YtDlpExtractor(ytdlp_options)
+
+
+class YouTubeIngestor:
+    """
+    Worker pool turning YouTube videos into music store tracks
+
+    Args:
+        store: MusicStore receiving the decoded tracks
+        extractor: Object with ``extract(video_id, url, output_dir, progress_hook)``
+        workers: Concurrent downloads
+        sample_rate: Rate of the stored PCM (the default render rate avoids resampling)
+        channels: Channel count of the stored PCM
+        work_dir: Parent folder for temporary downloads (defaults to the system temp dir)
+    """
+
+    def __init__(self, store, extractor, workers=2, sample_rate=DEFAULT_SAMPLE_RATE, channels=2, work_dir=None):
+        self.store = store
+        self.extractor = extractor
+        self.workers = workers
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.work_dir = work_dir
+        self._jobs = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='youtube-ingest')
+
+    def submit(self, video_id, url, name):
+        """
+        Start ingesting a video, or join the job already running for it
+
+        Returns:
+            (IngestJob, deduplicated) where deduplicated is True if an
+            in-flight job for the same video was reused
+        """
+        with self._lock:
+            self._prune()
+            job = self._in_flight.get(video_id)
+            if job:
+                return job, True
+            job = IngestJob(video_id, url, name)
+            self._jobs[job.job_id] = job
+            self._in_flight[video_id] = job
+        self._executor.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'in_flight': len(self._in_flight)}
+
+    def _prune(self):
+        cutoff = time.monotonic() - FINISHED_JOB_TTL_S
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _progress_hook(self, job):
+        def hook(status):
+            if status.get('status') != 'downloading':
+                return
+            downloaded = status.get('downloaded_bytes') or 0
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            job.downloaded_bytes = downloaded
+            job.total_bytes = total
+            job.eta_s = status.get('eta')
+            if total:
+                job.progress = min(DOWNLOAD_PROGRESS_SHARE, int(DOWNLOAD_PROGRESS_SHARE * downloaded / total))
+                job.message = f'Downloading audio... ({downloaded / 1e6:.1f} / {total / 1e6:.1f} MB)'
+            else:
+                job.message = f'Downloading audio... ({downloaded / 1e6:.1f} MB)'
+        return hook
+
+    def _run(self, job):
+        work_dir = tempfile.mkdtemp(prefix='uap_youtube_', dir=self.work_dir)
+        try:
+            job.status = 'downloading'
+            job.message = 'Downloading audio...'
+            path, title = self.extractor.extract(job.video_id, job.url, work_dir, self._progress_hook(job))
+
+            job.status = 'decoding'
+            job.progress = DOWNLOAD_PROGRESS_SHARE
+            job.eta_s = None
+            job.message = 'Decoding audio...'
+            track = self.store.add_file(job.name, path, self.sample_rate, self.channels,
+                                        source='youtube', title=title, video_id=job.video_id)
+            job.result = {
+                'filename': job.name,
+                'title': title,
+                'duration_ms': track['duration_ms'],
+                'duration_seconds': track['duration_ms'] / 1000
+            }
+            job.progress = 100
+            job.message = 'Audio ready'
+            job.status = 'completed'
+            print(f"[YOUTUBE] Ingested {job.video_id} ({track['duration_ms']} ms)")
+        except Exception as e:
+            job.error = str(e)
+            job.message = 'Download failed'
+            job.status = 'error'
+            print(f"[YOUTUBE] Ingestion of {job.video_id} failed: {e}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            with self._lock:
+                job.finished = time.monotonic()
+                self._in_flight.pop(job.video_id, None)